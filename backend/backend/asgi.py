@@ -11,6 +11,14 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from utils import solver_pool
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
+# Serve the asynchronous versions of the API endpoints
+os.environ.setdefault('ASYNC_VIEWS', 'True')
+
 application = get_asgi_application()
+
+# Start the solver pool's worker processes before the first request arrives
+solver_pool.start()
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tourguide.middleware.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,6 +59,10 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'backend.urls'
 
+# Serve the asynchronous versions of the API endpoints; enabled by default
+# under ASGI (see asgi.py)
+ASYNC_VIEWS = env.bool("ASYNC_VIEWS", default=False)
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -92,6 +97,118 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.1/ref/settings/#caches
+
+# Distance matrices, solved tours, and tour responses are kept in
+# local memory by default; set DISTANCE_CACHE_BACKEND, SOLUTION_CACHE_BACKEND,
+# or RESPONSE_CACHE_BACKEND to "file" to share them between processes on disk
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'distances': {
+        'BACKEND': CACHE_BACKENDS[env("DISTANCE_CACHE_BACKEND", default="locmem")],
+        'LOCATION': env("DISTANCE_CACHE_LOCATION", default=str(BASE_DIR / "distance_cache")),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            # eviction is normally driven by DISTANCE_CACHE_MAX_BYTES instead
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'solutions': {
+        'BACKEND': CACHE_BACKENDS[env("SOLUTION_CACHE_BACKEND", default="locmem")],
+        'LOCATION': env("SOLUTION_CACHE_LOCATION", default=str(BASE_DIR / "solution_cache")),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            # least recently used solutions are evicted past this many
+            'MAX_ENTRIES': env.int("SOLUTION_CACHE_MAX_ENTRIES", default=10000),
+        },
+    },
+    # Serialized `get_tour` responses; use a backend that is shared between
+    # server processes when running more than one
+    'responses': {
+        'BACKEND': CACHE_BACKENDS[env("RESPONSE_CACHE_BACKEND", default="locmem")],
+        'LOCATION': env("RESPONSE_CACHE_LOCATION", default=str(BASE_DIR / "response_cache")),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': env.int("RESPONSE_CACHE_MAX_ENTRIES", default=10000),
+        },
+    },
+}
+
+# Memory budget for cached distance matrices, in bytes
+DISTANCE_CACHE_MAX_BYTES = env.int("DISTANCE_CACHE_MAX_BYTES", default=256 * 1024 * 1024)
+
+
+# Tour calculation
+# Milliseconds that calculating a tour may take when a request does not give a
+# time budget, and the largest budget a request may give
+TOUR_TIME_BUDGET_MS = env.float("TOUR_TIME_BUDGET_MS", default=1000.0)
+MAX_TIME_BUDGET_MS = env.float("MAX_TIME_BUDGET_MS", default=10000.0)
+
+
+# Background solves
+# Job statuses are stored in the default cache, so it must be shared between
+# server processes (e.g., Redis or Memcached) for any of them to report on a job.
+# Number of worker processes that improve large tours in the background; set
+# to 0 to solve every tour within its request
+SOLVER_WORKERS = env.int("SOLVER_WORKERS", default=2)
+# Tours with more locations than this are improved in the background after
+# each edit, and seconds that each background solve may take
+SOLVER_POOL_CUTOFF = env.int("SOLVER_POOL_CUTOFF", default=100)
+SOLVER_TIME_BUDGET = env.float("SOLVER_TIME_BUDGET", default=5.0)
+
+
+# Tour imports
+# Largest number of locations that can be imported into a tour at once
+IMPORT_MAX_LOCATIONS = env.int("IMPORT_MAX_LOCATIONS", default=2000)
+
+
+# Request timing
+# Fraction of requests whose phases are timed, with the results sent in a
+# Server-Timing header and logged at INFO level to the "tourguide.timing"
+# logger; timing every request costs little, but a small fraction is enough in
+# production. The logger only writes to the console if TIMING_LOG_LEVEL is set
+# to INFO or lower.
+TIMING_SAMPLE_RATE = env.float("TIMING_SAMPLE_RATE", default=1.0 if env.bool("DEBUG") else 0.01)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'tourguide.timing': {
+            'handlers': ['console'],
+            'level': env("TIMING_LOG_LEVEL", default="WARNING"),
+            'propagate': False,
+        },
+    },
+}
+
+
+# Geocoding
+# Backend used to search for locations ("nominatim", "offline", or "local"),
+# and the SQLite database that caches search results; set GEOCODER_CACHE_PATH
+# to an empty string to disable caching
+GEOCODER_BACKEND = env("GEOCODER_BACKEND", default="nominatim")
+# Place index used by the offline backend, built with `manage.py build_place_index`
+GEOCODER_PLACE_INDEX = env("GEOCODER_PLACE_INDEX", default=str(BASE_DIR / "place_index"))
+GEOCODER_CACHE_PATH = env("GEOCODER_CACHE_PATH", default=str(BASE_DIR / "geocode_cache.sqlite3")) or None
+GEOCODER_CACHE_TTL = env.int("GEOCODER_CACHE_TTL", default=7 * 24 * 60 * 60)
+GEOCODER_CACHE_MAX_ENTRIES = env.int("GEOCODER_CACHE_MAX_ENTRIES", default=100000)
+GEOCODER_TIMEOUT = env.float("GEOCODER_TIMEOUT", default=5.0)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -14,6 +14,7 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
@@ -23,14 +24,27 @@ router = routers.DefaultRouter()
 router.register(r"locations", views.LocationView, 'Locations')  # TODO: remove
 router.register(r"tours", views.TourView, 'Tours')
 
+
+def endpoint(name):
+    """ Get an API endpoint by name, or its asynchronous version (prefixed with
+        `a`) if ASYNC_VIEWS is set """
+    return getattr(views, f"a{name}" if settings.ASYNC_VIEWS else name)
+
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
-    path('api/get_tour/<int:tour_id>/', views.get_tour, name='get_tour'),
-    path('api/delete_tour/<int:tour_id>/', views.delete_tour, name='delete_tour'),
-    path('api/add_to_tour/', views.add_to_tour, name='add_to_tour'),
-    path('api/remove_from_tour/', views.remove_from_tour, name='remove_from_tour'),
-    path('api/search/<str:query>/', views.search_location, name='search'),
-    path('api/add_location/', views.add_location, name='add_location'),
-    path('api/create_tour/', views.create_tour, name='create_tour'),
+    path('api/get_tour/<int:tour_id>/', endpoint("get_tour"), name='get_tour'),
+    path('api/delete_tour/<int:tour_id>/', endpoint("delete_tour"), name='delete_tour'),
+    path('api/delete_tours/', endpoint("delete_tours"), name='delete_tours'),
+    path('api/add_to_tour/', endpoint("add_to_tour"), name='add_to_tour'),
+    path('api/remove_from_tour/', endpoint("remove_from_tour"), name='remove_from_tour'),
+    path('api/solve_tour/', endpoint("solve_tour"), name='solve_tour'),
+    path('api/solver_job/<str:job_id>/', endpoint("solver_job"), name='solver_job'),
+    path('api/search/<str:query>/', endpoint("search_location"), name='search'),
+    path('api/add_location/', endpoint("add_location"), name='add_location'),
+    path('api/create_tour/', endpoint("create_tour"), name='create_tour'),
+    path('api/import_tour/', endpoint("import_tour"), name='import_tour'),
+    path('api/distance_cache_stats/', views.distance_cache_stats, name='distance_cache_stats'),
+    path('api/solution_cache_stats/', views.solution_cache_stats, name='solution_cache_stats'),
 ]
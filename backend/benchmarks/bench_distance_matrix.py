@@ -0,0 +1,60 @@
+""" Benchmark comparing the vectorized distance matrix builder against
+    filling the matrix with the scalar `haversine` function
+
+    Run from the `backend` directory with:
+        python -m benchmarks.bench_distance_matrix [n ...] """
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.datasets import uniform
+from utils.algorithms import haversine, make_distance_matrix
+
+# largest n for which the scalar baseline is run, since it is O(n^2) Python calls
+REFERENCE_LIMIT = 1000
+
+
+def reference_distance_matrix(vertices: dict) -> np.ndarray:
+    """ The original double loop over the scalar `haversine` function """
+    dists = np.zeros(shape=(len(vertices), len(vertices)))
+
+    for i, (lat1, long1) in enumerate(vertices.values()):
+        for j, (lat2, long2) in enumerate(vertices.values()):
+            dists[i][j] = haversine(lat1, long1, lat2, long2)
+
+    return dists
+
+
+def best_time(func, *args, repeat: int = 3) -> tuple[float, object]:
+    """ Best wall-clock time of `repeat` calls to `func`, and the last result """
+    times = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - begin)
+    return min(times), result
+
+
+def main(sizes: list[int]):
+    print(f"{'n':>5} {'reference (s)':>14} {'float64 (s)':>12} {'float32 (s)':>12} "
+          f"{'speedup':>8} {'max error (mi)':>15}")
+    for n in sizes:
+        vertices = uniform(n)
+
+        vec_time, (dists, _) = best_time(make_distance_matrix, vertices)
+        f32_time, _ = best_time(make_distance_matrix, vertices, np.float32)
+
+        if n <= REFERENCE_LIMIT:
+            ref_time, reference = best_time(reference_distance_matrix, vertices, repeat=1)
+            speedup = f"{ref_time / vec_time:>7.1f}x"
+            error = f"{np.abs(reference - dists).max():>15.2e}"
+            ref_time = f"{ref_time:>14.4f}"
+        else:
+            ref_time, speedup, error = f"{'-':>14}", f"{'-':>8}", f"{'-':>15}"
+
+        print(f"{n:>5} {ref_time} {vec_time:>12.4f} {f32_time:>12.4f} {speedup} {error}")
+
+
+if __name__ == "__main__":
+    main([int(x) for x in sys.argv[1:]] or [10, 100, 1000, 5000])
@@ -0,0 +1,48 @@
+""" Benchmark comparing the memory use and solve times of the distance
+    providers against a dense distance matrix
+
+    Run from the `backend` directory with:
+        python -m benchmarks.bench_distance_providers [n ...] """
+import sys
+import time
+
+from benchmarks.datasets import uniform
+from utils.algorithms import improve_tour, make_distance_matrix, nearest_neighbor
+from utils.distances import make_distance_provider
+
+# largest n for which the dense matrix is built, since it takes 8n^2 bytes
+DENSE_LIMIT = 5000
+
+# seconds of local search after the nearest neighbor tour
+IMPROVE_TIME = 2.0
+
+
+def main(sizes: list[int]):
+    print(f"{'n':>6} {'provider':>10} {'memory (MB)':>12} {'build (s)':>10} "
+          f"{'nn (s)':>8} {'nn cost':>12} {'improved cost':>14}")
+    for n in sizes:
+        vertices = uniform(n)
+        start = next(iter(vertices))
+
+        builders = {kind: (lambda kind=kind: make_distance_provider(vertices, kind))
+                    for kind in ("condensed", "lazy", "neighbors")}
+        if n <= DENSE_LIMIT:
+            builders = {"dense": lambda: make_distance_matrix(vertices), **builders}
+
+        for name, build in builders.items():
+            begin = time.perf_counter()
+            distances, ids = build()
+            build_time = time.perf_counter() - begin
+
+            begin = time.perf_counter()
+            tour, cost = nearest_neighbor(distances, ids, start)
+            nn_time = time.perf_counter() - begin
+
+            _, improved = improve_tour(distances, ids, tour, time_limit=IMPROVE_TIME)
+
+            print(f"{n:>6} {name:>10} {distances.nbytes / 2**20:>12.1f} {build_time:>10.3f} "
+                  f"{nn_time:>8.3f} {cost:>12.1f} {improved:>14.1f}")
+
+
+if __name__ == "__main__":
+    main([int(x) for x in sys.argv[1:]] or [1000, 5000, 10000])
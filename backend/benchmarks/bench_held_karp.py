@@ -0,0 +1,94 @@
+""" Benchmark comparing the NumPy Held-Karp engine against the original
+    dictionary-based implementation
+
+    Run from the `backend` directory with:
+        python -m benchmarks.bench_held_karp [n ...] """
+import itertools
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.datasets import uniform
+from utils.algorithms import held_karp, make_distance_matrix
+
+
+def reference_held_karp(distances: np.ndarray, ids: np.ndarray, start: int) -> tuple[list, float]:
+    """ The original Held-Karp implementation, which stores the DP state in a
+        dictionary keyed by `(mask, v)` tuples. Kept only as a baseline for
+        correctness and speed comparisons. """
+    n = len(distances)
+    opt = {}
+
+    for i in range(1, n):
+        opt[(1 << i, i)] = (distances[0][i], 0)
+
+    for size in range(2, n):
+        for S in itertools.combinations(range(1, n), size):
+            mask = 0
+            for bit in S:
+                mask |= 1 << bit
+
+            for v in S:
+                min_cost = sys.maxsize
+                previous_city = -1
+                S_minus_v = mask & ~(1 << v)
+
+                for u in S:
+                    if u == v:
+                        continue
+
+                    new_cost = opt[(S_minus_v, u)][0] + distances[u][v]
+
+                    if new_cost < min_cost:
+                        min_cost = new_cost
+                        previous_city = u
+
+                opt[(mask, v)] = (min_cost, previous_city)
+
+    min_cost = sys.maxsize
+    previous_city = -1
+    cities_bitmask = (2 ** n) - 2
+
+    for v in range(1, n):
+        new_cost = opt[(cities_bitmask, v)][0] + distances[0][v]
+
+        if new_cost < min_cost:
+            min_cost = new_cost
+            previous_city = v
+
+    tour = [ids[previous_city]]
+    while cities_bitmask > 0:
+        new_mask = cities_bitmask & (~(1 << previous_city))
+        _, previous_city = opt[(cities_bitmask, previous_city)]
+        tour.insert(0, ids[previous_city])
+        cities_bitmask = new_mask
+
+    amt = -tour.index(start) % len(tour)
+    tour = tour[-amt:] + tour[:-amt]
+
+    return list(map(int, tour)), min_cost
+
+
+def time_call(func, *args) -> tuple[float, tuple]:
+    """ Time a single call to `func`, returning the elapsed seconds and the result """
+    begin = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - begin, result
+
+
+def main(sizes: list[int]):
+    print(f"{'n':>4} {'reference (s)':>14} {'numpy (s)':>10} {'speedup':>8}  same result")
+    for n in sizes:
+        distances, ids = make_distance_matrix(uniform(n))
+        start = int(ids[0])
+
+        ref_time, ref = time_call(reference_held_karp, distances, ids, start)
+        new_time, new = time_call(held_karp, distances, ids, start)
+        same = ref[0] == new[0] and ref[1] == new[1]
+
+        print(f"{n:>4} {ref_time:>14.4f} {new_time:>10.4f} {ref_time / new_time:>7.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    main([int(x) for x in sys.argv[1:]] or [8, 10, 12, 13, 14, 15])
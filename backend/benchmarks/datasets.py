@@ -0,0 +1,65 @@
+""" Reproducible synthetic location sets for benchmarking the solvers
+
+    Every generator takes a number of locations and a seed and returns a
+    dictionary of the format {location_id: (latitude, longitude)}, with IDs
+    from 1 to n, like the data passed to `calculate_tour`. The same arguments
+    always give the same locations. """
+import numpy as np
+
+# bounds of the continental United States, in degrees
+SOUTH, NORTH = 25.0, 49.0
+WEST, EAST = -124.0, -67.0
+
+
+def uniform(n: int, seed: int = 0) -> dict:
+    """ Locations spread uniformly over the continental United States """
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(SOUTH, NORTH, n)
+    longs = rng.uniform(WEST, EAST, n)
+    return _vertices(lats, longs)
+
+
+def clustered(n: int, seed: int = 0) -> dict:
+    """ Locations gathered around cities, as in a tour of sights in several
+        cities: one city per 50 locations (at least 2), with a few large
+        cities and many small ones, and locations within about 10 miles of
+        their city's center """
+    rng = np.random.default_rng(seed)
+    cities = max(2, n // 50)
+    centers = np.column_stack((rng.uniform(SOUTH + 1, NORTH - 1, cities),
+                               rng.uniform(WEST + 1, EAST - 1, cities)))
+
+    # city sizes fall off like a power law
+    weights = 1 / np.arange(1, cities + 1)
+    city = rng.choice(cities, size=n, p=weights / weights.sum())
+
+    offsets = rng.normal(0.0, 0.15, size=(n, 2))
+    return _vertices(centers[city, 0] + offsets[:, 0], centers[city, 1] + offsets[:, 1])
+
+
+def coastline(n: int, seed: int = 0) -> dict:
+    """ Locations along a winding coastline about 1,000 miles long, as in a
+        road trip down a coast. Nearly all locations are close to a single
+        line, which is a hard case for the Nearest Neighbor heuristic. """
+    rng = np.random.default_rng(seed)
+    t = np.sort(rng.uniform(0.0, 1.0, n))
+
+    # the coast runs north to south with bays every few hundred miles
+    lats = 47.0 - 14.0 * t
+    longs = -123.0 + 3.0 * t + 0.6 * np.sin(t * 9 * np.pi)
+
+    # locations are up to a few miles inland
+    inland = rng.exponential(0.03, n)
+    return _vertices(lats + rng.normal(0.0, 0.01, n), longs + inland)
+
+
+# datasets by name
+DATASETS = {
+    "uniform": uniform,
+    "clustered": clustered,
+    "coastline": coastline,
+}
+
+
+def _vertices(lats: np.ndarray, longs: np.ndarray) -> dict:
+    return {i + 1: (float(lat), float(long)) for i, (lat, long) in enumerate(zip(lats, longs))}
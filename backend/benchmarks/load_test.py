@@ -0,0 +1,116 @@
+""" Load test for a running server, used to compare the synchronous (WSGI) and
+    asynchronous (ASGI) deployments of the API
+
+    Start the server one way or the other, for example:
+        gunicorn backend.wsgi -w 4
+        uvicorn backend.asgi:application --workers 4
+
+    then run from the `backend` directory with:
+        python -m benchmarks.load_test [--url URL] [--endpoint search|get_tour|edit]
+                                       [--concurrency N] [--duration SECONDS]
+
+    The `search` endpoint exercises the geocoder, `get_tour` a plain database
+    read, and `edit` repeatedly adds and removes a location from a tour of
+    `--tour-size` locations, which exercises the tour solver. """
+import argparse
+import asyncio
+import time
+
+import httpx
+import numpy as np
+
+from benchmarks.datasets import uniform
+
+
+async def create_tour(client: httpx.AsyncClient, size: int) -> tuple[int, int, list[int]]:
+    """ Create a tour of `size` random locations, plus one spare location that is
+        added and removed by the `edit` workload. The spare is also kept in a
+        second tour, since removing a location from its only tour deletes it.
+
+    :param client: Client connected to the server under test
+    :param size: Number of locations in the tour
+    :return: IDs of the new tour and of the tour holding the spare, and IDs of
+             the tour's locations with the spare last
+    """
+    response = await client.post("/api/create_tour/", json={"name": "load test"})
+    tour_id = response.json()["id"]
+    response = await client.post("/api/create_tour/", json={"name": "load test spare"})
+    spare_tour_id = response.json()["id"]
+
+    location_ids = []
+    for i, (lat, long) in enumerate(uniform(size + 1, seed=tour_id).values()):
+        response = await client.post("/api/add_location/", json={
+            "name": f"Load test {i}",
+            "address": "",
+            "latitude": lat,
+            "longitude": long,
+        })
+        location_ids.append(response.json()["id"])
+
+    for location_id in location_ids[:-1]:
+        await client.post("/api/add_to_tour/", json={"tour_id": tour_id, "location_id": location_id})
+    await client.post("/api/add_to_tour/", json={"tour_id": spare_tour_id, "location_id": location_ids[-1]})
+
+    return tour_id, spare_tour_id, location_ids
+
+
+async def worker(client: httpx.AsyncClient, endpoint: str, deadline: float,
+                 tour_id: int, spare_id: int, latencies: list, errors: list):
+    """ Send requests to `endpoint` one after another until `deadline` """
+    queries = ["paris", "london", "new york", "tokyo", "sydney"]
+    i = 0
+
+    while time.perf_counter() < deadline:
+        begin = time.perf_counter()
+        try:
+            if endpoint == "search":
+                response = await client.get(f"/api/search/{queries[i % len(queries)]}/")
+            elif endpoint == "get_tour":
+                response = await client.get(f"/api/get_tour/{tour_id}/")
+            else:
+                # alternate between adding and removing the spare location
+                action = "add_to_tour" if i % 2 == 0 else "remove_from_tour"
+                response = await client.post(f"/api/{action}/",
+                                             json={"tour_id": tour_id, "location_id": spare_id})
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+            else:
+                latencies.append(time.perf_counter() - begin)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        i += 1
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30.0) as client:
+        tour_id, spare_tour_id, location_ids = await create_tour(client, args.tour_size)
+        spare_id = location_ids[-1]
+
+        latencies, errors = [], []
+        begin = time.perf_counter()
+        deadline = begin + args.duration
+        await asyncio.gather(*(worker(client, args.endpoint, deadline, tour_id, spare_id, latencies, errors)
+                               for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - begin
+
+        await client.post(f"/api/delete_tour/{tour_id}/")
+        await client.post(f"/api/delete_tour/{spare_tour_id}/")
+
+    print(f"endpoint:    {args.endpoint}")
+    print(f"concurrency: {args.concurrency}")
+    print(f"requests:    {len(latencies)} ok, {len(errors)} failed")
+    print(f"throughput:  {len(latencies) / elapsed:.1f} req/s")
+    if latencies:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        print(f"latency:     p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", choices=["search", "get_tour", "edit"], default="get_tour")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--tour-size", type=int, default=30)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,344 @@
+""" Benchmark suite for the tour solvers, run on the synthetic datasets in
+    `benchmarks.datasets`
+
+    For each dataset, size, and solver, reports the runtime, the peak memory
+    allocated during the call (as traced by `tracemalloc`, which includes NumPy
+    arrays), and the length of the tour found compared to a baseline. The
+    baseline is the optimal length where it is known and otherwise the best
+    known length, read from `baselines.json`; `--update-baselines` recomputes
+    it, spending longer on each instance than the solvers do.
+
+    The construction heuristics are also run as the first step of
+    `calculate_tour` (as "calculate_tour[<heuristic>]"), and a summary lists,
+    at each size, how long each heuristic takes, how long its tour is, and how
+    long the tour is once `calculate_tour` has improved it within its default
+    budget. The heuristic that leaves the shortest tour gives the most quality
+    for the time it takes, and is the one `calculate_tour` should choose.
+
+    Results are written as JSON with `--output`, so that a release can be
+    compared against an earlier one with `--compare`, which lists solvers that
+    became slower or find longer tours and exits with status 1 if there are any.
+
+    Run from the `backend` directory with:
+        python -m benchmarks.suite [--datasets uniform clustered coastline]
+                                   [--sizes 5 10 ...] [--seed 0]
+                                   [--output results.json] [--compare old.json]
+                                   [--update-baselines] """
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.datasets import DATASETS
+from utils.algorithms import (CONSTRUCTIONS, branch_and_bound, calculate_tour, christofides, greedy_tour,
+                              held_karp, hilbert_tour, improve_tour, make_distance_matrix,
+                              multi_start_nearest_neighbor, nearest_neighbor, strip_tour)
+from utils.distances import make_distance_provider
+
+BASELINES = Path(__file__).with_name("baselines.json")
+
+DEFAULT_SIZES = [5, 10, 15, 40, 100, 1000, 10000]
+
+# greatest number of locations for which a dense distance matrix is built
+DENSE_LIMIT = 2000
+
+# a solver is reported as slower if it takes this many times as long as
+# before, and at least this many seconds longer
+SLOWDOWN_RATIO = 1.25
+SLOWDOWN_SECONDS = 0.01
+
+# a solver is reported as worse if its tour is this much longer than before
+LENGTH_TOLERANCE = 0.001
+
+# seconds spent improving a tour when computing a best-known baseline
+BASELINE_TIME = 30.0
+
+
+def distances_for(vertices: dict):
+    """ Dense distance matrix for small instances, and a distance provider for
+        large ones, as `calculate_tour` does """
+    if len(vertices) <= DENSE_LIMIT:
+        return make_distance_matrix(vertices)
+    return make_distance_provider(vertices, "neighbors")
+
+
+def on_distances(solver):
+    """ Wrap a solver that takes a distance matrix so that it takes the
+        vertices instead; the time to build the distances is included """
+    def run(vertices, start):
+        distances, ids = distances_for(vertices)
+        return solver(distances, ids, start)[:2]
+    return run
+
+
+def on_coordinates(solver):
+    """ Wrap a solver that also takes the coordinates of the vertices, in
+        radians, like `on_distances` """
+    def run(vertices, start):
+        distances, ids = distances_for(vertices)
+        coordinates = np.radians(np.array(list(vertices.values())))
+        return solver(distances, ids, start, coordinates[:, 0], coordinates[:, 1])
+    return run
+
+
+def with_construction(construction):
+    """ `calculate_tour` with a given construction heuristic """
+    return lambda vertices, start: calculate_tour(vertices, start, construction=construction)
+
+
+# solvers by name: (smallest and largest number of locations it is run for,
+# or None for any number, and a function of (vertices, start) that returns a
+# tour and its cost, or None for functions that do not find tours)
+SOLVERS = {
+    "make_distance_matrix": (None, 5000, lambda vertices, start: (make_distance_matrix(vertices), None)[1]),
+    "held_karp": (None, 15, on_distances(held_karp)),
+    "branch_and_bound": (None, 40, on_distances(branch_and_bound)),
+    "nearest_neighbor": (None, None, on_distances(nearest_neighbor)),
+    # a nearest neighbor run from every city takes O(n^3) time
+    "multi_start_nearest_neighbor": (None, 1000, on_distances(multi_start_nearest_neighbor)),
+    "greedy": (None, None, on_distances(greedy_tour)),
+    "christofides": (None, DENSE_LIMIT, on_distances(christofides)),
+    "hilbert": (None, None, on_coordinates(hilbert_tour)),
+    "strip": (None, None, on_coordinates(strip_tour)),
+    "calculate_tour": (None, None, calculate_tour),
+}
+
+# `calculate_tour` with each construction heuristic, at sizes where it runs
+# local search rather than an exact solver; Christofides' heuristic needs a
+# dense distance matrix
+SOLVERS.update({
+    f"calculate_tour[{construction}]": (41, DENSE_LIMIT if construction == "christofides" else None,
+                                        with_construction(construction))
+    for construction in CONSTRUCTIONS
+})
+
+
+def tour_length(vertices: dict, tour: list) -> float:
+    """ Length of a closed tour, checking that it visits every location once """
+    if sorted(tour) != sorted(vertices):
+        raise ValueError("tour does not visit every location exactly once")
+
+    distances, ids = make_distance_provider(vertices, "lazy")
+    index = {int(id): i for i, id in enumerate(ids)}
+    order = np.array([index[id] for id in tour])
+    return float(distances[order, np.roll(order, -1)].sum())
+
+
+def measure(func, vertices: dict, start: int, repeat: int) -> dict:
+    """ Run a solver `repeat` times and once more under `tracemalloc`, and
+        report its best time, its peak memory, and the length of its tour """
+    times, result = [], None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        result = func(vertices, start)
+        times.append(time.perf_counter() - begin)
+
+    # tracing slows allocations down, so memory is measured in a separate run
+    tracemalloc.start()
+    func(vertices, start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "seconds": min(times),
+        "peak_bytes": peak,
+        "length": None if result is None else tour_length(vertices, result[0]),
+    }
+
+
+def compute_baseline(vertices: dict, start: int, best_length: float | None) -> dict:
+    """ Compute the optimal length of a tour if it is feasible, or else a best
+        known length by improving the best tour for much longer than usual """
+    n = len(vertices)
+    if n <= 15:
+        distances, ids = make_distance_matrix(vertices)
+        return {"length": held_karp(distances, ids, start)[1], "kind": "optimal"}
+
+    if n <= 40:
+        distances, ids = make_distance_matrix(vertices)
+        _, cost, gap = branch_and_bound(distances, ids, start, time_budget=BASELINE_TIME)
+        if gap == 0:
+            return {"length": cost, "kind": "optimal"}
+        length = cost
+    else:
+        distances, ids = distances_for(vertices)
+        tour, _ = nearest_neighbor(distances, ids, start)
+        tour, _ = improve_tour(distances, ids, tour, time_limit=BASELINE_TIME, neighbors=12)
+        length = tour_length(vertices, tour)
+
+    if best_length is not None:
+        length = min(length, best_length)
+
+    return {"length": length, "kind": "best-known"}
+
+
+def run(datasets: list[str], sizes: list[int], seed: int, update_baselines: bool) -> dict:
+    baselines = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+    results = []
+
+    for dataset in datasets:
+        for n in sizes:
+            vertices = DATASETS[dataset](n, seed)
+            start = next(iter(vertices))
+            key = f"{dataset}:{n}:{seed}"
+
+            # small instances are repeated to reduce timing noise
+            repeat = 5 if n <= 100 else 1
+
+            rows = []
+            for solver, (min_n, max_n, func) in SOLVERS.items():
+                if min_n is not None and n < min_n or max_n is not None and n > max_n:
+                    continue
+                row = {"dataset": dataset, "n": n, "seed": seed, "solver": solver}
+                row.update(measure(func, vertices, start, repeat))
+                rows.append(row)
+                print(f"{dataset:>10} {n:>6} {solver:>20} {row['seconds']:>10.4f} s "
+                      f"{row['peak_bytes'] / 2**20:>9.1f} MB", file=sys.stderr)
+
+            lengths = [row["length"] for row in rows if row["length"] is not None]
+            best = min(lengths) if lengths else None
+
+            if update_baselines:
+                computed = compute_baseline(vertices, start, best)
+                if key not in baselines or computed["length"] < baselines[key]["length"]:
+                    baselines[key] = computed
+            elif key not in baselines and n <= 15:
+                baselines[key] = compute_baseline(vertices, start, best)
+
+            baseline = baselines.get(key) or {"length": best, "kind": "best-in-run"}
+            for row in rows:
+                row["baseline"] = baseline["length"]
+                row["baseline_kind"] = baseline["kind"]
+                row["gap"] = None if row["length"] is None else row["length"] / baseline["length"] - 1
+            results.extend(rows)
+
+    if update_baselines:
+        BASELINES.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+
+    return {"meta": metadata(), "results": results}
+
+
+def metadata() -> dict:
+    """ Describe the code and machine that produced a set of results """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+    }
+
+
+def compare(old: dict, new: dict) -> list[str]:
+    """ List the solvers that are slower or find longer tours in `new` than
+        in `old` """
+    before = {(r["dataset"], r["n"], r["seed"], r["solver"]): r for r in old["results"]}
+    regressions = []
+
+    for r in new["results"]:
+        previous = before.get((r["dataset"], r["n"], r["seed"], r["solver"]))
+        if previous is None:
+            continue
+
+        name = f"{r['solver']} on {r['dataset']} n={r['n']}"
+        if (r["seconds"] > previous["seconds"] * SLOWDOWN_RATIO
+                and r["seconds"] - previous["seconds"] > SLOWDOWN_SECONDS):
+            regressions.append(f"{name}: {previous['seconds']:.4f} s -> {r['seconds']:.4f} s")
+        if (r["length"] is not None and previous["length"] is not None
+                and r["length"] > previous["length"] * (1 + LENGTH_TOLERANCE)):
+            regressions.append(f"{name}: length {previous['length']:.1f} -> {r['length']:.1f}")
+
+    return regressions
+
+
+def print_table(results: list[dict]):
+    print(f"{'dataset':>10} {'n':>6} {'solver':>20} {'time (s)':>10} {'peak (MB)':>10} "
+          f"{'length':>12} {'gap':>8}  baseline")
+    for r in results:
+        length = "-" if r["length"] is None else f"{r['length']:.1f}"
+        gap = "-" if r["gap"] is None else f"{r['gap']:.2%}"
+        print(f"{r['dataset']:>10} {r['n']:>6} {r['solver']:>20} {r['seconds']:>10.4f} "
+              f"{r['peak_bytes'] / 2**20:>10.1f} {length:>12} {gap:>8}  {r['baseline_kind']}")
+
+
+def construction_summary(results: list[dict]) -> list[dict]:
+    """ Summarize the construction heuristics at each size, averaged over
+        datasets: the time each takes, the gap of its tour, and the gap once
+        `calculate_tour` has improved it. The heuristic with the smallest gap
+        after improvement is marked as the best. """
+    summary = []
+    for n in sorted({r["n"] for r in results}):
+        # results of each solver at this size, one per dataset
+        rows = {}
+        for r in results:
+            if r["n"] == n:
+                rows.setdefault(r["solver"], []).append(r)
+
+        entries = []
+        for construction in CONSTRUCTIONS:
+            built, improved = rows.get(construction), rows.get(f"calculate_tour[{construction}]")
+            if not built or not improved:
+                continue
+            entries.append({
+                "n": n,
+                "construction": construction,
+                "seconds": float(np.mean([r["seconds"] for r in built])),
+                "gap": float(np.mean([r["gap"] for r in built])),
+                "improved_gap": float(np.mean([r["gap"] for r in improved])),
+                "best": False,
+            })
+
+        if entries:
+            min(entries, key=lambda e: e["improved_gap"])["best"] = True
+        summary.extend(entries)
+
+    return summary
+
+
+def print_summary(summary: list[dict]):
+    print(f"\n{'n':>6} {'construction':>16} {'time (s)':>10} {'gap':>8} {'improved':>9}")
+    for e in summary:
+        print(f"{e['n']:>6} {e['construction']:>16} {e['seconds']:>10.4f} {e['gap']:>8.2%} "
+              f"{e['improved_gap']:>9.2%}{'  best' if e['best'] else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite for the tour solvers")
+    parser.add_argument("--datasets", nargs="+", choices=list(DATASETS), default=list(DATASETS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    parser.add_argument("--compare", help="results of an earlier run to check for regressions")
+    parser.add_argument("--update-baselines", action="store_true")
+    args = parser.parse_args()
+
+    report = run(args.datasets, args.sizes, args.seed, args.update_baselines)
+    report["constructions"] = construction_summary(report["results"])
+    print_table(report["results"])
+    print_summary(report["constructions"])
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text()), report)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class TourguideConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tourguide'
+
+    def ready(self):
+        # Connect signal handlers
+        from . import signals
+
+        # Count the queries of timed requests (see `middleware.TimingMiddleware`)
+        from utils import timing
+        timing.install_query_counter()
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from tourguide.models import Location, Tour, TourLocation
+from tourguide.views import _delete_tours
+import time
+
+
+class Command(BaseCommand):
+    help = ("Benchmark deleting tours of different sizes, reporting the number of "
+            "queries and time taken. All changes are rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("sizes", nargs="*", type=int, default=[10, 100, 1000],
+                            help="Number of locations in each benchmarked tour")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'stops':>6} {'queries':>8} {'time (ms)':>10}")
+
+        for n in options["sizes"]:
+            with transaction.atomic():
+                tour = self.make_tour(n)
+
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    _delete_tours([tour.pk])
+                    elapsed = time.perf_counter() - start
+
+                self.stdout.write(f"{n:>6} {len(queries):>8} {elapsed * 1000:>10.1f}")
+
+                # Leave the database as it was
+                transaction.set_rollback(True)
+
+    def make_tour(self, n):
+        """ Create a tour with `n` locations that are not part of any other tour """
+        tour = Tour.objects.create(name=f"Benchmark tour of {n}")
+        locations = Location.objects.bulk_create([
+            Location(name=f"Benchmark {i}", address=f"Benchmark {i}",
+                     latitude=-89 + (i % 1000) * 0.001, longitude=-179 + (i // 1000) * 0.001)
+            for i in range(n)
+        ])
+        TourLocation.objects.bulk_create([
+            TourLocation(tour=tour, location=location, index=i)
+            for i, location in enumerate(locations)
+        ])
+        return tour
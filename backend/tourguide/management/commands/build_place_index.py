@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from utils.gazetteer import build_index
+import time
+
+
+class Command(BaseCommand):
+    help = ("Build the offline place index used by the 'offline' geocoder from a "
+            "CSV/TSV gazetteer of names, display names, latitudes, and longitudes")
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="Path to the CSV/TSV gazetteer")
+        parser.add_argument("--output", default=settings.GEOCODER_PLACE_INDEX,
+                            help="Directory to write the index to (default: GEOCODER_PLACE_INDEX)")
+        parser.add_argument("--columns",
+                            help="Column numbers for files without a header row, e.g., "
+                                 "'name=1,latitude=4,longitude=5,importance=14' for a GeoNames dump")
+        parser.add_argument("--delimiter", help="Field delimiter (default: tab for .tsv/.txt, comma otherwise)")
+
+    def handle(self, *args, **options):
+        columns = None
+        if options["columns"]:
+            try:
+                columns = {field: int(number) for field, number in
+                           (pair.split("=") for pair in options["columns"].split(","))}
+            except ValueError:
+                raise CommandError("--columns must be of the format 'field=number,field=number,...'")
+
+        start = time.perf_counter()
+        try:
+            count = build_index(options["source"], options["output"], columns, options["delimiter"])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"Indexed {count} places in {time.perf_counter() - start:.1f}s "
+                          f"to {options['output']}")
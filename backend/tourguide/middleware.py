@@ -0,0 +1,72 @@
+import json
+import logging
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from utils import timing
+
+logger = logging.getLogger("tourguide.timing")
+
+
+class TimingMiddleware:
+    """ Time a sample of requests with `utils.timing`: the duration and number
+        of database queries of each phase of a request are sent back in a
+        Server-Timing header and logged as a JSON object to the
+        "tourguide.timing" logger. A fraction TIMING_SAMPLE_RATE of requests
+        is timed; the others pay only for a random number and a context
+        variable lookup per phase. """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.TIMING_SAMPLE_RATE
+
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if not self._sampled():
+            return self.get_response(request)
+
+        token = timing.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = timing.finish(token)
+
+        return self._report(request, response, timings)
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+
+        token = timing.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = timing.finish(token)
+
+        return self._report(request, response, timings)
+
+    def _sampled(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _report(self, request, response, timings):
+        response.headers["Server-Timing"] = timings.server_timing()
+
+        match = request.resolver_match
+        logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "view": match.url_name if match else None,
+            "status": response.status_code,
+            **timings.as_dict(),
+        }))
+
+        return response
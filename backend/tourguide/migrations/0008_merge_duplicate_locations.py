@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:56
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    """ Merge locations with identical coordinates and remove repeated
+        tour-location pairs so that the unique constraints can be created """
+    Location = apps.get_model('tourguide', 'Location')
+    TourLocation = apps.get_model('tourguide', 'TourLocation')
+
+    duplicates = (Location.objects.values('latitude', 'longitude')
+                  .annotate(count=Count('id'), keep=Min('id')).filter(count__gt=1))
+    for duplicate in duplicates:
+        others = (Location.objects.filter(latitude=duplicate['latitude'], longitude=duplicate['longitude'])
+                  .exclude(pk=duplicate['keep']))
+        TourLocation.objects.filter(location__in=others).update(location_id=duplicate['keep'])
+        others.delete()
+
+    pairs = (TourLocation.objects.values('tour', 'location')
+             .annotate(count=Count('id'), keep=Min('id')).filter(count__gt=1))
+    for pair in pairs:
+        (TourLocation.objects.filter(tour=pair['tour'], location=pair['location'])
+         .exclude(pk=pair['keep']).delete())
+
+
+class Migration(migrations.Migration):
+    """ Runs on its own, before the constraints are added in the next
+        migration: on PostgreSQL, altering a table in the same transaction as
+        updates to its deferred foreign keys fails with pending trigger events """
+
+    dependencies = [
+        ('tourguide', '0007_alter_tour_created'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tourguide', '0008_merge_duplicate_locations'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tourlocation',
+            index=models.Index(fields=['tour', 'index'], name='tourlocation_tour_index'),
+        ),
+        migrations.AddConstraint(
+            model_name='location',
+            constraint=models.UniqueConstraint(fields=('latitude', 'longitude'), name='unique_location_coordinates'),
+        ),
+        migrations.AddConstraint(
+            model_name='tourlocation',
+            constraint=models.UniqueConstraint(fields=('tour', 'location'), name='unique_tour_location'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tourguide', '0009_location_tourlocation_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tour',
+            name='mode',
+            field=models.CharField(choices=[('cycle', 'Cycle'), ('open', 'Open'), ('fixed', 'Fixed')], default='cycle', max_length=5),
+        ),
+        migrations.AddField(
+            model_name='tour',
+            name='end',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='tourguide.location'),
+        ),
+    ]
@@ -6,14 +6,31 @@ class Location(models.Model):
     latitude = models.DecimalField(max_digits=9, decimal_places=6)
     longitude = models.DecimalField(max_digits=9, decimal_places=6)
 
+    class Meta:
+        constraints = [
+            # Two locations with the same exact coordinates are the same location
+            models.UniqueConstraint(fields=["latitude", "longitude"], name="unique_location_coordinates"),
+        ]
+
     def __str__(self):
         return self.name
 
 
 class Tour(models.Model):
+    class Mode(models.TextChoices):
+        # Return to the first location, stop at any location, or stop at `end`
+        CYCLE = "cycle"
+        OPEN = "open"
+        FIXED = "fixed"
+
     name = models.CharField(max_length=100)
     created = models.DateTimeField(auto_now_add=True)
     locations = models.ManyToManyField(Location, through="TourLocation")
+    mode = models.CharField(max_length=5, choices=Mode.choices, default=Mode.CYCLE)
+    # The end is always one of the tour's locations, which are only deleted
+    # once no tour includes them, so deleting a location never has to look
+    # for tours that end at it
+    end = models.ForeignKey(Location, null=True, blank=True, on_delete=models.DO_NOTHING, related_name="+")
 
     def __str__(self):
         return self.name
@@ -23,4 +40,13 @@ class TourLocation(models.Model):
     tour = models.ForeignKey(Tour, on_delete=models.CASCADE)
     location = models.ForeignKey(Location, on_delete=models.CASCADE)
     index = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["tour", "location"], name="unique_tour_location"),
+        ]
+        indexes = [
+            # Serves fetching a tour's locations in order
+            models.Index(fields=["tour", "index"], name="tourlocation_tour_index"),
+        ]
     
\ No newline at end of file
@@ -10,4 +10,4 @@ class LocationSerializer(serializers.ModelSerializer):
 class TourSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tour
-        fields = ('id', 'name', 'created', 'locations')
+        fields = ('id', 'name', 'created', 'mode', 'end', 'locations')
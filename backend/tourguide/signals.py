@@ -0,0 +1,22 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import Location, Tour, TourLocation
+from utils import response_cache
+
+
+@receiver(post_save, sender=Location)
+def location_saved(sender, instance, created, **kwargs):
+    """ Invalidate cached tour responses involving a location when it is
+        changed. Cached distances are keyed by coordinates, so they need no
+        invalidation (see `matrix_cache`). """
+    if not created:
+        tour_ids = TourLocation.objects.filter(location=instance).values_list("tour_id", flat=True)
+        for tour_id in tour_ids:
+            response_cache.discard_on_commit(tour_id)
+
+
+@receiver(post_save, sender=Tour)
+def tour_saved(sender, instance, created, **kwargs):
+    """ Invalidate the cached response of a tour when it is changed """
+    if not created:
+        response_cache.discard_on_commit(instance.pk)
@@ -1,3 +1,978 @@
-from django.test import TestCase
+from django.core.cache import caches
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, override_settings
+from unittest import mock
+from . import views
+from .models import Location, Tour, TourLocation
+from utils import matrix_cache, response_cache, solution_cache, solver_pool
+from benchmarks.bench_held_karp import reference_held_karp
+from benchmarks.datasets import uniform
+from utils.algorithms import (CONSTRUCTIONS, branch_and_bound, calculate_tour, grow_distance_matrix, haversine,
+                              held_karp, improve_tour, make_distance_matrix, multi_start_nearest_neighbor,
+                              nearest_neighbor, neighbor_lists, or_opt_move, path_cost, rotate,
+                              shrink_distance_matrix, two_opt_move)
+from utils.distances import make_distance_provider
+from utils.gazetteer import PlaceIndex, build_index
+from utils.spatial import SpatialIndex
+from utils.geocoding import CachedGeocoder, LocalGeocoder
+import itertools
+import json
+import numpy as np
+import os
+import tempfile
+import time
 
-# Create your tests here.
+
+class TourTestCase(TestCase):
+    """ Helpers for creating tours and calling the API """
+
+    # Number of locations created so far, so that every location gets its own
+    # coordinates
+    created = 0
+
+    def setUp(self):
+        # Tour IDs are reused once each test's changes are rolled back
+        caches["responses"].clear()
+
+    def make_tour(self, n):
+        """ Create a tour with `n` locations on a rough grid, in index order """
+        tour = Tour.objects.create(name=f"Tour of {n}")
+        locations = Location.objects.bulk_create([
+            Location(name=f"Location {i}", address=f"Address {i}",
+                     latitude=40 + (i % 10) * 0.1, longitude=-75 + (i // 10) * 0.1)
+            for i in range(self.created, self.created + n)
+        ])
+        self.created += n
+        TourLocation.objects.bulk_create([
+            TourLocation(tour=tour, location=location, index=i)
+            for i, location in enumerate(locations)
+        ])
+        return tour
+
+    def post(self, url, data):
+        return self.client.post(url, json.dumps(data), content_type="application/json")
+
+    def assert_indices(self, tour):
+        indices = TourLocation.objects.filter(tour=tour).order_by("index").values_list("index", flat=True)
+        self.assertEqual(list(indices), list(range(len(indices))))
+
+
+class TourEditQueryCountTests(TourTestCase):
+    """ Editing a tour should take the same number of queries regardless of
+        how many locations the tour has """
+
+    def test_add_to_tour(self):
+        for n in (5, 60):
+            tour = self.make_tour(n)
+            location = Location.objects.create(name="New", address="New", latitude=39.5, longitude=-75 + n * 0.01)
+
+            with self.assertNumQueries(7):
+                response = self.post("/api/add_to_tour/", {"tour_id": tour.pk, "location_id": location.pk})
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(TourLocation.objects.filter(tour=tour).count(), n + 1)
+            self.assert_indices(tour)
+
+    def test_remove_from_tour(self):
+        for n in (5, 60):
+            tour = self.make_tour(n)
+            location = TourLocation.objects.get(tour=tour, index=0).location
+
+            with self.assertNumQueries(9):
+                response = self.post("/api/remove_from_tour/", {"tour_id": tour.pk, "location_id": location.pk})
+
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(Location.objects.filter(pk=location.pk).exists())
+            self.assertEqual(TourLocation.objects.filter(tour=tour).count(), n - 1)
+            self.assert_indices(tour)
+
+
+class TimingTests(TourTestCase):
+    """ Sampled requests should report the time and queries of each phase """
+
+    @override_settings(TIMING_SAMPLE_RATE=1.0)
+    def test_edits_report_phases(self):
+        tour = self.make_tour(60)
+        location = Location.objects.create(name="New", address="New", latitude=39.5, longitude=-74)
+
+        with self.assertLogs("tourguide.timing") as logs:
+            response = self.post("/api/add_to_tour/", {"tour_id": tour.pk, "location_id": location.pk})
+
+        metrics = {metric.split(";")[0]: metric for metric in response.headers["Server-Timing"].split(", ")}
+        self.assertLessEqual({"matrix", "solve", "write", "db", "total"}, metrics.keys())
+        self.assertIn('desc="7 queries"', metrics["db"])
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record["view"], record["status"], record["queries"]), ("add_to_tour", 200, 7))
+        self.assertEqual(record["phases"]["write"]["queries"], 1)
+
+    @override_settings(TIMING_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_not_timed(self):
+        tour = self.make_tour(5)
+        response = self.client.get(f"/api/get_tour/{tour.pk}/")
+        self.assertNotIn("Server-Timing", response.headers)
+
+
+class TimeBudgetTests(TourTestCase):
+    """ Tours should be calculated within the time budget of a request """
+
+    def test_edits_report_how_the_tour_was_calculated(self):
+        tour = self.make_tour(8)
+        location = Location.objects.create(name="New", address="New", latitude=39.5, longitude=-74)
+
+        response = self.post("/api/add_to_tour/", {"tour_id": tour.pk, "location_id": location.pk,
+                                                   "time_budget_ms": 500})
+        solver = response.json()["solver"]
+        self.assertEqual((solver["engine"], solver["optimal"], solver["time_budget_ms"]), ("held_karp", True, 500))
+
+        response = self.post("/api/remove_from_tour/", {"tour_id": tour.pk, "location_id": location.pk,
+                                                        "time_budget_ms": -1})
+        self.assertEqual(response.status_code, 400)
+
+    def test_large_tours_are_constructed_within_a_small_budget(self):
+        rng = np.random.default_rng(0)
+        locations = {i: (rng.uniform(30, 45), rng.uniform(-120, -75)) for i in range(5000)}
+
+        began = time.perf_counter()
+        tour, cost, info = calculate_tour(locations, 0, time_budget_ms=50)
+        self.assertLess(time.perf_counter() - began, 0.5)
+
+        self.assertEqual(sorted(tour), list(range(5000)))
+        self.assertEqual(tour[0], 0)
+        self.assertEqual(info["construction"], "hilbert")
+
+    def test_large_tours_are_improved_until_the_budget_runs_out(self):
+        rng = np.random.default_rng(0)
+        locations = {i: (rng.uniform(30, 45), rng.uniform(-120, -75)) for i in range(12000)}
+        _, constructed, _ = calculate_tour(locations, 0, time_budget_ms=0, construction="hilbert")
+
+        began = time.perf_counter()
+        tour, cost, info = calculate_tour(locations, 0, time_budget_ms=500, construction="hilbert")
+        self.assertGreater(time.perf_counter() - began, 0.4)
+
+        self.assertEqual(sorted(tour), list(range(12000)))
+        self.assertEqual(info["engine"], "local_search")
+        self.assertLess(cost, constructed)
+
+
+class TourModeTests(TourTestCase):
+    """ Tours may end anywhere or at a fixed location instead of returning to
+        their first location """
+
+    def order(self, tour):
+        return list(TourLocation.objects.filter(tour=tour).order_by("index").values_list("location_id", flat=True))
+
+    def test_paths_keep_their_start_and_end(self):
+        tour = self.make_tour(8)
+        first, last = self.order(tour)[0], self.order(tour)[3]
+
+        response = self.post("/api/solve_tour/", {"tour_id": tour.pk, "mode": "open"})
+        self.assertTrue(response.json()["solver"]["optimal"])
+        self.assertEqual(self.order(tour)[0], first)
+
+        response = self.post("/api/solve_tour/", {"tour_id": tour.pk, "mode": "fixed", "end_id": first})
+        self.assertEqual(response.status_code, 400)
+
+        self.post("/api/solve_tour/", {"tour_id": tour.pk, "mode": "fixed", "end_id": last})
+        order = self.order(tour)
+        self.assertEqual((order[0], order[-1]), (first, last))
+        self.assertEqual(self.client.get(f"/api/get_tour/{tour.pk}/").json()["end"], last)
+
+        # a new location is never added after the fixed end
+        location = Location.objects.create(name="New", address="New", latitude=39.5, longitude=-74)
+        self.post("/api/add_to_tour/", {"tour_id": tour.pk, "location_id": location.pk})
+        self.assertEqual(self.order(tour)[-1], last)
+        self.assert_indices(tour)
+
+        # removing the fixed end lets the tour end anywhere
+        self.post("/api/remove_from_tour/", {"tour_id": tour.pk, "location_id": last})
+        tour.refresh_from_db()
+        self.assertEqual((tour.mode, tour.end), (Tour.Mode.OPEN, None))
+
+    def test_fixed_end_needs_two_locations(self):
+        tour = self.make_tour(1)
+        only = self.order(tour)[0]
+
+        response = self.post("/api/solve_tour/", {"tour_id": tour.pk, "mode": "fixed", "end_id": only})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.post("/api/import_tour/?mode=fixed", {"name": "Imported", "locations": [
+            {"name": "Stop", "address": "", "latitude": 39.5, "longitude": -74}]})
+        self.assertEqual(response.status_code, 400)
+
+        # the tour keeps returning to its start, so it can still grow
+        location = Location.objects.create(name="New", address="New", latitude=39.5, longitude=-74)
+        response = self.post("/api/add_to_tour/", {"tour_id": tour.pk, "location_id": location.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.order(tour), [only, location.pk])
+
+    def test_open_path_is_no_longer_than_the_cycle(self):
+        rng = np.random.default_rng(1)
+        locations = {i: (rng.uniform(30, 45), rng.uniform(-120, -75)) for i in range(30)}
+
+        _, cycle_cost, _ = calculate_tour(locations, 0)
+        path, path_cost, _ = calculate_tour(locations, 0, mode="open")
+        fixed, _, _ = calculate_tour(locations, 0, mode="fixed", end=7)
+
+        self.assertLessEqual(path_cost, cycle_cost)
+        self.assertEqual((sorted(path), path[0]), (list(range(30)), 0))
+        self.assertEqual((sorted(fixed), fixed[0], fixed[-1]), (list(range(30)), 0, 7))
+
+
+class DeleteTourQueryCountTests(TourTestCase):
+    """ Deleting tours should take the same number of queries regardless of
+        how many locations they have """
+
+    def test_delete_tour(self):
+        for n in (10, 100, 1000):
+            tour = self.make_tour(n)
+            other = self.make_tour(3)
+
+            # One location is shared with another tour and must not be deleted
+            shared = TourLocation.objects.get(tour=tour, index=0).location
+            TourLocation.objects.create(tour=other, location=shared, index=3)
+
+            with self.assertNumQueries(6):
+                response = self.client.delete(f"/api/delete_tour/{tour.pk}/")
+
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(Tour.objects.filter(pk=tour.pk).exists())
+            self.assertFalse(TourLocation.objects.filter(tour=tour).exists())
+            self.assertTrue(Location.objects.filter(pk=shared.pk).exists())
+            self.assertEqual(Location.objects.filter(tourlocation__tour=other).count(), 4)
+            self.assertFalse(Location.objects.filter(tourlocation__isnull=True).exists())
+
+    def test_delete_tours(self):
+        tours = [self.make_tour(n) for n in (5, 50)]
+
+        with self.assertNumQueries(6):
+            response = self.post("/api/delete_tours/", {"tour_ids": [tour.pk for tour in tours]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Tour.objects.exists())
+        self.assertFalse(Location.objects.exists())
+
+
+class AddLocationTests(TourTestCase):
+
+    def test_existing_coordinates_return_existing_location(self):
+        data = {"name": "Philadelphia", "address": "Philadelphia, PA",
+                "latitude": "39.9526", "longitude": "-75.1652"}
+
+        first = self.post("/api/add_location/", data).json()
+        second = self.post("/api/add_location/", {**data, "name": "Philly"}).json()
+
+        self.assertEqual(first["id"], second["id"])
+        self.assertEqual(second["name"], "Philadelphia")
+        self.assertEqual(Location.objects.count(), 1)
+
+
+class GetTourTests(TourTestCase):
+
+    def test_responses_are_cached_until_the_tour_changes(self):
+        tour = self.make_tour(5)
+
+        first = self.client.get(f"/api/get_tour/{tour.pk}/")
+        self.assertEqual([loc["index"] for loc in first.json()["locations"]], list(range(5)))
+
+        # An unchanged tour is served from the cache, and is not sent again to
+        # a client that already has it
+        with self.assertNumQueries(0):
+            again = self.client.get(f"/api/get_tour/{tour.pk}/", headers={"If-None-Match": first["ETag"]})
+        self.assertEqual(again.status_code, 304)
+
+        location = Location.objects.create(name="New", address="New", latitude=39.5, longitude=-74.5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post("/api/add_to_tour/", {"tour_id": tour.pk, "location_id": location.pk})
+
+        changed = self.client.get(f"/api/get_tour/{tour.pk}/", headers={"If-None-Match": first["ETag"]})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], first["ETag"])
+        self.assertEqual(len(changed.json()["locations"]), 6)
+
+    def test_responses_built_before_a_change_are_not_served(self):
+        tour = self.make_tour(3)
+
+        # A response is built from the tour, which changes before it is stored
+        _, version = response_cache.get(tour.pk)
+        response_cache.discard(tour.pk)
+        response_cache.put(tour.pk, version, {"stale": True})
+
+        self.assertEqual(response_cache.get(tour.pk)[0], None)
+        self.assertNotIn("stale", self.client.get(f"/api/get_tour/{tour.pk}/").json())
+
+    def test_last_modified_alone_does_not_skip_the_response(self):
+        tour = self.make_tour(3)
+        first = self.client.get(f"/api/get_tour/{tour.pk}/")
+
+        again = self.client.get(f"/api/get_tour/{tour.pk}/", headers={"If-Modified-Since": first["Last-Modified"]})
+        self.assertEqual(again.status_code, 200)
+
+
+class ImportTourTests(TourTestCase):
+
+    def test_import_upserts_locations_and_solves_once(self):
+        existing = Location.objects.create(name="Old name", address="", latitude=40.1, longitude=-75.1)
+        locations = [{"name": f"Stop {i}", "address": f"Address {i}",
+                      "latitude": 40 + (i % 5) * 0.1, "longitude": -75 - (i // 5) * 0.1} for i in range(20)]
+
+        with self.assertNumQueries(6), mock.patch("utils.solution_cache.calculate_tour",
+                                                  wraps=solution_cache.calculate_tour) as calculate_tour:
+            response = self.post("/api/import_tour/", {"name": "Imported", "locations": locations})
+        calculate_tour.assert_called_once()
+
+        data = response.json()
+        self.assertEqual(data["name"], "Imported")
+        self.assertEqual([loc["index"] for loc in data["locations"]], list(range(20)))
+        self.assertEqual(data["locations"][0]["name"], "Stop 0")
+        self.assertEqual(Location.objects.count(), 20)
+        existing.refresh_from_db()
+        self.assertEqual(existing.name, "Stop 6")
+        self.assert_indices(Tour.objects.get(pk=data["id"]))
+
+    def test_import_csv_and_geojson(self):
+        csv_body = "name,address,latitude,longitude\nA,,41.0,-74.0\nB,,41.1,-74.2\nC,,41.3,-74.1\n"
+        response = self.client.post("/api/import_tour/?name=From%20CSV", csv_body, content_type="text/csv")
+        self.assertEqual([loc["name"] for loc in response.json()["locations"]][0], "A")
+        self.assertEqual(len(response.json()["locations"]), 3)
+
+        geojson = {"type": "FeatureCollection", "features": [
+            {"type": "Feature", "geometry": {"type": "Point", "coordinates": [-74.0, 41.0]},
+             "properties": {"name": "A"}},
+            {"type": "Feature", "geometry": {"type": "Point", "coordinates": [-73.5, 41.5]},
+             "properties": {"name": "D"}},
+        ]}
+        response = self.post("/api/import_tour/?name=From%20GeoJSON", geojson)
+        self.assertEqual(response.json()["name"], "From GeoJSON")
+        self.assertEqual(Location.objects.count(), 4)
+
+        self.assertEqual(self.post("/api/import_tour/", {"locations": []}).status_code, 400)
+
+
+class TourListTests(TourTestCase):
+
+    def test_tours_are_listed_a_page_at_a_time(self):
+        tours = [self.make_tour(3) for _ in range(5)]
+
+        # One query for the page of tours and one for all of their locations
+        with self.assertNumQueries(2):
+            page = self.client.get("/api/tours/", {"page_size": 2}).json()
+
+        listed = page["results"]
+        while page["next"]:
+            page = self.client.get(page["next"]).json()
+            listed += page["results"]
+
+        self.assertEqual([tour["id"] for tour in listed], [tour.pk for tour in tours])
+        self.assertTrue(all(len(tour["locations"]) == 3 for tour in listed))
+
+    def test_export_streams_one_tour_per_line(self):
+        tours = [self.make_tour(n) for n in (1, 2, 3)]
+
+        response = self.client.get("/api/tours/export/")
+        lines = b"".join(response.streaming_content).splitlines()
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual([json.loads(line)["id"] for line in lines], [tour.pk for tour in tours])
+        self.assertEqual([len(json.loads(line)["locations"]) for line in lines], [1, 2, 3])
+
+
+class AsyncViewTests(TourTestCase):
+    """ The asynchronous endpoints should leave tours in the same state as the
+        synchronous ones """
+
+    async def test_add_and_remove(self):
+        factory = AsyncRequestFactory()
+        tour = await Tour.objects.acreate(name="Async")
+        locations = [await Location.objects.acreate(name=f"Location {i}", address="",
+                                                    latitude=41 + i * 0.1, longitude=-74 - (i % 3) * 0.1)
+                     for i in range(6)]
+
+        for location in locations:
+            request = factory.post("/api/add_to_tour/", {"tour_id": tour.pk, "location_id": location.pk},
+                                   content_type="application/json")
+            response = await views.aadd_to_tour(request)
+            self.assertEqual(response.status_code, 200)
+
+        request = factory.post("/api/remove_from_tour/", {"tour_id": tour.pk, "location_id": locations[2].pk},
+                               content_type="application/json")
+        await views.aremove_from_tour(request)
+
+        response = await views.aget_tour(factory.get(f"/api/get_tour/{tour.pk}/"), tour.pk)
+        data = json.loads(response.content)
+        self.assertEqual([loc["index"] for loc in data["locations"]], list(range(5)))
+        self.assertNotIn(locations[2].pk, [loc["id"] for loc in data["locations"]])
+        self.assertFalse(await Location.objects.filter(pk=locations[2].pk).aexists())
+
+    async def test_failed_add_leaves_no_placeholder(self):
+        factory = AsyncRequestFactory()
+        tour = await Tour.objects.acreate(name="Async")
+        location = await Location.objects.acreate(name="Location", address="", latitude=41, longitude=-74)
+
+        request = factory.post("/api/add_to_tour/", {"tour_id": tour.pk, "location_id": location.pk},
+                               content_type="application/json")
+        with mock.patch.object(views, "_order_after_add", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                await views.aadd_to_tour(request)
+
+        self.assertFalse(await TourLocation.objects.filter(tour=tour).aexists())
+
+
+class CachedGeocoderTests(SimpleTestCase):
+
+    places = [
+        {"name": "London", "address": "London, England", "latitude": "51.5", "longitude": "-0.13"},
+        {"name": "London", "address": "London, Ontario", "latitude": "42.98", "longitude": "-81.25"},
+        {"name": "Paris", "address": "Paris, France", "latitude": "48.86", "longitude": "2.35"},
+    ]
+
+    def make_geocoder(self, **options):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        backend = LocalGeocoder(self.places)
+        backend.search = mock.Mock(wraps=backend.search)
+        return CachedGeocoder(backend, os.path.join(directory.name, "cache.sqlite3"), **options)
+
+    def test_repeated_queries_are_served_from_cache(self):
+        geocoder = self.make_geocoder()
+
+        first = geocoder.search("London")
+        second = geocoder.search("  LONDON ")
+
+        self.assertEqual(len(first), 2)
+        self.assertEqual(first, second)
+        self.assertEqual(geocoder.backend.search.call_count, 1)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        geocoder = self.make_geocoder(max_entries=1)
+
+        geocoder.search("London")
+        geocoder.search("Paris")
+        geocoder.search("London")
+
+        self.assertEqual(geocoder.backend.search.call_count, 3)
+
+    def test_expired_entries_are_refreshed(self):
+        geocoder = self.make_geocoder(ttl=0)
+
+        geocoder.search("Paris")
+        geocoder.search("Paris")
+
+        self.assertEqual(geocoder.backend.search.call_count, 2)
+
+    def test_eviction_runs_only_when_due(self):
+        geocoder = self.make_geocoder(max_entries=3)
+        geocoder.evict = mock.Mock(wraps=geocoder.evict)
+
+        for query in ("London", "Paris", "Rome"):
+            geocoder.search(query)
+        self.assertEqual(geocoder.evict.call_count, 0)
+
+        geocoder.search("Berlin")
+        self.assertEqual(geocoder.evict.call_count, 1)
+        self.assertEqual(geocoder.connection().execute("SELECT COUNT(*) FROM geocode_cache").fetchone()[0], 3)
+
+
+class PlaceIndexTests(SimpleTestCase):
+
+    def test_prefix_search_ranks_exact_then_important_matches(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        source = os.path.join(directory.name, "places.tsv")
+
+        with open(source, "w", encoding="utf-8") as f:
+            f.write("name\tdisplay_name\tlat\tlon\tpopulation\n")
+            f.write("Londonderry\tLonderry, Northern Ireland\t54.99\t-7.31\t85000\n")
+            f.write("London\tLondon, Ontario\t42.98\t-81.25\t400000\n")
+            f.write("London\tLondon, England\t51.50\t-0.13\t8900000\n")
+            f.write("São Paulo\tSão Paulo, Brazil\t-23.55\t-46.63\t12300000\n")
+
+        build_index(source, os.path.join(directory.name, "index"))
+        index = PlaceIndex(os.path.join(directory.name, "index"))
+
+        self.assertEqual([place["address"] for place in index.search("lond")],
+                         ["London, England", "London, Ontario", "Londerry, Northern Ireland"])
+        self.assertEqual(index.search("London", limit=1)[0],
+                         {"name": "London", "address": "London, England",
+                          "latitude": "51.5", "longitude": "-0.13"})
+        self.assertEqual(index.search("sao")[0]["name"], "São Paulo")
+        self.assertEqual(index.search("Paris"), [])
+
+    def test_prefix_search_ranks_every_match(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        source = os.path.join(directory.name, "places.tsv")
+
+        # Thousands of small places that sort before the most important match
+        with open(source, "w", encoding="utf-8") as f:
+            f.write("name\tlat\tlon\tpopulation\n")
+            for i in range(2500):
+                f.write(f"New A{i:04d}\t0\t0\t{i}\n")
+            f.write("New York\t40.71\t-74.01\t8000000\n")
+
+        build_index(source, os.path.join(directory.name, "index"))
+        index = PlaceIndex(os.path.join(directory.name, "index"))
+
+        self.assertEqual([place["name"] for place in index.search("new", limit=3)],
+                         ["New York", "New A2499", "New A2498"])
+        self.assertEqual([place["name"] for place in index.search("new a", limit=20)],
+                         [f"New A{i:04d}" for i in range(2499, 2479, -1)])
+
+
+class AlgorithmEquivalenceTests(SimpleTestCase):
+    """ The vectorized solvers should give the same results as the loops they
+        replaced """
+
+    @staticmethod
+    def tied_distances(n, seed):
+        """ Symmetric distances with many ties """
+        distances = np.random.default_rng(seed).integers(1, 4, (n, n)).astype(np.float64)
+        distances = np.triu(distances, 1)
+        return distances + distances.T
+
+    @staticmethod
+    def scan_nearest_neighbor(distances, ids, start):
+        """ Nearest neighbor by scanning each row for its first smallest edge """
+        current = int(np.where(ids == start)[0][0])
+        tour, length = [current], 0.0
+        while len(tour) < len(distances):
+            nearest = None
+            for i, edge in enumerate(distances[current]):
+                if i not in tour and (nearest is None or edge < distances[current][nearest]):
+                    nearest = i
+            length += distances[current][nearest]
+            tour.append(nearest)
+            current = nearest
+        return [int(ids[i]) for i in tour], length + distances[current][tour[0]]
+
+    def test_held_karp_matches_reference(self):
+        for n in range(4, 11):
+            for distances, ids in (make_distance_matrix(uniform(n, seed=n)),
+                                   (self.tied_distances(n, n), np.arange(1, n + 1))):
+                self.assertEqual(held_karp(distances, ids, int(ids[0])),
+                                 reference_held_karp(distances, ids, int(ids[0])))
+
+    def test_haversine_matrix_matches_scalar_haversine(self):
+        locations = uniform(30, seed=1)
+        distances, ids = make_distance_matrix(locations)
+
+        expected = [[haversine(*locations[a], *locations[b]) for b in ids] for a in ids]
+        np.testing.assert_allclose(distances, expected, rtol=1e-12, atol=1e-9)
+
+    def test_nearest_neighbor_breaks_ties_like_a_scan(self):
+        for seed in range(5):
+            distances = self.tied_distances(12, seed)
+            ids = np.arange(10, 22)
+            for start in (10, 15):
+                self.assertEqual(nearest_neighbor(distances, ids, start),
+                                 self.scan_nearest_neighbor(distances, ids, start))
+
+
+class DistanceProviderTests(SimpleTestCase):
+
+    def test_providers_match_dense_matrix(self):
+        # random coordinates, since exact ties may be broken differently
+        rng = np.random.default_rng(1)
+        locations = {i: (lat, long) for i, (lat, long) in enumerate(rng.uniform((39, -76), (41, -74), (300, 2)))}
+        dense, ids = make_distance_matrix(locations)
+        tour, _ = nearest_neighbor(dense, ids, 0)
+        improved, cost = improve_tour(dense, ids, tour, time_limit=5)
+        i, j = np.array([0, 5, 299, 7]), np.array([5, 0, 299, 150])
+
+        for kind in ("condensed", "lazy", "neighbors"):
+            with self.subTest(kind=kind):
+                distances, _ = make_distance_provider(locations, kind)
+
+                np.testing.assert_allclose(distances[17], dense[17], rtol=1e-6)
+                np.testing.assert_allclose(distances[10:20], dense[10:20], rtol=1e-6)
+                np.testing.assert_allclose(distances[i, j], dense[i, j], rtol=1e-6)
+                self.assertEqual(nearest_neighbor(distances, ids, 0)[0], tour)
+                self.assertEqual(improve_tour(distances, ids, tour, time_limit=5)[0], improved)
+
+    def test_neighbor_lists_grow_and_shrink_like_new_ones(self):
+        rng = np.random.default_rng(2)
+        coordinates = rng.uniform((39, -76), (41, -74), (301, 2))
+        locations = dict(enumerate(map(tuple, coordinates[:300])))
+        distances, ids = make_distance_provider(locations, "neighbors")
+
+        # add a location among the others, then remove one that is among the
+        # neighbors of others
+        distances, ids, grown = grow_distance_matrix(distances, ids, coordinates[:300], 300, coordinates[300])
+        expected, _ = make_distance_provider({**locations, 300: tuple(coordinates[300])}, "neighbors")
+        np.testing.assert_array_equal(distances.neighbors, expected.neighbors)
+
+        distances, ids, _ = shrink_distance_matrix(distances, ids, grown, int(expected.neighbors[0, 0]))
+        expected, _ = make_distance_provider({int(id): tuple(grown[id]) for id in ids}, "neighbors")
+        np.testing.assert_array_equal(distances.neighbors, expected.neighbors)
+        np.testing.assert_allclose(distances[4], expected[4])
+
+
+class SpatialIndexTests(SimpleTestCase):
+
+    def test_queries_match_distance_matrix_and_skip_deleted_points(self):
+        rng = np.random.default_rng(2)
+        locations = {i: (lat, long) for i, (lat, long) in enumerate(rng.uniform((39, -76), (41, -74), (500, 2)))}
+        dense, _ = make_distance_matrix(locations)
+        coordinates = np.radians(np.array(list(locations.values())))
+        index = SpatialIndex(coordinates[:, 0], coordinates[:, 1])
+
+        row = dense[3].copy()
+        row[3] = np.inf
+        points, distances = index.nearest(3, 5)
+        self.assertEqual(points.tolist(), np.argsort(row, kind="stable")[:5].tolist())
+        np.testing.assert_allclose(distances, np.sort(row)[:5], rtol=1e-6)
+
+        points, _ = index.within(3, 10)
+        self.assertEqual(sorted(points.tolist()), np.where(row <= 10)[0].tolist())
+
+        index.delete(int(points[0]))
+        self.assertNotIn(int(points[0]), index.within(3, 10)[0].tolist())
+        self.assertEqual(len(index), 499)
+
+
+class ConstructionTests(SimpleTestCase):
+
+    def test_every_construction_visits_each_location_once_from_the_start(self):
+        rng = np.random.default_rng(2)
+        locations = {i: (rng.uniform(30, 45), rng.uniform(-120, -75)) for i in range(60)}
+
+        for construction in CONSTRUCTIONS:
+            for mode, end in (("cycle", None), ("open", None), ("fixed", 7)):
+                tour, cost, info = calculate_tour(locations, 3, time_budget_ms=0, mode=mode, end=end,
+                                                  construction=construction)
+                self.assertEqual((sorted(tour), tour[0]), (list(range(60)), 3))
+                self.assertEqual(info["construction"], construction)
+                if end is not None:
+                    self.assertEqual(tour[-1], end)
+
+
+class LocalSearchTests(SimpleTestCase):
+
+    # Five locations on a line, one unit apart, so that costs can be checked by hand
+    LINE = np.abs(np.arange(5.0)[:, np.newaxis] - np.arange(5.0)[np.newaxis, :])
+
+    def apply(self, move, distances, order, a, k=2):
+        """ Apply one move to `order`, returning the new order and the cities
+            whose edges changed """
+        order = np.array(order, dtype=np.int64)
+        position = np.empty(len(order), dtype=np.int64)
+        position[order] = np.arange(len(order))
+
+        touched = move(distances, order, position, neighbor_lists(distances, k), a)
+        self.assertEqual(position[order].tolist(), list(range(len(order))))
+        return order.tolist(), touched
+
+    def test_two_opt_move_uncrosses_edges(self):
+        # 0 -> 2 -> 1 -> 3 -> 4 -> 0 costs 10; reversing (2, 1) leaves 8
+        order, touched = self.apply(two_opt_move, self.LINE, [0, 2, 1, 3, 4], 0)
+        self.assertEqual(order, [0, 1, 2, 3, 4])
+        self.assertEqual(sorted(touched), [0, 1, 2, 3])
+
+        self.assertEqual(self.apply(two_opt_move, self.LINE, order, 0), (order, []))
+
+    def test_or_opt_move_relocates_a_segment(self):
+        # 0 -> 3 -> 1 -> 2 -> 4 -> 0 costs 12; moving 3 between 2 and 4 leaves 8
+        order, touched = self.apply(or_opt_move, self.LINE, [0, 3, 1, 2, 4], 3)
+        self.assertEqual(order, [0, 1, 2, 3, 4])
+        self.assertEqual(sorted(set(touched)), [0, 1, 2, 3, 4])
+
+        # the first location never moves
+        self.assertEqual(self.apply(or_opt_move, self.LINE, [0, 3, 1, 2, 4], 0)[1], [])
+
+    def test_moves_keep_the_start_and_never_lengthen_the_tour(self):
+        distances, _ = make_distance_matrix(uniform(7, seed=4))
+
+        # every order of 7 locations that starts at 0, and every city to move
+        for rest in itertools.permutations(range(1, 7)):
+            before = [0, *rest]
+            for move in (two_opt_move, or_opt_move):
+                for a in range(7):
+                    order, touched = self.apply(move, distances, before, a, k=3)
+
+                    self.assertEqual((order[0], sorted(order)), (0, list(range(7))))
+                    self.assertLessEqual(path_cost(distances, order), path_cost(distances, before) + 1e-9)
+                    self.assertEqual(order == before, not touched)
+
+    def test_improve_tour_keeps_the_start_and_reports_its_cost(self):
+        locations = uniform(200, seed=5)
+        distances, ids = make_distance_matrix(locations)
+        rng = np.random.default_rng(5)
+        tour = [int(id) for id in rng.permutation(ids)]
+        index = {int(id): i for i, id in enumerate(ids)}
+        cost = path_cost(distances, [index[id] for id in tour])
+
+        for stages in ((two_opt_move,), (or_opt_move,), None):
+            with self.subTest(stages=stages):
+                improved, improved_cost = improve_tour(distances, ids, tour, stages=stages, time_limit=5)
+
+                self.assertEqual((improved[0], sorted(improved)), (tour[0], sorted(tour)))
+                self.assertLess(improved_cost, cost)
+                self.assertAlmostEqual(improved_cost, path_cost(distances, [index[id] for id in improved]))
+
+    def test_improve_tour_stops_at_its_time_limit(self):
+        distances, ids = make_distance_matrix(uniform(2000, seed=6))
+        tour = [int(id) for id in np.random.default_rng(6).permutation(ids)]
+
+        # nothing is examined without time
+        self.assertEqual(improve_tour(distances, ids, tour, time_limit=0)[0], tour)
+
+        # a full search of a random order of 2000 locations takes about half a
+        # second, and stops with the limit after the current move
+        began = time.perf_counter()
+        improve_tour(distances, ids, tour, time_limit=0.02)
+        self.assertLess(time.perf_counter() - began, 0.2)
+
+
+class MultiStartNearestNeighborTests(SimpleTestCase):
+
+    def test_shortest_run_is_rotated_to_the_start(self):
+        rng = np.random.default_rng(7)
+        locations = {i: (rng.uniform(30, 45), rng.uniform(-120, -75)) for i in range(10, 50)}
+        distances, ids = make_distance_matrix(locations)
+
+        runs = [nearest_neighbor(distances, ids, int(id)) for id in ids]
+        shortest = min(cost for _, cost in runs)
+        expected = [rotate(tour, -tour.index(25)) for tour, cost in runs if cost <= shortest + 1e-9]
+
+        tour, cost = multi_start_nearest_neighbor(distances, ids, 25)
+        self.assertAlmostEqual(cost, shortest, places=6)
+        self.assertIn(tour, expected)
+
+        # a sample of starting cities always includes the start
+        self.assertEqual(multi_start_nearest_neighbor(distances, ids, 25, starts=1), runs[15])
+        for seed in range(5):
+            tour, cost = multi_start_nearest_neighbor(distances, ids, 25, starts=5, seed=seed)
+            self.assertEqual((sorted(tour), tour[0]), (list(range(10, 50)), 25))
+            self.assertLessEqual(cost, runs[15][1] + 1e-9)
+
+
+class BranchAndBoundTests(SimpleTestCase):
+
+    @staticmethod
+    def brute_force(distances, mode, end=None):
+        """ Cost of the shortest tour from index 0, trying every order """
+        n = len(distances)
+        best = np.inf
+        for rest in itertools.permutations(range(1, n)):
+            if mode == "fixed" and rest[-1] != end:
+                continue
+            order = (0,) + rest
+            cost = sum(distances[a, b] for a, b in zip(order, order[1:]))
+            best = min(best, cost + (distances[order[-1], 0] if mode == "cycle" else 0))
+        return best
+
+    def test_tours_are_optimal_in_every_mode(self):
+        rng = np.random.default_rng(5)
+        for n in range(4, 9):
+            locations = {i: (rng.uniform(30, 45), rng.uniform(-120, -75)) for i in range(n)}
+            distances, ids = make_distance_matrix(locations)
+
+            for mode, end in (("cycle", None), ("open", None), ("fixed", n - 1)):
+                tour, cost, gap = branch_and_bound(distances, ids, 0, 5, mode=mode, end=end)
+                self.assertEqual((sorted(tour), tour[0], gap), (list(range(n)), 0, 0.0))
+                self.assertAlmostEqual(cost, self.brute_force(distances, mode, end), places=6)
+                self.assertAlmostEqual(cost, held_karp(distances, ids, 0, mode, end)[1], places=6)
+
+    def test_gap_bounds_the_distance_from_the_optimum(self):
+        rng = np.random.default_rng(6)
+        locations = {i: (rng.uniform(30, 45), rng.uniform(-120, -75)) for i in range(15)}
+        distances, ids = make_distance_matrix(locations)
+
+        for mode, end in (("cycle", None), ("open", None), ("fixed", 14)):
+            optimum = held_karp(distances, ids, 0, mode, end)[1]
+            for time_budget in (0.001, 5):
+                _, cost, gap = branch_and_bound(distances, ids, 0, time_budget, mode=mode, end=end)
+                self.assertGreaterEqual(cost, optimum - 1e-6)
+                self.assertLessEqual((cost - optimum) / cost, gap + 1e-9)
+
+    def test_open_paths_are_proven_optimal(self):
+        rng = np.random.default_rng(4)
+        for n in range(10, 16):
+            locations = {i: (rng.uniform(30, 45), rng.uniform(-120, -75)) for i in range(n)}
+            distances, ids = make_distance_matrix(locations)
+
+            started = time.perf_counter()
+            path, cost, gap = branch_and_bound(distances, ids, 0, 20, mode="open")
+            self.assertLess(time.perf_counter() - started, 10)
+            self.assertEqual((sorted(path), path[0]), (list(range(n)), 0))
+            self.assertAlmostEqual(cost, held_karp(distances, ids, 0, mode="open")[1], places=6)
+            self.assertEqual(gap, 0.0)
+
+
+class MatrixCacheTests(TourTestCase):
+
+    def setUp(self):
+        super().setUp()
+        caches["distances"].clear()
+
+    @staticmethod
+    def locations_dict(tour):
+        return {row.location_id: (float(row.location.latitude), float(row.location.longitude))
+                for row in TourLocation.objects.select_related("location").filter(tour=tour)}
+
+    @override_settings(DISTANCE_CACHE_MAX_BYTES=2500)
+    def test_least_recently_used_matrices_are_evicted_past_the_byte_budget(self):
+        # Three sets of 10 locations, each taking 1040 bytes, of which only two fit
+        sets = [{i: (40 + i * 0.01, -75 - first * 0.01) for i in range(10)} for first in range(3)]
+        for locations in sets[:2]:
+            distances, ids = make_distance_matrix(locations)
+            matrix_cache.put(distances, ids, np.array(list(locations.values())))
+
+        self.assertIsNotNone(matrix_cache.get(sets[0]))
+        distances, ids = make_distance_matrix(sets[2])
+        matrix_cache.put(distances, ids, np.array(list(sets[2].values())))
+
+        self.assertIsNone(matrix_cache.get(sets[1]))
+        self.assertIsNotNone(matrix_cache.get(sets[2]))
+        self.assertEqual(matrix_cache.stats(), {
+            "hits": 2, "misses": 1, "evictions": 1, "hit_rate": 2 / 3,
+            "entries": 2, "bytes": 2080, "max_bytes": 2500,
+        })
+
+    def test_moved_and_deleted_locations_are_not_served_from_cache(self):
+        tour = self.make_tour(45)
+        location = Location.objects.create(name="New", address="New", latitude=39.5, longitude=-74.5)
+        self.post("/api/add_to_tour/", {"tour_id": tour.pk, "location_id": location.pk})
+        self.assertIsNotNone(matrix_cache.get(self.locations_dict(tour)))
+
+        moved = TourLocation.objects.get(tour=tour, index=5).location
+        moved.latitude = 38
+        moved.save()
+        self.assertIsNone(matrix_cache.get(self.locations_dict(tour)))
+
+        self.post("/api/remove_from_tour/", {"tour_id": tour.pk, "location_id": location.pk})
+        locations = self.locations_dict(tour)
+        distances, ids, _ = matrix_cache.get(locations)
+        expected, expected_ids = make_distance_matrix(locations)
+        order = np.argsort(ids)
+        np.testing.assert_allclose(distances[np.ix_(order, order)],
+                                   expected[np.ix_(np.argsort(expected_ids), np.argsort(expected_ids))])
+
+
+class SolutionCacheTests(SimpleTestCase):
+
+    def test_cached_tour_is_rotated_to_start(self):
+        locations = {i: (40 + (i * 7 % 13) * 0.05, -75 + (i * 5 % 11) * 0.05) for i in range(10, 22)}
+        before = solution_cache.stats()
+
+        tour, cost, _ = solution_cache.solve(locations, 10)
+        with mock.patch("utils.solution_cache.calculate_tour") as calculate_tour:
+            rotated, rotated_cost, info = solution_cache.solve(dict(reversed(locations.items())), 15)
+            calculate_tour.assert_not_called()
+
+        i = tour.index(15)
+        self.assertEqual(rotated, tour[i:] + tour[:i])
+        self.assertEqual(rotated_cost, cost)
+        self.assertTrue(info["cached"])
+        self.assertEqual(solution_cache.stats()["hits"], before["hits"] + 1)
+
+
+class SolverPoolTests(SimpleTestCase):
+
+    def wait(self, job_id):
+        """ Wait for a job to finish and return its status """
+        deadline = time.monotonic() + 60
+        while solver_pool.status(job_id)["status"] not in solver_pool.FINISHED:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        return solver_pool.status(job_id)
+
+    def test_superseded_jobs_are_not_saved(self):
+        if not solver_pool.enabled():
+            self.skipTest("the solver pool is disabled")
+        locations = {i: (40 + (i * 7 % 13) * 0.05, -75 + (i * 5 % 11) * 0.05) for i in range(30)}
+        distances, ids = make_distance_matrix(locations)
+        saved = []
+
+        def on_result(tour_id, order):
+            saved.append(order)
+            return True
+
+        first = solver_pool.submit(1, distances, ids, list(locations), on_result, time_budget=0.1)
+        second = solver_pool.submit(1, distances, ids, list(locations), on_result, time_budget=0.1)
+
+        self.assertEqual(self.wait(first)["status"], "cancelled")
+        job = self.wait(second)
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(saved, [job["order"]])
+        self.assertEqual(sorted(job["order"]), list(locations))
+        self.assertEqual(job["order"][0], 0)
+
+    @override_settings(SOLVER_WORKERS=0)
+    def test_jobs_run_inline_when_the_pool_is_disabled(self):
+        locations = {i: (40 + (i * 7 % 13) * 0.05, -75 + (i * 5 % 11) * 0.05) for i in range(30)}
+        distances, ids = make_distance_matrix(locations)
+        saved = []
+
+        def on_result(tour_id, order):
+            saved.append(order)
+            return True
+
+        job = self.wait(solver_pool.submit(2, distances, ids, list(locations), on_result, time_budget=0.1))
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(saved, [job["order"]])
+        self.assertEqual(job["order"][0], 0)
+
+
+@override_settings(SOLVER_WORKERS=0)
+class SolverJobViewTests(TourTestCase):
+    """ Background solves of large tours, with the pool disabled so that jobs
+        run in the request's thread """
+
+    def order(self, tour):
+        return list(TourLocation.objects.filter(tour=tour).order_by("index").values_list("location_id", flat=True))
+
+    def test_solved_order_is_only_saved_over_an_unchanged_tour(self):
+        tour = self.make_tour(6)
+        order = self.order(tour)
+        solved = order[:1] + order[:0:-1]
+
+        self.assertTrue(views._save_solved_order(tour.pk, solved))
+        self.assertEqual(self.order(tour), solved)
+        self.assert_indices(tour)
+
+        # the tour's mode changed since the job was submitted
+        self.post("/api/solve_tour/", {"tour_id": tour.pk, "mode": "fixed", "end_id": order[3]})
+        current = self.order(tour)
+        self.assertFalse(views._save_solved_order(tour.pk, solved))
+        self.assertFalse(views._save_solved_order(tour.pk, solved, mode="fixed", end=order[2]))
+        self.assertEqual(self.order(tour), current)
+
+        # a location was added since the job was submitted
+        location = Location.objects.create(name="New", address="New", latitude=39.5, longitude=-74)
+        self.post("/api/add_to_tour/", {"tour_id": tour.pk, "location_id": location.pk})
+        current = self.order(tour)
+        self.assertFalse(views._save_solved_order(tour.pk, solved, mode="fixed", end=order[3]))
+        self.assertEqual(self.order(tour), current)
+
+        # the tour was deleted since the job was submitted
+        self.client.delete(f"/api/delete_tour/{tour.pk}/")
+        self.assertFalse(views._save_solved_order(tour.pk, current, mode="fixed", end=order[3]))
+
+    @override_settings(SOLVER_POOL_CUTOFF=20)
+    def test_edits_are_solved_in_the_request(self):
+        tour = self.make_tour(30)
+        location = Location.objects.create(name="New", address="New", latitude=39.5, longitude=-74)
+
+        response = self.post("/api/add_to_tour/", {"tour_id": tour.pk, "location_id": location.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("job_id", response.json())
+
+    def test_job_status_is_reported_and_streamed(self):
+        locations = {i: (40 + (i * 7 % 13) * 0.05, -75 + (i * 5 % 11) * 0.05) for i in range(30)}
+        distances, ids = make_distance_matrix(locations)
+        job_id = solver_pool.submit(-1, distances, ids, list(locations), lambda tour_id, order: True,
+                                    time_budget=0.1)
+
+        # the stream ends once the job finishes
+        response = self.client.get(f"/api/solver_job/{job_id}/?stream=1")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = b"".join(response.streaming_content).decode().split("\n\n")
+        self.assertEqual(events[-1], "")
+        statuses = [json.loads(event.removeprefix("data: ")) for event in events[:-1]]
+        self.assertEqual(statuses[-1]["status"], "done")
+        self.assertEqual(statuses[-1]["order"][0], 0)
+
+        response = self.client.get(f"/api/solver_job/{job_id}/")
+        self.assertEqual(response.json(), statuses[-1])
+        self.assertEqual(self.client.get("/api/solver_job/missing/").status_code, 404)
@@ -1,12 +1,45 @@
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from rest_framework.renderers import JSONRenderer
 from .serializers import LocationSerializer, TourSerializer
 from .models import Location, Tour, TourLocation
-from utils.algorithms import calculate_tour
-from django.http import HttpResponse, JsonResponse
+from utils.algorithms import (CYCLE, DENSE_CUTOFF, grow_distance_matrix, insert_location, make_distance_matrix,
+                              remove_location, shrink_distance_matrix)
+from utils.distances import make_distance_provider
+from utils import matrix_cache, response_cache, solution_cache, solver_pool, timing
+from utils.geocoding import GeocoderError, make_geocoder
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Min
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch
+from asgiref.sync import sync_to_async
+import asyncio
+import csv
+import functools
 import json
-import requests
+import numpy as np
+import time
+
+
+# greatest number of locations for which a tour is re-solved from scratch on
+# every edit; larger tours are updated incrementally
+INCREMENTAL_CUTOFF = 40
+
+# seconds between status updates when streaming a solver job's status, and the
+# longest a stream stays open
+JOB_STREAM_INTERVAL = 0.25
+JOB_STREAM_TIMEOUT = 60
+
+# number of tours fetched from the database at a time when exporting tours
+EXPORT_CHUNK_SIZE = 2000
+
+# milliseconds spent repairing a tour after an incremental edit, unless the
+# request gives a time budget
+INCREMENTAL_TIME_BUDGET_MS = 50.0
 
 
 class LocationView(viewsets.ModelViewSet):
@@ -14,10 +47,48 @@ class LocationView(viewsets.ModelViewSet):
     queryset = Location.objects.all()
 
 
+class TourPagination(CursorPagination):
+    """ List tours a page at a time, in the order they were created. A cursor
+        stays valid as tours are added and deleted, and fetching a page does
+        not get slower with the number of pages before it. """
+    ordering = "id"
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+
 class TourView(viewsets.ModelViewSet):
     """ Access all tours and associated data """
     serializer_class = TourSerializer
-    queryset = Tour.objects.all()
+    pagination_class = TourPagination
+    # Fetch the locations of every tour on a page in a single query
+    queryset = Tour.objects.prefetch_related(Prefetch("locations", queryset=Location.objects.only("id")))
+
+    @action(detail=False)
+    def export(self, request):
+        """ Stream every tour as newline-delimited JSON (one tour per line).
+            Tours are fetched from the database in chunks, so memory use does
+            not grow with the number of tours. """
+        tours = self.get_queryset().order_by("id")
+
+        # Under ASGI, a synchronous iterator would be read into memory in full
+        # before being sent, so tours are fetched asynchronously instead
+        if settings.ASYNC_VIEWS:
+            lines = self._aexport_lines(tours)
+        else:
+            lines = self._export_lines(tours)
+
+        return StreamingHttpResponse(lines, content_type="application/x-ndjson")
+
+    def _export_lines(self, tours):
+        renderer = JSONRenderer()
+        for tour in tours.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield renderer.render(self.get_serializer(tour).data) + b"\n"
+
+    async def _aexport_lines(self, tours):
+        renderer = JSONRenderer()
+        async for tour in tours.aiterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield renderer.render(self.get_serializer(tour).data) + b"\n"
 
 
 @csrf_exempt
@@ -35,6 +106,8 @@ def create_tour(request):
         "id": new_tour.pk,
         "name": new_tour.name,
         "created": new_tour.created,
+        "mode": new_tour.mode,
+        "end": None,
         "locations": []
     }
 
@@ -43,11 +116,40 @@ def create_tour(request):
 
 def get_tour(request, tour_id):
     """ API endpoint to retrieve the name, time created, and locations
-        of a tour given its ID """
-    # Get location objects and tour object for specified tour
-    locs = TourLocation.objects.select_related("location").filter(tour=tour_id)
-    tour = Tour.objects.get(pk=tour_id)
+        of a tour given its ID. Responses are cached until the tour changes,
+        and conditional requests for an unchanged tour are answered with
+        304 Not Modified. """
+    entry, version = response_cache.get(tour_id)
 
+    if entry is None:
+        # Get tour object and location objects for specified tour, in order
+        tour = Tour.objects.get(pk=tour_id)
+        locs = TourLocation.objects.select_related("location").filter(tour=tour_id).order_by("index")
+        entry = response_cache.put(tour_id, version, _tour_dict(tour, locs))
+
+    return _tour_response(request, entry)
+
+
+def _tour_response(request, entry):
+    """ Create the response to a request for a tour from its cached entry (see
+        `response_cache`), or a 304 response if the client's copy is current """
+    # Only the ETag is compared: Last-Modified has a resolution of a second,
+    # so a client could miss a change made in the same second
+    response = get_conditional_response(request, etag=entry["etag"])
+    if response is None:
+        response = HttpResponse(entry["body"], content_type="application/json")
+
+    response.headers["ETag"] = entry["etag"]
+    response.headers["Last-Modified"] = http_date(entry["last_modified"])
+    # Browsers should check that their copy is current before each use
+    patch_cache_control(response, no_cache=True)
+
+    return response
+
+
+def _tour_dict(tour, locs):
+    """ Create the response dictionary for a tour given its TourLocation rows
+        in index order """
     # Create locations list
     locations = [
         {"id": x.location.pk,
@@ -58,171 +160,528 @@ def get_tour(request, tour_id):
          "index": x.index} for x in locs
     ]
 
-    # Sort locations on index
-    locations = sorted(locations, key=lambda x: x["index"])
-
     # Create response dictionary
     res = {
         "id": tour.pk,
         "name": tour.name,
         "created": tour.created,
+        "mode": tour.mode,
+        "end": tour.end_id,
         "locations": locations
     }
 
-    return JsonResponse(res)
+    return res
 
 
 @csrf_exempt
 def delete_tour(request, tour_id):
     """ API endpoint to delete a tour from the Tour table and TourLocation
         table given its ID """
-    # Get tour-location pairs from database
-    locs = TourLocation.objects.select_related("location").filter(tour_id=tour_id)
+    _delete_tours([tour_id])
 
-    # Check each location in the tour to see if it exists in another tour; if
-    # not, delete it from the Location table
-    for loc in locs:
-        # Get associated location ID
-        id = loc.location.pk
+    return HttpResponse(status=200)
 
-        # Delete location from TourLocation table
-        loc.delete()
 
-        # Check if any other tours include this location
-        if not TourLocation.objects.filter(location_id=id).exists():
-            # No other tours include this location, so we can delete it from the database
-            Location.objects.get(pk=id).delete()
+@csrf_exempt
+def delete_tours(request):
+    """ API endpoint to delete many tours at once given a list of their IDs """
+    # Load data - `request.body` consists of a list of tour IDs
+    data = json.loads(request.body)
+    tour_ids = data.get("tour_ids", [])
 
-    # Delete tour with the given ID from the database
-    Tour.objects.filter(pk=tour_id).delete()
+    _delete_tours(tour_ids)
 
     return HttpResponse(status=200)
 
 
+def _delete_tours(tour_ids):
+    """ Delete tours, their TourLocation rows, and every location that is not
+        part of any other tour, using the same number of queries regardless of
+        the number of tours or locations """
+    with transaction.atomic():
+        # Locations in these tours that no other tour includes
+        in_tours = TourLocation.objects.filter(location=OuterRef("pk"), tour_id__in=tour_ids)
+        elsewhere = TourLocation.objects.filter(location=OuterRef("pk")).exclude(tour_id__in=tour_ids)
+        orphans = Location.objects.filter(Exists(in_tours), ~Exists(elsewhere))
+
+        # Delete the orphaned locations in a single statement. Nothing listens
+        # for their deletion, so a regular `delete()`, which loads them to
+        # collect their TourLocation rows in batches, is not needed; the rows
+        # still referencing them are deleted with the tours below, before the
+        # deferred foreign key checks run at the end of the transaction.
+        orphans._raw_delete(orphans.db)
+
+        # Delete the tours; their TourLocation rows are deleted along with them
+        # in a single statement
+        Tour.objects.filter(pk__in=tour_ids).delete()
+
+    for tour_id in tour_ids:
+        response_cache.discard(tour_id)
+        solver_pool.cancel(tour_id)
+
+
 @csrf_exempt
 def add_to_tour(request):
     """ API endpoint to add a location to a tour given the tour's ID and
-        the location's ID """
-    # Load data - `request.body` consists of a tour ID and location ID
+        the location's ID, and optionally the milliseconds that may be spent
+        re-calculating the tour. Responds with how the tour was calculated. """
+    # Load data - `request.body` consists of a tour ID and location ID, and
+    # optionally a time budget
     data = json.loads(request.body)
     tour_id = data.get("tour_id")
     location_id = data.get("location_id")
+    try:
+        time_budget_ms = _time_budget(data.get("time_budget_ms"))
+    except (TypeError, ValueError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
 
-    # Get all locations in tour
-    locs = TourLocation.objects.select_related("location").filter(tour=tour_id)
-    
-    # Check if location is already in tour
-    if locs.filter(location_id=location_id).exists():
-        # Location is already in tour, so no re-calculation is necessary
-        return HttpResponse(status=200)
-    
-    index = -1  # Placeholder index before tour recalculation
-
-    # Set index to 0 if tour is blank
-    if not locs:
-        index = 0
-    
-    # Add location to tour with placeholder index
-    new_tour_loc = TourLocation(tour_id=tour_id, location_id=location_id, index=index)
-    new_tour_loc.save()
-
-    # Get all locations in tour, again
-    locs = TourLocation.objects.select_related("location").filter(tour=tour_id)
-
-    # Turn locations into dictionary of the format: {location_id: (latitude, longitude)}
-    locs_dict = {
-        l.location.pk: (float(l.location.latitude), float(l.location.longitude)) 
-        for l in locs
-    }
+    with transaction.atomic():
+        # Lock the tour so that concurrent edits to it are applied one at a time
+        tour_obj = Tour.objects.select_for_update().get(pk=tour_id)
 
-    # Re-calculate tour with new location added
-    start = locs.get(index=0).location.pk
-    order, _ = calculate_tour(locs_dict, start)
+        # Get all locations in tour
+        rows = list(TourLocation.objects.select_related("location").filter(tour_id=tour_id))
 
-    # Update indices in database
-    for index, id in enumerate(order):
-        l = TourLocation.objects.get(tour_id=tour_id, location_id=id)
-        l.index = index
-        l.save()
+        # Check if location is already in tour
+        if any(row.location_id == location_id for row in rows):
+            # Location is already in tour, so no re-calculation is necessary
+            return HttpResponse(status=200)
 
-    return HttpResponse(status=200)
+        # Current order of the tour, not including the new location
+        tour = [row.location_id for row in sorted(rows, key=lambda x: x.index)]
+
+        # Add location to tour with placeholder index before tour recalculation
+        new_row = TourLocation.objects.create(
+            tour_id=tour_id, location=Location.objects.get(pk=location_id), index=-1)
+        rows.append(new_row)
+        response_cache.discard_on_commit(tour_id)
+
+        # Re-calculate tour with new location added and update indices in database
+        order, info = _order_after_add(tour_id, rows, tour, location_id, time_budget_ms,
+                                       tour_obj.mode, tour_obj.end_id)
+        _save_order(rows, order)
+
+    return _solve_in_background(tour_id, rows, order, info, tour_obj.mode, tour_obj.end_id)
 
 
 @csrf_exempt
 def remove_from_tour(request):
     """ API endpoint to remove a location from a tour given the tour's ID 
-        and the location's ID """
-    # Load data - `request.body` consists of a tour ID and location ID
+        and the location's ID, and optionally the milliseconds that may be
+        spent re-calculating the tour. Responds with how the tour was
+        calculated. """
+    # Load data - `request.body` consists of a tour ID and location ID, and
+    # optionally a time budget
     data = json.loads(request.body)
     tour_id = data.get("tour_id")
     location_id = data.get("location_id")
+    try:
+        time_budget_ms = _time_budget(data.get("time_budget_ms"))
+    except (TypeError, ValueError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
 
-    # Get all locations in tour
-    locs = TourLocation.objects.select_related("location").filter(tour=tour_id)
-
-    # Check if location is in tour
-    if not locs.filter(location_id=location_id).exists():
-        # Location is not in tour, so no re-calculation is necessary
-        return HttpResponse(status=200)
-    
-    # Remove location from TourLocation table
-    TourLocation.objects.get(tour_id=tour_id, location_id=location_id).delete()
-
-    # Check if any other tours include this location
-    if not TourLocation.objects.filter(location_id=location_id).exists():
-        # No other tours include this location, so we can delete it from the database
-        Location.objects.get(pk=location_id).delete()
-
-    # If this was the last location in the tour, no need to recalculate
-    if not locs:
-        return HttpResponse(status=200)
-
-    # Turn locations into dictionary of the format: {location_id: (latitude, longitude)}
-    locs_dict = {
-        l.location.pk: (float(l.location.latitude), float(l.location.longitude)) 
-        for l in locs
-    }
+    with transaction.atomic():
+        # Lock the tour so that concurrent edits to it are applied one at a time
+        tour_obj = Tour.objects.select_for_update().get(pk=tour_id)
 
-    # `start` is the location with the lowest index; if index 0 is the location
-    # that was removed, then index 1 is the new start
-    start = locs.get(index=locs.aggregate(Min("index"))["index__min"]).location.pk
+        # Get all locations in tour
+        rows = list(TourLocation.objects.select_related("location").filter(tour_id=tour_id))
+        removed = next((row for row in rows if row.location_id == location_id), None)
 
-    # Re-calculate tour with new location added
-    order, _ = calculate_tour(locs_dict, start)
+        # Check if location is in tour
+        if removed is None:
+            # Location is not in tour, so no re-calculation is necessary
+            return HttpResponse(status=200)
 
-    # Update indices in database
-    for index, id in enumerate(order):
-        l = TourLocation.objects.get(tour_id=tour_id, location_id=id)
-        l.index = index
-        l.save()
+        # Current order of the tour, including the removed location
+        tour = [row.location_id for row in sorted(rows, key=lambda x: x.index)]
 
-    return HttpResponse(status=200)
+        # A tour whose fixed end is removed, or would become its first
+        # location, may end anywhere instead; the end is cleared first so that
+        # the location can be deleted below
+        if _loses_end(tour_obj, tour, location_id):
+            tour_obj.mode, tour_obj.end = Tour.Mode.OPEN, None
+            tour_obj.save(update_fields=["mode", "end"])
 
+        # Remove location from TourLocation table
+        rows.remove(removed)
+        removed.delete()
+        response_cache.discard_on_commit(tour_id)
 
-def search_location(request, query):
-    """ API endpoint to use the Nominatim API to search for a location by 
-        name and return a dictionary containing 5 candidates """
-    # Base URL for API
-    url = "https://nominatim.openstreetmap.org/search"
-
-    # Parameters and headers for API call
-    params = {"q": query,               # search query
-            "format": "json",           # return in json format
-            "accept-language": "en",    # return results in English
-            "limit": 5,                 # max number of results returned
+        # No other tours include this location if it has no TourLocation rows
+        # left, so we can delete it from the database
+        Location.objects.filter(pk=location_id, tourlocation__isnull=True).delete()
+
+        # If this was the last location in the tour, no need to recalculate
+        if not rows:
+            return HttpResponse(status=200)
+
+        # Re-calculate tour with location removed and update indices in database
+        order, info = _order_after_remove(tour_id, rows, removed, tour, time_budget_ms,
+                                          tour_obj.mode, tour_obj.end_id)
+        _save_order(rows, order)
+
+    return _solve_in_background(tour_id, rows, order, info, tour_obj.mode, tour_obj.end_id)
+
+
+@csrf_exempt
+def solve_tour(request):
+    """ API endpoint to set how a tour ends and re-calculate it, given the
+        tour's ID and its mode: "cycle" to return to the first location,
+        "open" to end at whichever location is best, or "fixed" to end at the
+        location `end_id`. Optionally takes the milliseconds that may be spent
+        re-calculating the tour. The first location stays first. Responds with
+        how the tour was calculated. """
+    # Load data - `request.body` consists of a tour ID and mode, the ID of the
+    # last location for a fixed end, and optionally a time budget
+    data = json.loads(request.body)
+    tour_id = data.get("tour_id")
+    mode = data.get("mode", Tour.Mode.CYCLE)
+    end = data.get("end_id") if mode == Tour.Mode.FIXED else None
+    try:
+        time_budget_ms = _time_budget(data.get("time_budget_ms"))
+    except (TypeError, ValueError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    if mode not in Tour.Mode.values:
+        return JsonResponse({"error": f"mode must be one of {', '.join(Tour.Mode.values)}"}, status=400)
+
+    with transaction.atomic():
+        # Lock the tour so that concurrent edits to it are applied one at a time
+        tour_obj = Tour.objects.select_for_update().get(pk=tour_id)
+
+        # Current order of the tour
+        rows = list(TourLocation.objects.select_related("location").filter(tour_id=tour_id))
+        tour = [row.location_id for row in sorted(rows, key=lambda x: x.index)]
+
+        # The fixed end has to be one of the tour's locations other than the
+        # first one, so a tour needs at least two locations to have one
+        if mode == Tour.Mode.FIXED and (end not in tour or end == tour[0]):
+            return JsonResponse({"error": "end_id must be a location in the tour other than its first"},
+                                status=400)
+
+        tour_obj.mode, tour_obj.end_id = mode, end
+        tour_obj.save(update_fields=["mode", "end"])
+        response_cache.discard_on_commit(tour_id)
+
+        # A blank tour has nothing to calculate
+        if not rows:
+            return HttpResponse(status=200)
+
+        # Re-calculate the whole tour and update indices in database
+        with timing.phase("solve"):
+            order, _, info = solution_cache.solve(_locations_dict(rows), tour[0], time_budget_ms, mode, end)
+        _save_order(rows, order)
+
+    return _solve_in_background(tour_id, rows, order, info, mode, end)
+
+
+def _loses_end(tour_obj, tour, location_id):
+    """ Whether removing a location from a tour with a fixed end leaves it
+        without a valid end: the end is the removed location, or would become
+        the first location
+
+        :param tour:        Location IDs in their current order, including
+                            the removed location """
+    if tour_obj.end_id is None:
+        return False
+
+    remaining = [id for id in tour if id != location_id]
+    return tour_obj.end_id not in remaining[1:]
+
+
+def _time_budget(value):
+    """ Read the time budget of a request, in milliseconds: None if it was not
+        given, or else at most the MAX_TIME_BUDGET_MS setting
+
+        :raises ValueError: if the budget is not a non-negative number """
+    if value is None:
+        return None
+
+    time_budget_ms = float(value)
+    if not time_budget_ms >= 0:
+        raise ValueError("time_budget_ms must be a non-negative number")
+
+    return min(time_budget_ms, settings.MAX_TIME_BUDGET_MS)
+
+
+def _incremental_info(engine, began, time_budget_ms):
+    """ Describe an incremental update of a tour the way `calculate_tour`
+        describes a calculation """
+    return {
+        "engine": engine,
+        "construction": None,
+        "optimal": False,
+        "gap": None,
+        "elapsed_ms": round((time.perf_counter() - began) * 1000, 3),
+        "time_budget_ms": time_budget_ms,
+        "cached": False,
     }
-    headers = {"User-Agent": "TourGuide"}
 
-    # Make API call
-    response = requests.get(url, params=params, headers=headers).json()
 
-    locations = [
-        {"id": i,
-         "name": loc["name"],
-         "address": loc["display_name"],
-         "latitude": loc["lat"],
-         "longitude": loc["lon"]} for i, loc in enumerate(response)
-    ]
+def _repair_time_limit(began, time_budget_ms):
+    """ Seconds left to repair a tour after an incremental edit that began at
+        `began` """
+    return max(time_budget_ms / 1000 - (time.perf_counter() - began), 0.0)
+
+
+def _locations_dict(rows):
+    """ Turn TourLocation rows into a dictionary of the format:
+        {location_id: (latitude, longitude)} """
+    return {
+        row.location_id: (float(row.location.latitude), float(row.location.longitude))
+        for row in rows
+    }
+
+
+def _order_after_add(tour_id, rows, tour, location_id, time_budget_ms=None, mode=CYCLE, end=None):
+    """ Calculate the order of a tour after a location is added to it
+
+        :param rows:            TourLocation rows of the tour, including the new one
+        :param tour:            Location IDs in their current order, not
+                                including the new location
+        :param time_budget_ms:  Milliseconds that may be spent, or None for
+                                the default
+        :param mode:            The tour's mode (see `Tour.Mode`)
+        :param end:             ID of the tour's last location, for a fixed end
+        :return:                A tuple containing the location IDs in their
+                                new order and how it was calculated (see
+                                `calculate_tour`) """
+    locs_dict = _locations_dict(rows)
+
+    if len(locs_dict) > INCREMENTAL_CUTOFF:
+        began = time.perf_counter()
+        if time_budget_ms is None:
+            time_budget_ms = INCREMENTAL_TIME_BUDGET_MS
+
+        # Add the new location to the tour's distance matrix and insert it
+        # into the current order
+        existing = {id: locs_dict[id] for id in tour}
+        with timing.phase("matrix"):
+            distances, ids, coordinates = grow_distance_matrix(
+                *_tour_matrix(tour_id, existing), location_id, locs_dict[location_id])
+            matrix_cache.put(distances, ids, coordinates)
+        with timing.phase("solve"):
+            order, _ = insert_location(distances, ids, tour, location_id,
+                                       time_limit=_repair_time_limit(began, time_budget_ms),
+                                       mode=mode, end=end)
+        info = _incremental_info("insertion", began, time_budget_ms)
+    else:
+        # Re-calculate tour with new location added; the first location
+        # stays first, or the new location is first if the tour was blank
+        start = tour[0] if tour else location_id
+        with timing.phase("solve"):
+            order, _, info = solution_cache.solve(locs_dict, start, time_budget_ms, mode, end)
+
+    return order, info
+
+
+def _order_after_remove(tour_id, rows, removed, tour, time_budget_ms=None, mode=CYCLE, end=None):
+    """ Calculate the order of a tour after a location is removed from it
+
+        :param rows:            TourLocation rows of the tour, not including
+                                the removed one
+        :param removed:         TourLocation row that was removed
+        :param tour:            Location IDs in their current order, including
+                                the removed location
+        :param time_budget_ms:  Milliseconds that may be spent, or None for
+                                the default
+        :param mode:            The tour's mode (see `Tour.Mode`)
+        :param end:             ID of the tour's last location, for a fixed end
+        :return:                A tuple containing the location IDs in their
+                                new order and how it was calculated (see
+                                `calculate_tour`) """
+    locs_dict = _locations_dict(rows)
+
+    if len(locs_dict) > INCREMENTAL_CUTOFF:
+        began = time.perf_counter()
+        if time_budget_ms is None:
+            time_budget_ms = INCREMENTAL_TIME_BUDGET_MS
+
+        # Remove the location from the tour's distance matrix and splice its
+        # neighbors together
+        existing = _locations_dict(rows + [removed])
+        with timing.phase("matrix"):
+            distances, ids, coordinates = shrink_distance_matrix(
+                *_tour_matrix(tour_id, existing), removed.location_id)
+            matrix_cache.put(distances, ids, coordinates)
+        with timing.phase("solve"):
+            order, _ = remove_location(distances, ids, tour, removed.location_id,
+                                       time_limit=_repair_time_limit(began, time_budget_ms),
+                                       mode=mode, end=end)
+        info = _incremental_info("removal", began, time_budget_ms)
+    else:
+        # `start` is the location with the lowest index; if the first location
+        # was removed, then the location after it is the new start
+        start = next(id for id in tour if id != removed.location_id)
+
+        # Re-calculate tour with location removed
+        with timing.phase("solve"):
+            order, _, info = solution_cache.solve(locs_dict, start, time_budget_ms, mode, end)
+
+    return order, info
+
+
+def _reindex(rows, order):
+    """ Set the index of each TourLocation row to its position in `order` and
+        return the rows whose index changed """
+    positions = {id: index for index, id in enumerate(order)}
+
+    changed = []
+    for row in rows:
+        if row.index != positions[row.location_id]:
+            row.index = positions[row.location_id]
+            changed.append(row)
+
+    return changed
+
+
+@timing.timed("write")
+def _save_order(rows, order):
+    """ Write the new index of each TourLocation row to the database in a
+        single query """
+    changed = _reindex(rows, order)
+    if changed:
+        TourLocation.objects.bulk_update(changed, ["index"])
+
+
+def _solve_in_background(tour_id, rows, order, info, mode=CYCLE, end=None):
+    """ Respond to an edit whose new order has been saved. A large tour's
+        order was only updated incrementally, so a job that keeps improving it
+        is submitted to the solver pool and its ID is returned; smaller tours
+        are already solved.
+
+        :param rows:        TourLocation rows of the tour
+        :param order:       Location IDs in the order that was saved
+        :param info:        How the order was calculated (see `calculate_tour`)
+        :param mode:        The tour's mode (see `Tour.Mode`)
+        :param end:         ID of the tour's last location, for a fixed end
+        :return:            The response to the edit """
+    job_id = _submit_solve(tour_id, rows, order, mode, end)
+    if job_id is None:
+        return JsonResponse({"solver": info})
+
+    return JsonResponse({"job_id": job_id, "solver": info}, status=202)
+
+
+@timing.timed("submit")
+def _submit_solve(tour_id, rows, order, mode=CYCLE, end=None):
+    """ Submit a job to the solver pool that keeps improving a tour, if it is
+        large enough to need one
+
+        :param rows:        TourLocation rows of the tour
+        :param order:       Location IDs in the order that was saved
+        :param mode:        The tour's mode (see `Tour.Mode`)
+        :param end:         ID of the tour's last location, for a fixed end
+        :return:            The job's ID, or None if no job was submitted """
+    if not solver_pool.enabled() or len(order) <= settings.SOLVER_POOL_CUTOFF:
+        return None
+
+    distances, ids, _ = _tour_matrix(tour_id, _locations_dict(rows))
+    return solver_pool.submit(tour_id, distances, ids, order,
+                              functools.partial(_save_solved_order, mode=mode, end=end),
+                              mode=mode, end=end)
+
+
+def _save_solved_order(tour_id, order, mode=CYCLE, end=None):
+    """ Save the order found by a solver job, unless the tour was deleted or
+        its locations or mode changed since the job was submitted. Called from
+        the solver pool's writer thread.
+
+        :return:            Whether the order was saved """
+    with transaction.atomic():
+        # Lock the tour so that the order is not saved over a concurrent edit
+        tour_obj = Tour.objects.select_for_update().filter(pk=tour_id).first()
+        if tour_obj is None or (tour_obj.mode, tour_obj.end_id) != (mode, end):
+            return False
+
+        rows = list(TourLocation.objects.filter(tour_id=tour_id))
+        if {row.location_id for row in rows} != set(order):
+            return False
+
+        _save_order(rows, order)
+        response_cache.discard_on_commit(tour_id)
+
+    return True
+
+
+@timing.timed("matrix")
+def _tour_matrix(tour_id, locs_dict):
+    """ Get the distance matrix, IDs, and coordinates of a tour's locations from
+        the cache, or build them if they are not cached. Above `DENSE_CUTOFF`
+        locations, a `NeighborDistances` provider takes the place of the
+        matrix, as in `calculate_tour`.
+
+        `locs_dict` is a dictionary of the format: {location_id: (latitude, longitude)} """
+    dense = len(locs_dict) <= DENSE_CUTOFF
+
+    # A matrix that grew past the cutoff is replaced by a provider
+    cached = matrix_cache.get(locs_dict)
+    if cached is not None and isinstance(cached[0], np.ndarray) == dense:
+        return cached
+
+    if dense:
+        distances, ids = make_distance_matrix(locs_dict)
+    else:
+        distances, ids = make_distance_provider(locs_dict, "neighbors")
+    coordinates = np.array(list(locs_dict.values()), dtype=np.float64).reshape(-1, 2)
+    return distances, ids, coordinates
+
+
+def distance_cache_stats(request):
+    """ API endpoint to retrieve the hit, miss, and eviction counters and the
+        current size of the distance matrix cache """
+    return JsonResponse(matrix_cache.stats())
+
+
+def solution_cache_stats(request):
+    """ API endpoint to retrieve the hit and miss counters of the solved tour
+        cache """
+    return JsonResponse(solution_cache.stats())
+
+
+def solver_job(request, job_id):
+    """ API endpoint to get the status of a background solve given its job ID.
+        With `?stream=1`, the status is instead streamed as server-sent events
+        until the job finishes. """
+    if solver_pool.status(job_id) is None:
+        return JsonResponse({"error": "No such job"}, status=404)
+
+    if request.GET.get("stream"):
+        return StreamingHttpResponse(_job_events(job_id), content_type="text/event-stream")
+
+    return JsonResponse(solver_pool.status(job_id))
+
+
+def _job_events(job_id):
+    """ Yield a server-sent event each time a job's status changes, until it
+        finishes or the stream times out """
+    deadline = time.monotonic() + JOB_STREAM_TIMEOUT
+    last = None
+
+    while True:
+        job = solver_pool.status(job_id)
+        if job != last:
+            yield f"data: {json.dumps(job)}\n\n"
+            last = job
+
+        if job is None or job["status"] in solver_pool.FINISHED or time.monotonic() > deadline:
+            return
+
+        time.sleep(JOB_STREAM_INTERVAL)
+
+
+def search_location(request, query):
+    """ API endpoint to search for a location by name with the configured
+        geocoder (Nominatim by default, or an offline place index) and return
+        a dictionary containing 5 candidates """
+    try:
+        results = _get_geocoder().search(query, limit=5)
+    except GeocoderError:
+        # The upstream service failed or timed out
+        return JsonResponse({"data": []}, status=502)
+
+    locations = [{"id": i, **loc} for i, loc in enumerate(results)]
 
     # Wrap response in a dictionary for JSON serialization
     as_dict = {"data": locations}
@@ -230,27 +689,42 @@ def search_location(request, query):
     return JsonResponse(as_dict)
 
 
+# Geocoder shared by all requests, created on first use
+_geocoder = None
+
+
+def _get_geocoder():
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = make_geocoder(
+            settings.GEOCODER_BACKEND,
+            settings.GEOCODER_CACHE_PATH,
+            timeout=settings.GEOCODER_TIMEOUT,
+            place_index=settings.GEOCODER_PLACE_INDEX,
+            ttl=settings.GEOCODER_CACHE_TTL,
+            max_entries=settings.GEOCODER_CACHE_MAX_ENTRIES,
+        )
+
+    return _geocoder
+
+
 @csrf_exempt
 def add_location(request):
     """ API endpoint to add a new location into the Locations table
         only if it does not already exist """
     # Load data - `request.body` contains location info
     loc_data = json.loads(request.body)
-    loc = None
 
     # Round latitude and longitude to 6 decimal places for comparison
     loc_data["latitude"] = round(float(loc_data["latitude"]), 6)
     loc_data["longitude"] = round(float(loc_data["longitude"]), 6)
 
-    # Test if location is already in database
-    try:
-        # Assume if two locations have the same exact latitude and longitude, they are the same
-        loc = Location.objects.get(latitude=loc_data["latitude"], longitude=loc_data["longitude"])
-    except:
-        # Location is not yet in the database, so add it
-        loc = Location(name=loc_data["name"], address=loc_data["address"], 
-                       latitude=loc_data["latitude"], longitude=loc_data["longitude"])
-        loc.save()
+    # Assume if two locations have the same exact latitude and longitude, they
+    # are the same; the unique constraint on coordinates makes this safe
+    # against concurrent requests adding the same location
+    loc, _ = Location.objects.get_or_create(
+        latitude=loc_data["latitude"], longitude=loc_data["longitude"],
+        defaults={"name": loc_data["name"], "address": loc_data["address"]})
 
     # Put location data into dictionary and return it as JSON
     loc_dict = {
@@ -262,3 +736,267 @@ def add_location(request):
     }
 
     return JsonResponse(loc_dict)
+
+
+@csrf_exempt
+def import_tour(request):
+    """ API endpoint to create a tour with many locations at once. The body is
+        either JSON of the format {"name": ..., "locations": [{"name": ...,
+        "address": ..., "latitude": ..., "longitude": ...}, ...]}, a GeoJSON
+        FeatureCollection of points, or CSV with those four columns (with
+        Content-Type: text/csv). For GeoJSON and CSV, the tour's name is given
+        by the `name` query parameter. The first location starts the tour.
+        The `time_budget_ms` query parameter limits the milliseconds spent
+        calculating the tour, and the `mode` query parameter sets how it ends
+        (see `solve_tour`); a fixed end is the last location listed. """
+    try:
+        tour_name, locations = _parse_import(request)
+        time_budget_ms = _time_budget(request.GET.get("time_budget_ms"))
+        mode = request.GET.get("mode", Tour.Mode.CYCLE)
+        if mode not in Tour.Mode.values:
+            raise ValueError(f"mode must be one of {', '.join(Tour.Mode.values)}")
+    except (ValueError, KeyError, TypeError, IndexError) as e:
+        return JsonResponse({"error": f"Invalid import: {e}"}, status=400)
+
+    if not locations:
+        return JsonResponse({"error": "No locations to import"}, status=400)
+    if mode == Tour.Mode.FIXED and len(locations) < 2:
+        return JsonResponse({"error": "A fixed end needs at least two locations"}, status=400)
+    if len(locations) > settings.IMPORT_MAX_LOCATIONS:
+        return JsonResponse({"error": f"At most {settings.IMPORT_MAX_LOCATIONS} locations "
+                                      "can be imported at once"}, status=400)
+
+    with transaction.atomic():
+        # Insert every location in a single query; locations whose coordinates
+        # already exist are updated with the imported name and address instead
+        locs = Location.objects.bulk_create(
+            [Location(**loc) for loc in locations], update_conflicts=True,
+            unique_fields=["latitude", "longitude"], update_fields=["name", "address"])
+
+        # Existing locations may belong to other tours, whose cached responses
+        # include their old names
+        others = TourLocation.objects.filter(location__in=locs).values_list("tour_id", flat=True).distinct()
+        for tour_id in others:
+            response_cache.discard_on_commit(tour_id)
+
+        end = locs[-1].pk if mode == Tour.Mode.FIXED else None
+        tour = Tour.objects.create(name=tour_name, mode=mode, end_id=end)
+
+        # Solve the tour once, and write its TourLocation rows in a single query
+        locs_by_id = {loc.pk: loc for loc in locs}
+        with timing.phase("solve"):
+            order, _, info = solution_cache.solve(_coordinates_dict(locs), locs[0].pk, time_budget_ms, mode, end)
+        with timing.phase("write"):
+            rows = TourLocation.objects.bulk_create([
+                TourLocation(tour=tour, location=locs_by_id[id], index=index)
+                for index, id in enumerate(order)
+            ])
+
+    res = _tour_dict(tour, rows)
+    res["solver"] = info
+
+    # Large tours keep being improved in the background
+    job_id = _submit_solve(tour.pk, rows, order, mode, end)
+    if job_id is not None:
+        res["job_id"] = job_id
+
+    return JsonResponse(res)
+
+
+def _parse_import(request):
+    """ Read the tour name and locations from the body of an import request
+
+        :return:            A tuple containing the tour's name and a list of
+                            dictionaries of Location fields, without duplicate
+                            coordinates """
+    if request.content_type == "text/csv":
+        tour_name = request.GET.get("name")
+        rows = csv.DictReader(request.body.decode("utf-8-sig").splitlines())
+        locations = [(row["name"], row.get("address", ""), row["latitude"], row["longitude"]) for row in rows]
+    else:
+        data = json.loads(request.body)
+        if data.get("type") == "FeatureCollection":
+            # GeoJSON coordinates are (longitude, latitude)
+            tour_name = request.GET.get("name", data.get("name"))
+            locations = []
+            for feature in data["features"]:
+                if feature["geometry"]["type"] != "Point":
+                    raise ValueError("only Point features can be imported")
+                properties = feature.get("properties") or {}
+                longitude, latitude = feature["geometry"]["coordinates"][:2]
+                locations.append((properties.get("name", ""), properties.get("address", ""), latitude, longitude))
+        else:
+            tour_name = data.get("name")
+            locations = [(loc["name"], loc.get("address", ""), loc["latitude"], loc["longitude"])
+                         for loc in data["locations"]]
+
+    if not tour_name:
+        raise ValueError("a tour name is required")
+
+    # Round latitude and longitude to 6 decimal places, as in `add_location`;
+    # a location listed twice is only imported once, since an upsert cannot
+    # affect the same row twice
+    unique = {}
+    for name, address, latitude, longitude in locations:
+        coordinates = (round(float(latitude), 6), round(float(longitude), 6))
+        unique.setdefault(coordinates, {
+            "name": (name or "")[:100],
+            "address": (address or "")[:250],
+            "latitude": coordinates[0],
+            "longitude": coordinates[1],
+        })
+
+    return tour_name[:100], list(unique.values())
+
+
+def _coordinates_dict(locs):
+    """ Turn Location objects into a dictionary of the format:
+        {location_id: (latitude, longitude)} """
+    return {loc.pk: (float(loc.latitude), float(loc.longitude)) for loc in locs}
+
+
+# Asynchronous versions of the endpoints, served instead of the ones above when
+# ASYNC_VIEWS is set (the default under ASGI). Database access goes through
+# Django's async ORM and geocoding through an async HTTP client. Anything that
+# needs a transaction, including every edit to a tour and its calculation,
+# runs in a thread as a whole so that it never blocks the event loop.
+
+
+@csrf_exempt
+async def acreate_tour(request):
+    """ Asynchronous version of `create_tour` """
+    data = json.loads(request.body)
+    new_tour = await Tour.objects.acreate(name=data.get("name"))
+
+    res = {
+        "id": new_tour.pk,
+        "name": new_tour.name,
+        "created": new_tour.created,
+        "mode": new_tour.mode,
+        "end": None,
+        "locations": []
+    }
+
+    return JsonResponse(res)
+
+
+async def aget_tour(request, tour_id):
+    """ Asynchronous version of `get_tour` """
+    entry, version = await sync_to_async(response_cache.get)(tour_id)
+
+    if entry is None:
+        tour = await Tour.objects.aget(pk=tour_id)
+        locs = [x async for x in TourLocation.objects.select_related("location").filter(tour=tour_id).order_by("index")]
+        entry = await sync_to_async(response_cache.put)(tour_id, version, _tour_dict(tour, locs))
+
+    return _tour_response(request, entry)
+
+
+@csrf_exempt
+async def adelete_tour(request, tour_id):
+    """ Asynchronous version of `delete_tour` """
+    # Transactions are not available in async code, so the deletion runs in
+    # a thread as a whole
+    await sync_to_async(_delete_tours)([tour_id])
+
+    return HttpResponse(status=200)
+
+
+@csrf_exempt
+async def adelete_tours(request):
+    """ Asynchronous version of `delete_tours` """
+    data = json.loads(request.body)
+    await sync_to_async(_delete_tours)(data.get("tour_ids", []))
+
+    return HttpResponse(status=200)
+
+
+@csrf_exempt
+async def aadd_to_tour(request):
+    """ Asynchronous version of `add_to_tour`. The edit needs a transaction
+        that locks the tour, so it runs in a thread as a whole. """
+    return await sync_to_async(add_to_tour)(request)
+
+
+@csrf_exempt
+async def aremove_from_tour(request):
+    """ Asynchronous version of `remove_from_tour`. The edit needs a
+        transaction that locks the tour, so it runs in a thread as a whole. """
+    return await sync_to_async(remove_from_tour)(request)
+
+
+async def asolver_job(request, job_id):
+    """ Asynchronous version of `solver_job` """
+    if await sync_to_async(solver_pool.status)(job_id) is None:
+        return JsonResponse({"error": "No such job"}, status=404)
+
+    if request.GET.get("stream"):
+        return StreamingHttpResponse(_ajob_events(job_id), content_type="text/event-stream")
+
+    return JsonResponse(await sync_to_async(solver_pool.status)(job_id))
+
+
+async def _ajob_events(job_id):
+    """ Asynchronous version of `_job_events` """
+    deadline = time.monotonic() + JOB_STREAM_TIMEOUT
+    last = None
+
+    while True:
+        job = await sync_to_async(solver_pool.status)(job_id)
+        if job != last:
+            yield f"data: {json.dumps(job)}\n\n"
+            last = job
+
+        if job is None or job["status"] in solver_pool.FINISHED or time.monotonic() > deadline:
+            return
+
+        await asyncio.sleep(JOB_STREAM_INTERVAL)
+
+
+@csrf_exempt
+async def asolve_tour(request):
+    """ Asynchronous version of `solve_tour`, which needs a transaction, so it
+        runs in a thread as a whole """
+    return await sync_to_async(solve_tour)(request)
+
+
+@csrf_exempt
+async def aimport_tour(request):
+    """ Asynchronous version of `import_tour`. The import needs a transaction,
+        so it runs in a thread as a whole. """
+    return await sync_to_async(import_tour)(request)
+
+
+async def asearch_location(request, query):
+    """ Asynchronous version of `search_location` """
+    try:
+        results = await _get_geocoder().asearch(query, limit=5)
+    except GeocoderError:
+        # The upstream service failed or timed out
+        return JsonResponse({"data": []}, status=502)
+
+    locations = [{"id": i, **loc} for i, loc in enumerate(results)]
+
+    return JsonResponse({"data": locations})
+
+
+@csrf_exempt
+async def aadd_location(request):
+    """ Asynchronous version of `add_location` """
+    loc_data = json.loads(request.body)
+    loc_data["latitude"] = round(float(loc_data["latitude"]), 6)
+    loc_data["longitude"] = round(float(loc_data["longitude"]), 6)
+
+    loc, _ = await Location.objects.aget_or_create(
+        latitude=loc_data["latitude"], longitude=loc_data["longitude"],
+        defaults={"name": loc_data["name"], "address": loc_data["address"]})
+
+    loc_dict = {
+        "id": loc.pk,
+        "name": loc.name,
+        "address": loc.address,
+        "latitude": loc.latitude,
+        "longitude": loc.longitude
+    }
+
+    return JsonResponse(loc_dict)
@@ -1,33 +1,253 @@
 import numpy as np
+import collections
 import math
-import itertools
-import sys
+import time
 
+from utils.distances import (SPATIAL_INDEX_CUTOFF, DistanceProvider, NeighborDistances, PathDistances,
+                             make_distance_provider)
+from utils.spatial import SpatialIndex
+
+# version of the solvers below; bump it whenever a change could alter the tours
+# they find, so that previously cached tours (see `utils.solution_cache`) are
+# not reused
+SOLVER_VERSION = 3
+
+# kinds of tour: a cycle that returns to its start, a path from the start that
+# may end anywhere, or a path from the start to a given end
+CYCLE = "cycle"
+OPEN = "open"
+FIXED = "fixed"
+MODES = (CYCLE, OPEN, FIXED)
+
+# ID of the dummy location that turns a path into a tour (see `PathDistances`)
+DUMMY_ID = -1
+
+# heuristics that build the first tour of `calculate_tour` (see `construct_tour`)
+CONSTRUCTIONS = ("nearest_neighbor", "greedy", "christofides", "hilbert", "strip")
+
+# time budget of `calculate_tour` when none is given, in milliseconds
+DEFAULT_TIME_BUDGET_MS = 1000.0
+
+# rough costs of the steps of `calculate_tour`, used to choose the ones that
+# fit in its time budget; measured on a typical laptop
+MATRIX_SECONDS_PER_PAIR = 4e-8                      # make_distance_matrix, per n^2
+NEAREST_NEIGHBOR_SECONDS_PER_PAIR = 1e-8            # nearest_neighbor on a matrix, per n^2
+INDEXED_NEAREST_NEIGHBOR_SECONDS_PER_LOCATION = 1e-4
+GREEDY_SECONDS_PER_PAIR = 1e-8                      # greedy_tour's neighbor lists on a matrix, per n^2
+GREEDY_SECONDS_PER_LOCATION = 1.5e-5                # greedy_tour given neighbor lists
+CHRISTOFIDES_SECONDS_PER_PAIR = 3e-8                # christofides, per n^2
+NEIGHBOR_LISTS_SECONDS_PER_PAIR = 1.2e-8            # NeighborDistances by matrix product, per n^2
+NEIGHBOR_LISTS_SECONDS_PER_LOCATION = 1.4e-4        # NeighborDistances by spatial index
+HELD_KARP_SECONDS_PER_STATE = 5e-8                  # held_karp, per n * 2^n
+
+# greatest number of locations for which a dense distance matrix is built;
+# larger tours compute distances as needed and keep only each location's
+# nearest neighbors (see `utils.distances`)
+DENSE_CUTOFF = 2000
+
+# shortest time left for which branch and bound is started, in seconds; its
+# bound takes some time to compute before the search begins
+BRANCH_AND_BOUND_MIN_SECONDS = 0.05
 
-def calculate_tour(data: dict, start: int) -> tuple[list, float]:
-    distances, ids = make_distance_matrix(data)
-    n = len(distances)
+
+def calculate_tour(data: dict, start: int, time_budget_ms: float = DEFAULT_TIME_BUDGET_MS,
+                   mode: str = CYCLE, end: int = None, construction: str = None) -> tuple[list, float, dict]:
+    """ Find a short tour through a set of locations within a time budget.
+        Solvers run as an anytime pipeline: a tour is first constructed
+        quickly, then the best solver that fits in the time left improves it
+        (Held-Karp or branch and bound for small tours, local search for
+        larger ones), and the best tour found is returned when the budget
+        runs out. Solvers are chosen from rough estimates of how long they
+        take, so the budget may be overrun slightly.
+
+        :param data:            Dictionary of the format {location_id: (latitude, longitude)}
+        :param start:           ID of the starting location
+        :param time_budget_ms:  Wall-clock budget in milliseconds
+        :param mode:            CYCLE for a tour that returns to the start, OPEN
+                                for a path that may end anywhere, or FIXED for a
+                                path that ends at `end`
+        :param end:             ID of the last location, for FIXED
+        :param construction:    Heuristic that builds the first tour, one of
+                                CONSTRUCTIONS, or None to choose one that fits
+                                in the budget
+        :return:                A tuple containing a list of the IDs of the
+                                locations in the order they are visited, the
+                                total cost of the tour, and a dictionary that
+                                describes how the tour was found:
+                                    engine          solver that produced the tour
+                                    construction    heuristic that built the first tour
+                                    optimal         whether the tour is proven optimal
+                                    gap             optimality gap, if known (see
+                                                    `branch_and_bound`)
+                                    elapsed_ms      time taken, in milliseconds
+                                    time_budget_ms  the budget """
+    began = time.perf_counter()
+    deadline = began + max(time_budget_ms, 0) / 1000
+    n = len(data)
+    _check_mode(mode, start, end, n)
+    if construction is not None and construction not in CONSTRUCTIONS:
+        raise ValueError(f"Unknown construction heuristic: {construction}")
 
     # greatest number of locations for which Held-Karp will be used
     CUTOFF = 15
 
-    if n <= 0:
-        return ([], 0.0)
-    elif n == 1:
-        return ([start], 0.0)
-    elif n <= CUTOFF:
-        return held_karp(distances, ids, start)
+    # greatest number of locations for which branch and bound will be used
+    BRANCH_AND_BOUND_CUTOFF = 40
+
+    info = {"engine": None, "construction": None, "optimal": False, "gap": None,
+            "elapsed_ms": 0.0, "time_budget_ms": time_budget_ms}
+
+    def remaining():
+        return deadline - time.perf_counter()
+
+    def finish(tour, cost):
+        info["elapsed_ms"] = round((time.perf_counter() - began) * 1000, 3)
+        return tour, float(cost), info
+
+    if n <= 1:
+        info.update(engine="trivial", optimal=True, gap=0.0)
+        return finish([start] if n else [], 0.0)
+
+    # the exact solvers need a dense matrix; beyond them, a matrix is only
+    # built if it takes a small part of the budget
+    if n <= BRANCH_AND_BOUND_CUTOFF or (n <= DENSE_CUTOFF and n * n * MATRIX_SECONDS_PER_PAIR <= remaining() / 2):
+        distances, ids = make_distance_matrix(data)
+    else:
+        distances, ids = make_distance_provider(data, "lazy")
+
+    # local search on a large tour needs each location's nearest neighbors,
+    # which are only found if that leaves time to search
+    if n <= SPATIAL_INDEX_CUTOFF:
+        lists_time = n * n * NEIGHBOR_LISTS_SECONDS_PER_PAIR
     else:
-        return nearest_neighbor(distances, ids, start)
+        lists_time = n * NEIGHBOR_LISTS_SECONDS_PER_LOCATION
+    if isinstance(distances, DistanceProvider) and lists_time <= remaining() * 0.75:
+        distances = NeighborDistances(distances.lats, distances.longs)
+
+    # construct a first tour with the heuristic that gives the shortest tour
+    # after local search (see `benchmarks.suite`), or a quicker one if it
+    # does not fit in the budget
+    if construction is None:
+        construction = _choose_construction(distances, n, remaining())
+    tour, cost = construct_tour(construction, distances, ids, start, data, mode, end)
+    info.update(engine=construction, construction=construction)
+
+    # then improve it with the best solver that fits in the time left
+    if n <= 2 or n == 3 and mode != OPEN:
+        # there is only one tour, or one path to a fixed end
+        info.update(optimal=True, gap=0.0)
+    elif n <= CUTOFF and n * 2 ** n * HELD_KARP_SECONDS_PER_STATE <= remaining():
+        tour, cost = held_karp(distances, ids, start, mode, end)
+        info.update(engine="held_karp", optimal=True, gap=0.0)
+    elif n <= BRANCH_AND_BOUND_CUTOFF and remaining() >= BRANCH_AND_BOUND_MIN_SECONDS:
+        tour, cost, gap = branch_and_bound(distances, ids, start, remaining(), mode, end)
+        info.update(engine="branch_and_bound", optimal=gap == 0, gap=gap)
+    elif remaining() > 0:
+        # without neighbor lists, each location's neighbors are found as the
+        # search reaches it (see `LazyNeighborLists`), so that the search can
+        # stop whenever the budget runs out
+        if mode == CYCLE:
+            improved, improved_cost = improve_tour(distances, ids, tour, time_limit=max(remaining(), 0))
+        else:
+            improved, improved_cost = improve_path(distances, ids, tour, end, time_limit=max(remaining(), 0))
+        if improved_cost < cost:
+            tour, cost = improved, improved_cost
+            info["engine"] = "local_search"
+
+    return finish(tour, cost)
+
+
+def construct_tour(construction: str, distances: np.ndarray, ids: np.ndarray, start: int, data: dict,
+                   mode: str = CYCLE, end: int = None) -> tuple[list, float]:
+    """ Build a tour with one of the construction heuristics
+
+        :param construction:    One of CONSTRUCTIONS
+        :param distances:       Distance matrix representation of a graph, or
+                                a distance provider; Christofides' heuristic
+                                needs a matrix
+        :param ids:             IDs of the locations
+        :param start:           ID of the starting location
+        :param data:            Dictionary of the format {location_id: (latitude, longitude)},
+                                in the order of `ids`
+        :param mode:            CYCLE, OPEN, or FIXED (see `calculate_tour`)
+        :param end:             ID of the last location, for FIXED
+        :return:                A tuple containing a list of the IDs of the
+                                locations in the order they are visited and
+                                the total cost of the tour """
+    if construction == "nearest_neighbor":
+        return nearest_neighbor(distances, ids, start, mode, end)
+    if construction == "greedy":
+        return greedy_tour(distances, ids, start, mode, end)
+    if construction == "christofides":
+        return christofides(distances, ids, start, mode, end)
+
+    coordinates = np.radians(np.array(list(data.values()), dtype=np.float64)).reshape(-1, 2)
+    if construction == "hilbert":
+        return hilbert_tour(distances, ids, start, coordinates[:, 0], coordinates[:, 1], mode, end)
+    if construction == "strip":
+        return strip_tour(distances, ids, start, coordinates[:, 0], coordinates[:, 1], mode, end)
+
+    raise ValueError(f"Unknown construction heuristic: {construction}")
+
+
+def _choose_construction(distances: np.ndarray, n: int, time_left: float) -> str:
+    """ Choose the construction heuristic of `calculate_tour`: the one that
+        leaves the shortest tour after local search in the benchmarks (see
+        `benchmarks.suite`), if it fits in the time left, or else the next
+        best one that does """
+    # greatest number of locations for which Christofides' heuristic is
+    # preferred; greedy matching does better on larger tours
+    CHRISTOFIDES_CUTOFF = 200
+
+    # heuristics in order of preference, with their estimated times
+    if isinstance(distances, np.ndarray):
+        estimates = {
+            "greedy": n * n * GREEDY_SECONDS_PER_PAIR + n * GREEDY_SECONDS_PER_LOCATION,
+            "nearest_neighbor": n * n * NEAREST_NEIGHBOR_SECONDS_PER_PAIR,
+        }
+        if n <= CHRISTOFIDES_CUTOFF:
+            estimates = {"christofides": n * n * CHRISTOFIDES_SECONDS_PER_PAIR, **estimates}
+    elif isinstance(distances, NeighborDistances):
+        estimates = {"greedy": n * GREEDY_SECONDS_PER_LOCATION}
+    else:
+        estimates = {"nearest_neighbor": n * INDEXED_NEAREST_NEIGHBOR_SECONDS_PER_LOCATION}
+
+    for construction, estimate in estimates.items():
+        if estimate <= time_left:
+            return construction
+
+    # the space-filling curve takes a few microseconds per location
+    return "hilbert"
+
+
+def _check_mode(mode: str, start: int, end: int, n: int):
+    """ Check the mode and end of a tour of `n` locations
+
+        :raises ValueError: if they do not describe a tour """
+    if mode not in MODES:
+        raise ValueError(f"Unknown tour mode: {mode}")
+    if mode == FIXED and (end is None or end == start and n > 1):
+        raise ValueError("A path with a fixed end needs an end other than its start")
 
 
-def held_karp(distances: np.ndarray, ids: np.ndarray, start: int) -> tuple[list, float]:
+def path_cost(distances: np.ndarray, order: np.ndarray, mode: str = CYCLE) -> float:
+    """ Total cost of a tour given the indices of its locations in order,
+        including the edge back to the start if it is a cycle """
+    order = np.asarray(order, dtype=np.int64)
+    following = np.roll(order, -1) if mode == CYCLE else order[1:]
+    return float(np.sum(distances[order[:len(following)], following]))
+
+
+def held_karp(distances: np.ndarray, ids: np.ndarray, start: int,
+              mode: str = CYCLE, end: int = None) -> tuple[list, float]:
     """ Held-Karp algorithm to find the optimal tour through the vertices of a
         strongly connected graph and the total cost of the tour
         
         :param distances:   Distance matrix representation of a graph 
         :param start:       ID of the starting vertex
         :param ids:         IDs of each location
+        :param mode:        CYCLE, OPEN, or FIXED (see `calculate_tour`)
+        :param end:         ID of the last vertex, for FIXED
         :return:            A tuple containing a list of the indices of 
                             the vertices in the order they are visited and
                             the total cost of the tour """
@@ -35,80 +255,86 @@ def held_karp(distances: np.ndarray, ids: np.ndarray, start: int) -> tuple[list,
     # number of cities in tour
     n = len(distances)
 
-    # `opt` is a dictionary of the format:
-    #      {(S, v), (cost, previous_city)}
-    # where `S` = bitmask of cities visited in subtour (1 for visited, 0 otherwise)
-    #       `v` = last node visited in the tour, as an index to cities[]
-    #       `cost` = sum of edge weights, i.e., total cost of the tour
-    #       `previous_city` = second-to-last city visited in tour 
-    # 
-    # `opt` stores optimal subtours that start at `start`, travel through the
-    # cities in `S`, and end at `v`
-    opt = {}
-
-    for i in range(1, n):
-        # the optimal tour from `start` to one other city is the edge between them
-        opt[(1 << i, i)] = (distances[0][i], 0)
+    # a path starts at city 0, so the starting city is moved there
+    if mode != CYCLE:
+        start_index = int(np.where(ids == start)[0][0])
+        cities = np.concatenate(([start_index], np.delete(np.arange(n), start_index)))
+        distances = np.asarray(distances)[np.ix_(cities, cities)]
+        ids = np.asarray(ids)[cities]
 
-    for size in range(2, n):
-        # get all combinations of cities of size `size` not including the start
-        subsets = itertools.combinations(range(1, n), size)
+    # every city except city 0 (the base of the tour) is represented by one
+    # bit; bit `j` of a subset corresponds to city `j + 1`
+    m = n - 1
+    num_subsets = 1 << m
 
-        # iterate through all subsets `S` whose size is i and who do not include the start
-        for S in subsets:
-            # subset `S` represented as a bitmask with a 1 for included
-            # cities and 0 for excluded cities
-            mask = to_bitmask(S)
+    # `cost` and `previous` are dense tables indexed by [S, v], where
+    #       `S` = bitmask of cities visited in subtour (1 for visited, 0 otherwise)
+    #       `v` = last city visited in the subtour, as a bit index into `S`
+    # `cost[S, v]` is the sum of edge weights of the optimal subtour that starts
+    # at city 0, travels through the cities in `S`, and ends at `v`, and
+    # `previous[S, v]` is the second-to-last city visited in that subtour (-1
+    # if the previous city is city 0). Entries where `v` is not in `S` are
+    # never valid and stay at infinity so that they lose every comparison.
+    cost = np.full((num_subsets, m), np.inf, dtype=np.float64)
+    previous = np.full((num_subsets, m), -1, dtype=np.int8)
 
-            # iterate through all `v` in `S`
-            for v in S:
-                min_cost = sys.maxsize
-                previous_city = -1  # last city visited in subtour
-                S_minus_v = mask & ~(1 << v)  # subset `S` with city `v` excluded
+    # edge weights between non-base cities, and from city 0 to every other city
+    inner = np.ascontiguousarray(distances[1:, 1:], dtype=np.float64)
+    from_base = np.asarray(distances[0, 1:], dtype=np.float64)
 
-                # iterate through all cities `u` != `v` in the subset `S` to
-                # find the optimal sub-tour that starts at `start`, goes through 
-                # `S` (not including `v`), goes to `u`, and ends at `v`
-                for u in S:
-                    if u == v:
-                        continue
+    # the optimal tour from city 0 to one other city is the edge between them
+    singletons = 1 << np.arange(m)
+    cost[singletons, np.arange(m)] = from_base
 
-                    new_cost = opt[(S_minus_v, u)][0] + distances[u][v]
+    # group every subset by the number of cities it contains so that each layer
+    # only depends on the layer before it
+    subsets = np.arange(num_subsets)
+    sizes = np.zeros(num_subsets, dtype=np.int8)
+    for bit in range(m):
+        sizes += (subsets >> bit) & 1
+
+    for size in range(2, n):
+        layer = subsets[sizes == size]
 
-                    if new_cost < min_cost:
-                        min_cost = new_cost
-                        previous_city = u
+        # fill in every subset of this size that contains `v` at once
+        for v in range(m):
+            masks = layer[(layer >> v) & 1 == 1]
+            S_minus_v = masks ^ (1 << v)  # subset `S` with city `v` excluded
 
-                opt[(mask, v)] = (min_cost, previous_city)
+            # cost of every sub-tour that goes through `S` (not including `v`),
+            # ends at `u`, and then travels to `v`; `u` outside of `S` is inf
+            candidates = cost[S_minus_v] + inner[:, v]
+
+            # `argmin` picks the lowest `u` on ties, matching a left-to-right scan
+            best = np.argmin(candidates, axis=1)
+            cost[masks, v] = candidates[np.arange(len(masks)), best]
+            previous[masks, v] = best
 
     # all optimal subtours of size (n - 1) have been found - now, we
-    # find the optimal tour of size n
-    min_cost = sys.maxsize
-    previous_city = -1
-    cities_bitmask = (2 ** n) - 2  # bitmask of cities with `start` excluded
-
-    # find shortest path through all cities (excluding `start`) to `start`
-    for v in range(1, n):
-        new_cost = opt[(cities_bitmask, v)][0] + distances[0][v]
-
-        if new_cost < min_cost:
-            min_cost = new_cost
-            previous_city = v
-
-    # reconstruct path
-    tour = [ids[previous_city]]  # start with last city visited
-    while cities_bitmask > 0:
-        # remove previous_city from the bitmask
-        new_mask = cities_bitmask & (~(1 << previous_city))
-
-        # get next-latest city visited in tour
-        _, previous_city = opt[(cities_bitmask, previous_city)]
-        
-        # insert next-latest city at index 0
-        tour.insert(0, ids[previous_city])
+    # find the optimal tour of size n by returning to city 0, or the optimal
+    # path by ending anywhere or at the fixed end
+    cities_bitmask = num_subsets - 1  # bitmask of cities with city 0 excluded
+    if mode == CYCLE:
+        closing = cost[cities_bitmask] + from_base
+    elif mode == OPEN:
+        closing = cost[cities_bitmask]
+    else:
+        closing = np.full(m, np.inf)
+        end_bit = int(np.where(ids == end)[0][0]) - 1
+        closing[end_bit] = cost[cities_bitmask, end_bit]
+    last = int(np.argmin(closing))
+    min_cost = float(closing[last])
 
-        # re-assign bitmask to new mask and iterate
-        cities_bitmask = new_mask
+    # reconstruct path, starting with the last city visited
+    tour = []
+    while last != -1:
+        tour.append(last + 1)
+        previous_city = int(previous[cities_bitmask, last])
+        cities_bitmask &= ~(1 << last)
+        last = previous_city
+    tour.append(0)
+    tour.reverse()
+    tour = [ids[i] for i in tour]
 
     # since TSP solution is a Hamiltonian cycle, starting location is
     # arbitrary - we simply rotate the list to get the right starting point
@@ -117,80 +343,1223 @@ def held_karp(distances: np.ndarray, ids: np.ndarray, start: int) -> tuple[list,
 
     return tour, min_cost
 
-    
-def to_bitmask(combination: tuple[int]):
-    """ Convert a tuple of integers into a bitmask """
-    mask = 0
-    for bit in combination:
-        # add a `1` at each index (0-based, right-to-left) specified in the tuple
-        # e.g., (2, 5, 6, 7) returns `0b11100100`
-        mask |= 1 << bit
 
-    return mask 
+def branch_and_bound(distances: np.ndarray, ids: np.ndarray, start: int,
+                     time_budget: float = 1.0, mode: str = CYCLE, end: int = None) -> tuple[list, float, float]:
+    """ Depth-first branch and bound algorithm to find the optimal tour through
+        the vertices of a strongly connected graph within a time budget. The
+        nearest neighbor tour improved by local search is used as the initial
+        upper bound, and partial tours are pruned with a minimum spanning tree
+        bound strengthened by Held-Karp (1-tree) vertex penalties.
+
+        :param distances:   Distance matrix representation of a graph
+        :param ids:         IDs of each location
+        :param start:       ID of the starting vertex
+        :param time_budget: Wall-clock budget in seconds for the search
+        :param mode:        CYCLE, OPEN, or FIXED (see `calculate_tour`); a
+                            path is found as a tour that goes from the start
+                            to a dummy vertex and back to the start through
+                            every other vertex
+        :param end:         ID of the last vertex, for FIXED
+        :return:            A tuple containing a list of the IDs of the
+                            vertices in the order they are visited, the total
+                            cost of the tour, and the optimality gap, i.e.,
+                            the fraction by which the tour may exceed the
+                            optimal tour (0.0 if the tour is proven optimal) """
+    deadline = time.perf_counter() + time_budget
+    n = len(distances)
+    start_index = int(np.where(ids == start)[0][0])
+    indices = np.arange(n)
+
+    if mode != CYCLE:
+        # initial upper bound: a path found by the heuristics
+        path, cost = nearest_neighbor(distances, indices, start_index, mode,
+                                      None if end is None else int(np.where(ids == end)[0][0]))
+        path, cost = improve_path(distances, indices, path, path[-1] if mode == FIXED else None,
+                                  time_limit=time_budget / 4)
+
+        # the search always goes from the start to a dummy vertex that is
+        # free to reach from anywhere (and then to the end, for FIXED), so
+        # the dummy's other edge leads to the end of the path and every tour
+        # costs exactly as much as its path
+        wrapped = np.zeros((n + 1, n + 1))
+        wrapped[:n, :n] = distances
+        prefix = [start_index, n] + ([path[-1]] if mode == FIXED else [])
+        tour, cost, gap = _branch_and_bound(wrapped, prefix, [start_index, n] + path[:0:-1], cost, deadline)
+
+        # the tour is the path backwards after the start and the dummy
+        path = [start_index] + tour[:1:-1]
+        return [int(ids[i]) for i in path], cost, gap
+
+    # initial upper bound: nearest neighbor followed by local search, in
+    # terms of indices rather than IDs
+    best_tour, _ = nearest_neighbor(distances, indices, start_index)
+    best_tour, best_cost = improve_tour(distances, indices, best_tour, time_limit=time_budget / 4)
+
+    tour, cost, gap = _branch_and_bound(distances, [start_index], best_tour, best_cost, deadline)
+    return [int(ids[i]) for i in tour], cost, gap
+
+
+def _branch_and_bound(distances: np.ndarray, prefix: list, best_tour: list, best_cost: float,
+                      deadline: float) -> tuple[list, float, float]:
+    """ Search of `branch_and_bound` for the shortest tour that begins with
+        the cities in `prefix`, in terms of indices
+
+        :param best_tour:   A tour that begins with `prefix`, as the initial
+                            upper bound
+        :param best_cost:   Cost of `best_tour`
+        :param deadline:    Time at which the search stops
+        :return:            A tuple containing the best tour found, its cost,
+                            and its optimality gap """
+    n = len(distances)
+    start_index = prefix[0]
+
+    # vertex penalties for the lower bound and the root lower bound itself
+    penalties, root_bound = held_karp_penalties(distances, best_cost)
+
+    # each stack entry is a partial tour of the format:
+    #      (bound, cost, path, visited)
+    # where `bound` = lower bound of any tour that extends `path` (this is the
+    #                 parent's bound until the entry is popped and evaluated)
+    #       `cost` = sum of edge weights along `path`
+    #       `path` = indices of the cities visited so far, starting at `start`
+    #       `visited` = bitmask of the cities in `path`
+    stack = [(root_bound, path_cost(distances, prefix, OPEN), list(prefix), sum(1 << v for v in prefix))]
+    complete = True
+
+    while stack:
+        if time.perf_counter() > deadline:
+            complete = False
+            break
+
+        bound, cost, path, visited = stack.pop()
+        if bound >= best_cost:
+            continue
+
+        current = path[-1]
+        unvisited = [v for v in range(n) if not visited & (1 << v)]
+
+        # only one city remains, so the tour is fully determined
+        if len(unvisited) == 1:
+            last = unvisited[0]
+            total = cost + distances[current][last] + distances[last][start_index]
+            if total < best_cost:
+                best_cost = total
+                best_tour = path + [last]
+            continue
+
+        if len(path) > 1:
+            bound = cost + path_bound(distances, penalties, unvisited, current, start_index)
+            if bound >= best_cost:
+                continue
+
+        # push children so that the nearest unvisited city is explored first
+        for v in sorted(unvisited, key=lambda v: distances[current][v], reverse=True):
+            child_cost = cost + distances[current][v]
+            if child_cost < best_cost:
+                stack.append((bound, child_cost, path + [v], visited | (1 << v)))
+
+    if complete:
+        gap = 0.0
+    else:
+        # every tour that has not been ruled out extends a partial tour that is
+        # still on the stack, so the smallest bound there bounds the optimum
+        lower_bound = min([best_cost] + [entry[0] for entry in stack])
+        gap = float((best_cost - lower_bound) / best_cost) if best_cost > 0 else 0.0
+
+    return [int(i) for i in best_tour], float(best_cost), max(gap, 0.0)
+
+
+def held_karp_penalties(distances: np.ndarray, upper_bound: float,
+                        iterations: int = 100) -> tuple[np.ndarray, float]:
+    """ Subgradient optimization of the Held-Karp (1-tree) lower bound
 
+        :param distances:   Distance matrix representation of a graph
+        :param upper_bound: Cost of a known tour, used to size each step
+        :param iterations:  Maximum number of subgradient steps
+        :return:            A tuple containing the vertex penalties that gave
+                            the best lower bound and the lower bound itself """
+    n = len(distances)
+    penalties = np.zeros(n)
+    best_penalties = penalties.copy()
+    best_bound = -np.inf
+    step_size = 2.0
+
+    for _ in range(iterations):
+        # modified edge weights: d'(u, v) = d(u, v) + pi(u) + pi(v)
+        modified = distances + penalties[:, None] + penalties[None, :]
+
+        # a 1-tree is a spanning tree on cities 1..n-1 plus the two cheapest
+        # edges from city 0
+        tree_cost, degrees = minimum_spanning_tree(modified, np.arange(1, n))
+        nearest = np.argsort(modified[0, 1:])[:2] + 1
+        tree_cost += modified[0, nearest].sum()
+        degrees[nearest] += 1
+        degrees[0] = 2
+
+        bound = tree_cost - 2 * penalties.sum()
+        if bound > best_bound:
+            best_bound = bound
+            best_penalties = penalties.copy()
+
+        # every city has degree 2 in a tour, so a 1-tree with that property is
+        # an optimal tour and the bound cannot be improved
+        subgradient = degrees - 2
+        norm = (subgradient ** 2).sum()
+        if norm == 0:
+            break
+
+        penalties = penalties + step_size * (upper_bound - bound) / norm * subgradient
+        step_size *= 0.95
+
+    return best_penalties, float(best_bound)
+
+
+def path_bound(distances: np.ndarray, penalties: np.ndarray, unvisited: list,
+               current: int, end: int) -> float:
+    """ Lower bound on the cost of a path from `current` to `end` that passes
+        through every city in `unvisited`
+
+        Such a path is a spanning tree of its cities in which the endpoints have
+        degree 1 and every other city has degree 2, so the minimum spanning tree
+        under the penalized edge weights, less the penalties the path must
+        pay, is a lower bound on its cost. """
+    nodes = np.array(unvisited + [current, end])
+    modified = (distances[np.ix_(nodes, nodes)]
+                + penalties[nodes][:, None] + penalties[nodes][None, :])
+    tree_cost, _ = minimum_spanning_tree(modified, np.arange(len(nodes)))
+
+    return tree_cost - 2 * penalties[unvisited].sum() - penalties[current] - penalties[end]
+
+
+def minimum_spanning_tree(distances: np.ndarray, nodes: np.ndarray) -> tuple[float, np.ndarray]:
+    """ Prim's algorithm to find the minimum spanning tree of a subset of the
+        vertices of a complete graph
+
+        :param distances:   Distance matrix representation of a graph
+        :param nodes:       Indices of the vertices to span
+        :return:            A tuple containing the total cost of the tree and
+                            the degree of every vertex of the graph in it """
+    total, parent = _prim(distances, nodes)
+
+    # every node but the first is joined to its parent by one edge
+    degrees = (np.bincount(nodes[1:], minlength=len(distances))
+               + np.bincount(nodes[parent[1:]], minlength=len(distances)))
+    return total, degrees
+
+
+def _prim(distances: np.ndarray, nodes: np.ndarray) -> tuple[float, np.ndarray]:
+    """ Prim's algorithm on a subset of the vertices of a complete graph
+
+        :return:            A tuple containing the total cost of the tree and
+                            the position in `nodes` of the parent of each node;
+                            the first node is the root and its own parent """
+    in_tree = np.zeros(len(nodes), dtype=bool)
+    in_tree[0] = True
 
-def nearest_neighbor(distances: np.ndarray, ids: np.ndarray, start: int) -> tuple[list, float]:
+    # cheapest edge connecting each node to the tree, and the tree node it
+    # connects to
+    cheapest = distances[nodes[0], nodes].astype(np.float64)
+    parent = np.zeros(len(nodes), dtype=np.int64)
+    cheapest[0] = np.inf
+    total = 0.0
+
+    for _ in range(len(nodes) - 1):
+        nearest = int(np.argmin(cheapest))
+        total += cheapest[nearest]
+
+        in_tree[nearest] = True
+        cheapest[nearest] = np.inf
+
+        # update the cheapest edges with edges from the new tree node
+        row = distances[nodes[nearest], nodes]
+        closer = (row < cheapest) & ~in_tree
+        cheapest[closer] = row[closer]
+        parent[closer] = nearest
+
+    return float(total), parent
+
+
+def nearest_neighbor(distances: np.ndarray, ids: np.ndarray, start: int,
+                     mode: str = CYCLE, end: int = None) -> tuple[list, float]:
     """ Nearest Neighbor algorithm to approximate the optimal tour and the 
         length of the shortest tour of a strongly connected graph
         
-        :param distances:   Distance matrix representation of a graph 
+        :param distances:   Distance matrix representation of a graph, or a
+                            distance provider (see `utils.distances`)
         :param ids:         IDs of the locations
         :param start:       ID of the starting vertex
+        :param mode:        CYCLE, OPEN, or FIXED (see `calculate_tour`)
+        :param end:         ID of the last vertex, for FIXED; it is only
+                            visited once every other vertex has been
         :return:            A tuple containing a list of the indices of 
                             the vertices in the order they are visited and
                             the total cost of the tour"""
-    
-    # all cities except `start` are initialized as False (unvisited)
-    visited = [False for _ in distances]
+    n = len(distances)
     start_index = np.where(ids == start)[0][0]  # get index of starting city
-    visited[start_index] = True
+
+    # distance providers compute rows as needed, so a spatial index finds the
+    # nearest unvisited city instead of a scan of the current city's row
+    if isinstance(distances, DistanceProvider):
+        return indexed_nearest_neighbor(SpatialIndex(distances.lats, distances.longs), ids, start, mode, end)
+
+    # `penalty` is inf for visited cities and 0 for unvisited cities, so that
+    # adding it to a row of the distance matrix masks out visited cities; the
+    # fixed end is masked out until the last step
+    penalty = np.zeros(n)
+    penalty[start_index] = np.inf
+    steps = n
+    if mode == FIXED and n > 1:
+        end_index = int(np.where(ids == end)[0][0])
+        penalty[end_index] = np.inf
+        steps = n - 1
+    row = np.empty(n)  # reused buffer for the masked row
 
     # `start` is the first city
     current = start_index
-    tour = [start_index]
+    tour = np.empty(n, dtype=np.int64)
+    tour[0] = start_index
     tour_length = 0
 
-    # iterate until all cities have been visited
-    while False in visited:
-        min_edge = sys.maxsize  # lowest edge weight
-        min_index = 0           # index of edge with lowest weight
-
-        # find the minimum edge that connects current city to some unvisited city
-        for i, edge in enumerate(distances[current]):
-            if (not visited[i]) and i != current and edge < min_edge:
-                min_edge = edge
-                min_index = i
-        
-        # set `current` to unvisited city with smallest edge weight
-        current = min_index
+    for step in range(1, steps):
+        # find the minimum edge that connects current city to some unvisited
+        # city; `argmin` returns the lowest index on ties
+        np.add(distances[current], penalty, out=row)
+        current = int(np.argmin(row))
 
-        # add unvisited city to tour
-        tour.append(current)
-        tour_length += min_edge
-        
-        # mark `current` as visited
-        visited[current] = True
+        # add unvisited city to tour and mark it as visited
+        tour[step] = current
+        tour_length += row[current]
+        penalty[current] = np.inf
 
-    # add distance from last visited city to start
-    tour_length += distances[tour[-1]][start_index]
+    if steps < n:
+        # the fixed end is last
+        tour[-1] = end_index
+        tour_length += distances[current, end_index]
+    elif mode == CYCLE:
+        # add distance from last visited city to start
+        tour_length += distances[tour[-1], start_index]
 
     # map location IDs onto indices of tour so that final tour is in terms of
     # IDs and not indices 0 through n
-    tour = list(map(lambda x: int(ids[x]), tour))
+    tour = ids[tour].tolist()
     
     return tour, tour_length
 
 
-def make_distance_matrix(vertices: dict) -> tuple[np.ndarray, np.ndarray]:
-    """ Creates a matrix of distances given a dictionary of names and coordinates """
+def indexed_nearest_neighbor(index: SpatialIndex, ids: np.ndarray, start: int,
+                             mode: str = CYCLE, end: int = None) -> tuple[list, float]:
+    """ Nearest Neighbor algorithm using a spatial index of the cities, which
+        takes roughly O(n log n) time rather than the O(n^2) of scanning rows
+        of a distance matrix. The index's points are deleted as they are
+        visited.
+
+        :param index:       Spatial index of the cities, in the order of `ids`
+        :param ids:         IDs of the locations
+        :param start:       ID of the starting vertex
+        :param mode:        CYCLE, OPEN, or FIXED (see `calculate_tour`)
+        :param end:         ID of the last vertex, for FIXED
+        :return:            A tuple containing a list of the IDs of the
+                            vertices in the order they are visited and the
+                            total cost of the tour """
+    start_index = int(np.where(ids == start)[0][0])
+    n = len(ids)
+
+    current = start_index
+    tour = np.empty(n, dtype=np.int64)
+    tour[0] = start_index
+    tour_length = 0.0
+    index.delete(current)
+
+    # the fixed end is left out of the index until the last step
+    steps = n
+    if mode == FIXED and n > 1:
+        end_index = int(np.where(ids == end)[0][0])
+        index.delete(end_index)
+        steps = n - 1
+
+    for step in range(1, steps):
+        # the nearest unvisited city is the nearest city left in the index
+        nearest, distance = index.nearest(current)
+        current = int(nearest[0])
+
+        tour[step] = current
+        tour_length += float(distance[0])
+        index.delete(current)
+
+    if steps < n:
+        tour[-1] = end_index
+        tour_length += index.distance(current, end_index)
+    elif mode == CYCLE:
+        # add distance from last visited city to start
+        tour_length += index.distance(tour[-1], start_index)
+
+    return ids[tour].tolist(), tour_length
+
+
+def multi_start_nearest_neighbor(distances: np.ndarray, ids: np.ndarray, start: int,
+                                 starts: int = None, seed: int = None) -> tuple[list, float]:
+    """ Run the Nearest Neighbor algorithm from several starting cities at
+        once and keep the shortest tour, rotated so that it begins at `start`
+
+        :param distances:   Distance matrix representation of a graph
+        :param ids:         IDs of the locations
+        :param start:       ID of the starting vertex
+        :param starts:      Number of starting cities to sample (`start` is
+                            always included); every city is tried if None
+        :param seed:        Seed for sampling the starting cities
+        :return:            A tuple containing a list of the IDs of the
+                            vertices in the order they are visited and the
+                            total cost of the tour """
+    n = len(distances)
+    start_index = int(np.where(ids == start)[0][0])
+
+    if starts is None or starts >= n:
+        origins = np.arange(n)
+    else:
+        others = np.delete(np.arange(n), start_index)
+        sampled = np.random.default_rng(seed).choice(others, size=max(starts - 1, 0), replace=False)
+        origins = np.concatenate(([start_index], sampled))
+
+    # each row is an independent nearest neighbor run, advanced in lockstep
+    k = len(origins)
+    runs = np.arange(k)
+    penalty = np.zeros((k, n))
+    penalty[runs, origins] = np.inf
+    rows = np.empty((k, n))
+
+    tours = np.empty((k, n), dtype=np.int64)
+    tours[:, 0] = origins
+    lengths = np.zeros(k)
+    current = origins
+
+    for step in range(1, n):
+        np.add(distances[current], penalty, out=rows)
+        current = np.argmin(rows, axis=1)
+
+        tours[:, step] = current
+        lengths += rows[runs, current]
+        penalty[runs, current] = np.inf
+
+    lengths += distances[current, origins]
+
+    # the shortest cycle is rotated so that it begins at `start`
+    best = int(np.argmin(lengths))
+    tour = tours[best].tolist()
+    tour = rotate(tour, -tour.index(start_index))
+
+    return ids[tour].tolist(), lengths[best]
+
+
+def strip_tour(distances: np.ndarray, ids: np.ndarray, start: int, lats: np.ndarray,
+               longs: np.ndarray, mode: str = CYCLE, end: int = None) -> tuple[list, float]:
+    """ Strip heuristic: divide the locations into about sqrt(n / 2) strips of
+        equal width from west to east, and visit the strips in turn, going
+        north through one strip and south through the next. Takes O(n log n)
+        time, much less than Nearest Neighbor on a large tour, but finds a
+        longer tour.
+
+        :param distances:   Distance matrix representation of a graph, or a
+                            distance provider (see `utils.distances`)
+        :param ids:         IDs of the locations
+        :param start:       ID of the starting vertex
+        :param lats:        Latitudes of the locations, in radians
+        :param longs:       Longitudes of the locations, in radians
+        :param mode:        CYCLE, OPEN, or FIXED (see `calculate_tour`)
+        :param end:         ID of the last vertex, for FIXED
+        :return:            A tuple containing a list of the IDs of the
+                            vertices in the order they are visited and the
+                            total cost of the tour """
+    n = len(ids)
+    start_index = int(np.where(ids == start)[0][0])
+
+    strips = max(1, math.ceil(math.sqrt(n / 2)))
+    width = (longs.max() - longs.min()) / strips or 1.0
+    strip = np.minimum(((longs - longs.min()) / width).astype(np.int64), strips - 1)
+
+    # sort by strip, then by latitude, which is negated in every other strip
+    order = np.lexsort((np.where(strip % 2 == 1, -lats, lats), strip))
+
+    order = _cycle_to_path(distances, order, ids, start, mode, end)
+    return ids[order].tolist(), path_cost(distances, order, mode)
+
+
+def hilbert_tour(distances: np.ndarray, ids: np.ndarray, start: int, lats: np.ndarray,
+                 longs: np.ndarray, mode: str = CYCLE, end: int = None) -> tuple[list, float]:
+    """ Space-filling curve heuristic: visit the locations in the order in
+        which a Hilbert curve over their bounding box passes them. Locations
+        close together on the curve are close together on the map, so the
+        tour is usually 25-40% longer than optimal. Takes O(n log n) time, like
+        the strip heuristic, but finds much shorter tours of clustered
+        locations, whose strips cut through clusters.
+
+        :param distances:   Distance matrix representation of a graph, or a
+                            distance provider (see `utils.distances`)
+        :param ids:         IDs of the locations
+        :param start:       ID of the starting vertex
+        :param lats:        Latitudes of the locations, in radians
+        :param longs:       Longitudes of the locations, in radians
+        :param mode:        CYCLE, OPEN, or FIXED (see `calculate_tour`)
+        :param end:         ID of the last vertex, for FIXED
+        :return:            A tuple containing a list of the IDs of the
+                            vertices in the order they are visited and the
+                            total cost of the tour """
+    # number of levels of the curve; the grid has 2^ORDER cells per side
+    ORDER = 16
+
+    # project the locations onto a plane in which east-west and north-south
+    # distances have about the same scale, then onto the grid
+    x = (longs - longs.min()) * math.cos(float(np.mean(lats)))
+    y = lats - lats.min()
+    scale = (2 ** ORDER - 1) / (max(x.max(), y.max()) or 1.0)
+    x = (x * scale).astype(np.int64)
+    y = (y * scale).astype(np.int64)
+
+    # position of each cell along the curve, computed one level at a time
+    # from the largest quadrants down, for every location at once
+    position = np.zeros(len(ids), dtype=np.int64)
+    side = 2 ** ORDER
+    level = side // 2
+    while level > 0:
+        right = (x & level) > 0
+        top = (y & level) > 0
+        position += level * level * ((3 * right) ^ top)
+
+        # rotate and reflect the quadrant so that the curve within it has the
+        # same orientation as at the level above
+        flip = right & ~top
+        x = np.where(flip, side - 1 - x, x)
+        y = np.where(flip, side - 1 - y, y)
+        x, y = np.where(top, x, y), np.where(top, y, x)
+        level //= 2
+
+    order = _cycle_to_path(distances, np.argsort(position, kind="stable"), ids, start, mode, end)
+    return ids[order].tolist(), path_cost(distances, order, mode)
+
+
+def greedy_tour(distances: np.ndarray, ids: np.ndarray, start: int, mode: str = CYCLE,
+                end: int = None, neighbors: int = 10) -> tuple[list, float]:
+    """ Greedy edge matching: add edges to the tour shortest first, skipping
+        any that would give a location a third edge or close a cycle early,
+        until the edges form paths through every location; the paths are then
+        joined into a tour. Usually 10-20% longer than optimal, shorter than a
+        Nearest Neighbor tour, and a better start for local search.
+        Only edges to each location's `neighbors` nearest locations are
+        considered, so most of the time goes to finding neighbor lists.
+
+        :param distances:   Distance matrix representation of a graph, or a
+                            distance provider (see `utils.distances`)
+        :param ids:         IDs of the locations
+        :param start:       ID of the starting vertex
+        :param mode:        CYCLE, OPEN, or FIXED (see `calculate_tour`)
+        :param end:         ID of the last vertex, for FIXED
+        :param neighbors:   Number of candidate edges per location
+        :return:            A tuple containing a list of the IDs of the
+                            vertices in the order they are visited and the
+                            total cost of the tour """
+    n = len(ids)
+    if n <= 3:
+        order = _cycle_to_path(distances, np.arange(n), ids, start, mode, end)
+        return ids[order].tolist(), path_cost(distances, order, mode)
+
+    # the start of a path, and its fixed end, only get one edge
+    start_index = int(np.where(ids == start)[0][0])
+    end_index = int(np.where(ids == end)[0][0]) if mode == FIXED else None
+    capacity = [2] * n
+    if mode != CYCLE:
+        capacity[start_index] = 1
+    if end_index is not None:
+        capacity[end_index] = 1
+
+    # candidate edges, each listed once, shortest first
+    candidates = neighbor_lists(distances, neighbors)
+    first = np.repeat(np.arange(n), candidates.shape[1])
+    second = candidates.ravel()
+    edges = np.unique(np.minimum(first, second) * n + np.maximum(first, second))
+    first, second = edges // n, edges % n
+    shortest = np.argsort(distances[first, second], kind="stable")
+
+    # each location's neighbors in the tour so far, and a union-find forest of
+    # the paths they form, to skip edges that would close a cycle; the start
+    # and a fixed end are never joined, so that a path can go from one to the
+    # other
+    links = [[] for _ in range(n)]
+    root = list(range(n))
+    if end_index is not None:
+        root[end_index] = start_index
+
+    def find(i):
+        while root[i] != i:
+            root[i] = root[root[i]]
+            i = root[i]
+        return i
+
+    added = 0
+    for a, b in zip(first[shortest].tolist(), second[shortest].tolist()):
+        if len(links[a]) == capacity[a] or len(links[b]) == capacity[b]:
+            continue
+        root_a, root_b = find(a), find(b)
+        if root_a == root_b:
+            continue
+
+        root[root_a] = root_b
+        links[a].append(b)
+        links[b].append(a)
+        added += 1
+        if added == n - 1:
+            break
+
+    # a cycle may begin from the end of any path
+    first = start_index if mode != CYCLE else next(i for i in range(n) if len(links[i]) < 2)
+    order = _join_paths(distances, links, first, end_index)
+    order = _cycle_to_path(distances, order, ids, start, mode, end)
+    return ids[order].tolist(), path_cost(distances, order, mode)
+
+
+def _join_paths(distances: np.ndarray, links: list, first: int, last: int = None) -> np.ndarray:
+    """ Join disjoint paths through every location into a tour, going from the
+        end of each path to the nearest end of a path not yet in the tour
+
+        :param links:       Neighbors of each location in its path; every
+                            location has at most two, and a location with none
+                            is a path by itself
+        :param first:       End of the path to begin from
+        :param last:        End of a path to finish at, or None
+        :return:            Indices of the locations in the order they are
+                            visited """
+    # ends of paths, and whether their path is not yet in the tour
+    ends = np.array([i for i in range(len(links)) if len(links[i]) < 2], dtype=np.int64)
+    position = {int(i): k for k, i in enumerate(ends)}
+    left = np.ones(len(ends), dtype=bool)
+
+    # the path that finishes at `last` is entered from its other end, `final`,
+    # after every other path
+    final = None if last is None else _other_end(links, last)
+    closing = np.isin(ends, [last, final]) if last is not None else np.zeros(len(ends), dtype=bool)
+
+    tour = []
+    current = first
+    while True:
+        # follow the path from one end to the other
+        left[position[current]] = False
+        previous = -1
+        while True:
+            tour.append(current)
+            following = [i for i in links[current] if i != previous]
+            if not following:
+                break
+            previous, current = current, following[0]
+        left[position[current]] = False
+
+        if not left.any():
+            return np.array(tour, dtype=np.int64)
+
+        # go on to the nearest end of another path
+        candidates = ends[left & ~closing]
+        if len(candidates) == 0:
+            current = final
+        else:
+            current = int(candidates[np.argmin(distances[current, candidates])])
+
+
+def _other_end(links: list, i: int) -> int:
+    """ Get the other end of the path that ends at `i` """
+    previous = -1
+    while True:
+        following = [j for j in links[i] if j != previous]
+        if not following:
+            return i
+        previous, i = i, following[0]
+
+
+def christofides(distances: np.ndarray, ids: np.ndarray, start: int, mode: str = CYCLE,
+                 end: int = None, neighbors: int = 10) -> tuple[list, float]:
+    """ Christofides' heuristic: take a minimum spanning tree, add a matching of
+        the locations with an odd number of edges in it, and shortcut an Euler
+        tour of the result. The matching is found greedily, shortest edge
+        first, rather than as a minimum weight perfect matching, so the tour
+        loses the guarantee of being at most 50% longer than optimal, but is
+        usually within about 10-15% of optimal. The spanning tree takes O(n^2)
+        time, so this needs a dense distance matrix.
+
+        :param distances:   Distance matrix representation of a graph
+        :param ids:         IDs of the locations
+        :param start:       ID of the starting vertex
+        :param mode:        CYCLE, OPEN, or FIXED (see `calculate_tour`)
+        :param end:         ID of the last vertex, for FIXED
+        :param neighbors:   Number of candidate edges per odd location for the
+                            matching; the few locations left unmatched are
+                            then matched among themselves
+        :return:            A tuple containing a list of the IDs of the
+                            vertices in the order they are visited and the
+                            total cost of the tour """
+    n = len(ids)
+    if n <= 3:
+        order = _cycle_to_path(distances, np.arange(n), ids, start, mode, end)
+        return ids[order].tolist(), path_cost(distances, order, mode)
+
+    start_index = int(np.where(ids == start)[0][0])
+    end_index = int(np.where(ids == end)[0][0]) if mode == FIXED else None
+
+    _, parent = _prim(distances, np.arange(n))
+    links = [[] for _ in range(n)]
+    for child, p in enumerate(parent[1:].tolist(), start=1):
+        links[child].append(p)
+        links[p].append(child)
+
+    # a tour needs an even number of edges at every location, and a path an
+    # odd number at its ends, so the locations to match are those whose
+    # number of edges is wrong; a path that may end anywhere leaves one of
+    # them unmatched, and ends there
+    wrong = np.array([len(edges) % 2 == 1 for edges in links])
+    if mode != CYCLE:
+        wrong[start_index] = not wrong[start_index]
+    if end_index is not None:
+        wrong[end_index] = not wrong[end_index]
+
+    # match them greedily, first along each one's nearest such locations, then
+    # the rest among themselves
+    unmatched = np.flatnonzero(wrong)
+    for k in (neighbors, None):
+        if len(unmatched) == 0:
+            break
+        among = distances[np.ix_(unmatched, unmatched)]
+        if k is None or k >= len(unmatched) - 1:
+            first, second = np.triu_indices(len(unmatched), 1)
+        else:
+            lists = neighbor_lists(among, k)
+            first = np.repeat(np.arange(len(unmatched)), k)
+            second = lists.ravel()
+        shortest = np.argsort(among[first, second], kind="stable")
+
+        matched = np.zeros(len(unmatched), dtype=bool)
+        for a, b in zip(first[shortest].tolist(), second[shortest].tolist()):
+            if matched[a] or matched[b]:
+                continue
+            matched[a] = matched[b] = True
+            links[int(unmatched[a])].append(int(unmatched[b]))
+            links[int(unmatched[b])].append(int(unmatched[a]))
+        unmatched = unmatched[~matched]
+
+    # a path is closed into a tour through a dummy location `n` between its
+    # ends, which is left out again below
+    begin = 0
+    if mode != CYCLE:
+        last = end_index if end_index is not None else int(unmatched[0])
+        links.append([start_index, last])
+        links[start_index].append(n)
+        links[last].append(n)
+        begin = n
+
+    # every location now has an even number of edges, so there is an Euler
+    # tour, found with Hierholzer's algorithm; each location is kept where
+    # the Euler tour first visits it
+    visited = np.zeros(len(links), dtype=bool)
+    order = []
+    stack = [begin]
+    while stack:
+        current = stack[-1]
+        if links[current]:
+            following = links[current].pop()
+            links[following].remove(current)
+            stack.append(following)
+        else:
+            stack.pop()
+            if not visited[current] and current < n:
+                visited[current] = True
+                order.append(current)
+
+    order = _cycle_to_path(distances, np.array(order, dtype=np.int64), ids, start, mode, end)
+    return ids[order].tolist(), path_cost(distances, order, mode)
+
+
+def _cycle_to_path(distances: np.ndarray, order: np.ndarray, ids: np.ndarray, start: int,
+                   mode: str = CYCLE, end: int = None) -> np.ndarray:
+    """ Rotate a cycle, given as indices of locations, so that it begins at
+        `start`, and for a path, drop the longer of the start's two edges, or
+        move a fixed end to the end """
+    n = len(order)
+    order = np.roll(order, -int(np.where(order == int(np.where(ids == start)[0][0]))[0][0]))
+
+    if mode == OPEN and n > 2 and distances[order[0], order[1]] > distances[order[-1], order[0]]:
+        order = np.append(order[:1], order[:0:-1])
+    elif mode == FIXED and n > 1:
+        # the cycle is first turned so that the end is nearer its end
+        end_index = int(np.where(ids == end)[0][0])
+        if int(np.where(order == end_index)[0][0]) < n / 2:
+            order = np.append(order[:1], order[:0:-1])
+        order = np.append(order[order != end_index], end_index)
+
+    return order
+
+
+def improve_tour(distances: np.ndarray, ids: np.ndarray, tour: list, stages: tuple = None,
+                 time_limit: float = 0.5, neighbors: int = 8, active: list = None) -> tuple[list, float]:
+    """ Local search to improve a tour by applying improving moves until none
+        remain or the time limit runs out. Each city's `neighbors` nearest
+        cities are the only candidates considered for its moves, and a city
+        is only re-examined after one of its edges changes ("don't-look bits").
+        The first location in the tour stays first.
+
+        :param distances:   Distance matrix representation of a graph, or a
+                            distance provider (see `utils.distances`)
+        :param ids:         IDs of the locations
+        :param tour:        IDs of the locations in the order they are visited
+        :param stages:      Move functions to try on each city, in order (see
+                            `two_opt_move`); defaults to 2-opt then Or-opt
+        :param time_limit:  Maximum number of seconds to spend improving
+        :param neighbors:   Number of candidate neighbors per city
+        :param active:      IDs of the locations to examine first, e.g., the
+                            ones next to a change in an otherwise improved
+                            tour; every location is examined if None
+        :return:            A tuple containing the improved tour and its cost """
+    deadline = time.perf_counter() + time_limit
+    stages = stages or IMPROVEMENT_STAGES
+
+    index = {int(id): i for i, id in enumerate(ids)}
+    order = np.array([index[int(id)] for id in tour], dtype=np.int64)
+    n = len(order)
+
+    if n > 3:
+        # a local repair usually only examines a few cities, and the search
+        # may not reach every city of a tour whose distances are computed as
+        # needed, so their neighbor lists are computed as needed instead of
+        # all at once, unless the distances come with them
+        cities = distances.distances if isinstance(distances, PathDistances) else distances
+        if isinstance(cities, NeighborDistances) or active is None and not isinstance(cities, DistanceProvider):
+            candidates = neighbor_lists(distances, neighbors)
+        else:
+            candidates = LazyNeighborLists(distances, neighbors)
+
+        # `position[v]` is the index of city `v` in `order`
+        position = np.empty(n, dtype=np.int64)
+        position[order] = np.arange(n)
+
+        # every city starts out "active" unless told otherwise; a city is
+        # dropped from the queue once no move improves any of its edges, and
+        # is added back if they change
+        if active is None:
+            queue = collections.deque(order.tolist())
+        else:
+            queue = collections.deque(index[int(id)] for id in active)
+        queued = np.zeros(n, dtype=bool)
+        queued[list(queue)] = True
+
+        while queue and time.perf_counter() < deadline:
+            city = queue.popleft()
+            queued[city] = False
+
+            for stage in stages:
+                touched = stage(distances, order, position, candidates, city)
+                if touched:
+                    for v in touched:
+                        if not queued[v]:
+                            queued[v] = True
+                            queue.append(v)
+                    break
+
+    cost = float(distances[order, np.roll(order, -1)].sum())
+    return [int(ids[i]) for i in order], cost
+
+
+def improve_path(distances: np.ndarray, ids: np.ndarray, path: list, end: int = None,
+                 time_limit: float = 0.5, neighbors: int = 8, active: list = None) -> tuple[list, float]:
+    """ Local search to improve a path that starts at its first location and
+        ends at `end`, or anywhere if `end` is None. The path is improved by
+        `improve_tour` as a tour through a dummy location (see
+        `PathDistances`); see `improve_tour` for the other parameters.
+
+        :return:            A tuple containing the improved path and its cost """
+    index = {int(id): i for i, id in enumerate(ids)}
+    start = int(path[0])
+
+    if len(path) > 2:
+        wrapped = PathDistances(distances, index[start], None if end is None else index[int(end)])
+        tour, _ = improve_tour(wrapped, np.append(ids, DUMMY_ID), list(path) + [DUMMY_ID],
+                               time_limit=time_limit, neighbors=neighbors, active=active)
+        path = _path_from_tour(tour, start)
+
+    return [int(id) for id in path], path_cost(distances, [index[int(id)] for id in path], OPEN)
+
+
+def _path_from_tour(tour: list, start: int) -> list:
+    """ Get the path from `start` in a tour through the dummy location, which
+        is next to `start` """
+    i = tour.index(DUMMY_ID)
+    path = tour[i + 1:] + tour[:i]
+    return path if path[0] == start else path[::-1]
+
+
+def two_opt_move(distances: np.ndarray, order: np.ndarray, position: np.ndarray,
+                 candidates: np.ndarray, a: int) -> list:
+    """ Apply the best 2-opt move that replaces one of the edges of city `a`
+        with an edge from `a` to one of its candidate neighbors, if any such
+        move shortens the tour
+
+        Improvement stages share this signature: `order` and `position` are
+        updated in place, and the cities whose edges changed are returned (an
+        empty list if the tour was not changed). """
+    n = len(order)
+    c = candidates[a]
+    a_next = order[(position[a] + 1) % n]
+    a_prev = order[position[a] - 1]
+    c_next = order[(position[c] + 1) % n]
+    c_prev = order[position[c] - 1]
+
+    # successor direction replaces (a, a_next) and (c, c_next) with (a, c) and
+    # (a_next, c_next); predecessor direction replaces (a_prev, a) and
+    # (c_prev, c) with (a, c) and (a_prev, c_prev)
+    gain_next = (distances[a, a_next] + distances[c, c_next]
+                 - distances[a, c] - distances[a_next, c_next])
+    gain_prev = (distances[a_prev, a] + distances[c_prev, c]
+                 - distances[a, c] - distances[a_prev, c_prev])
+
+    best_next = int(np.argmax(gain_next))
+    best_prev = int(np.argmax(gain_prev))
+
+    if gain_next[best_next] >= gain_prev[best_prev]:
+        if gain_next[best_next] <= 1e-9:
+            return []
+        first, second = a, c[best_next]
+    else:
+        if gain_prev[best_prev] <= 1e-9:
+            return []
+        first, second = c_prev[best_prev], a_prev
+
+    # both moves replace edges (first, next of first) and (second, next of
+    # second), which reverses the path between them; the reversed range never
+    # includes index 0, so the first location stays first
+    i, j = position[first], position[second]
+    if i > j:
+        i, j = j, i
+    touched = [order[i], order[i + 1], order[j], order[(j + 1) % n]]
+    order[i + 1:j + 1] = order[i + 1:j + 1][::-1].copy()
+    position[order[i + 1:j + 1]] = np.arange(i + 1, j + 1)
+
+    return touched
+
+
+def or_opt_move(distances: np.ndarray, order: np.ndarray, position: np.ndarray,
+                candidates: np.ndarray, a: int) -> list:
+    """ Apply the best Or-opt move that relocates a segment of 1 to 3 cities
+        starting at city `a` (in either orientation) between a pair of adjacent
+        cities near one of the segment's ends, if any such move shortens the
+        tour. See `two_opt_move` for the shared stage signature. """
+    n = len(order)
+    i = int(position[a])
+
+    # the first location never moves
+    if i == 0:
+        return []
+
+    best_gain, best_move = 1e-9, None
+
+    for length in range(1, 4):
+        # the segment may not wrap around to the first location
+        if i + length > n or n - length < 3:
+            break
+
+        segment = order[i:i + length]
+        first, last = segment[0], segment[-1]
+        prev, next = order[i - 1], order[(i + length) % n]
+        removal_gain = distances[prev, first] + distances[last, next] - distances[prev, next]
+
+        # candidate insertion edges (u, w) are the edges on either side of
+        # each neighbor of the segment's ends
+        c = np.concatenate((candidates[first], candidates[last]))
+        u = np.concatenate((c, order[position[c] - 1]))
+        w = np.concatenate((order[(position[c] + 1) % n], c))
+
+        # skip edges that touch the segment, since they are not in the tour
+        # once the segment is removed
+        in_segment = ((position[u] >= i) & (position[u] < i + length)
+                      | (position[w] >= i) & (position[w] < i + length))
+
+        forward = distances[u, first] + distances[last, w] - distances[u, w]
+        backward = distances[u, last] + distances[first, w] - distances[u, w]
+        insertion = np.minimum(forward, backward)
+        insertion[in_segment] = np.inf
+
+        k = int(np.argmin(insertion))
+        gain = removal_gain - insertion[k]
+        if gain > best_gain:
+            best_gain = gain
+            best_move = (length, u[k], w[k], backward[k] < forward[k])
+
+    if best_move is None:
+        return []
+
+    length, u, w, reverse = best_move
+    segment = order[i:i + length].copy()
+    touched = [order[i - 1], order[(i + length) % n], u, w] + segment.tolist()
+
+    rest = np.concatenate((order[:i], order[i + length:]))
+    at = int(np.where(rest == u)[0][0]) + 1
+    order[:] = np.concatenate((rest[:at], segment[::-1] if reverse else segment, rest[at:]))
+    position[order] = np.arange(n)
+
+    return touched
+
+
+# default improvement stages, in the order they are tried on each city
+IMPROVEMENT_STAGES = (two_opt_move, or_opt_move)
+
+
+class LazyNeighborLists:
+    """ Neighbor lists that are computed for each city the first time they are
+        accessed, indexed like the array returned by `neighbor_lists` """
+
+    def __init__(self, distances: np.ndarray, k: int):
+        self.distances = distances
+        self.k = min(k, len(distances) - 1)
+        self.lists = {}
+
+        # the neighbors of a distance provider's cities are found with a
+        # spatial index rather than by computing their full rows; the dummy
+        # location of a path takes the start's neighbors, as in `neighbor_lists`
+        self.path = distances if isinstance(distances, PathDistances) else None
+        cities = distances.distances if self.path is not None else distances
+        self.index = None
+        if isinstance(cities, DistanceProvider) and len(cities) > 1:
+            self.index = SpatialIndex(cities.lats, cities.longs)
+            self.k = min(k, len(cities) - 1)
+
+    def __getitem__(self, city: int) -> np.ndarray:
+        if city not in self.lists:
+            if self.index is None:
+                row = np.array(self.distances[city], dtype=np.float64)
+                row[city] = np.inf
+                nearest = np.argpartition(row, self.k - 1)[:self.k]
+                self.lists[city] = nearest[np.argsort(row[nearest])]
+            elif self.path is not None and city == len(self.path.distances):
+                self.lists[city] = self[self.path.start]
+            else:
+                self.lists[city] = np.asarray(self.index.nearest(city, self.k)[0], dtype=np.int64)
+
+        return self.lists[city]
+
+
+def neighbor_lists(distances: np.ndarray, k: int) -> np.ndarray:
+    """ Get the `k` nearest other cities of every city, nearest first
+
+        :param distances:   Distance matrix representation of a graph
+        :param k:           Number of neighbors per city
+        :return:            An (n, k) array of city indices """
+    if isinstance(distances, NeighborDistances):
+        return distances.neighbor_lists(k)
+
+    # the dummy location of a path is never a candidate for another location,
+    # and takes the start's candidates as its own
+    if isinstance(distances, PathDistances):
+        lists = neighbor_lists(distances.distances, k)
+        return np.vstack((lists, lists[distances.start]))
+
+    # the neighbors of every city are found with a spatial index rather than
+    # by computing the full rows of a distance provider
+    if isinstance(distances, DistanceProvider):
+        index = SpatialIndex(distances.lats, distances.longs)
+        k = min(k, len(distances) - 1)
+        return np.array([index.nearest(i, k)[0] for i in range(len(distances))], dtype=np.int64).reshape(-1, k)
+
+    n = len(distances)
+    k = min(k, n - 1)
+    result = np.empty((n, k), dtype=np.int64)
+
+    # work in blocks of rows to bound the size of temporary arrays
+    BLOCK = 1024
+    for begin in range(0, n, BLOCK):
+        rows = np.array(distances[begin:begin + BLOCK], dtype=np.float64)
+        rows[np.arange(len(rows)), np.arange(begin, begin + len(rows))] = np.inf
+
+        nearest = np.argpartition(rows, k - 1, axis=1)[:, :k]
+        nearest_distances = np.take_along_axis(rows, nearest, axis=1)
+        result[begin:begin + len(rows)] = np.take_along_axis(
+            nearest, np.argsort(nearest_distances, axis=1), axis=1)
+
+    return result
+
+
+def insert_location(distances: np.ndarray, ids: np.ndarray, tour: list, new_id: int,
+                    time_limit: float = 0.05, mode: str = CYCLE, end: int = None) -> tuple[list, float]:
+    """ Add a location to an existing tour by inserting it where it increases
+        the length of the tour the least, then repairing the tour locally
+        around it. The first location in the tour stays first.
+
+        :param distances:   Distance matrix representation of a graph,
+                            including the new location
+        :param ids:         IDs of the locations
+        :param tour:        IDs of the locations in the order they are visited,
+                            not including the new location
+        :param new_id:      ID of the location to add
+        :param time_limit:  Maximum number of seconds to spend repairing
+        :param mode:        CYCLE, OPEN, or FIXED (see `calculate_tour`)
+        :param end:         ID of the last location, for FIXED
+        :return:            A tuple containing the new tour and its cost """
+    if not tour:
+        return [new_id], 0.0
+
+    index = {int(id): i for i, id in enumerate(ids)}
+    order = np.array([index[int(id)] for id in tour], dtype=np.int64)
+    new = index[int(new_id)]
+
+    # cost of inserting the new location between each pair of consecutive
+    # locations, including the last location and the first
+    following = np.roll(order, -1)
+    added = distances[order, new] + distances[new, following] - distances[order, following]
+
+    # a path has no edge from its last location back to the first; a location
+    # may be added after the last location of an open path, but not after a
+    # fixed end
+    if mode != CYCLE:
+        added[-1] = distances[order[-1], new] if mode == OPEN else np.inf
+    position = int(np.argmin(added)) + 1
+
+    tour = list(tour[:position]) + [new_id] + list(tour[position:])
+
+    # only the new location and its neighbors need to be re-examined
+    active = [tour[position - 1], new_id, tour[(position + 1) % len(tour)]]
+    if mode != CYCLE:
+        return improve_path(distances, ids, tour, end, time_limit=time_limit, active=active)
+    return improve_tour(distances, ids, tour, time_limit=time_limit, active=active)
+
+
+def remove_location(distances: np.ndarray, ids: np.ndarray, tour: list, removed_id: int,
+                    time_limit: float = 0.05, mode: str = CYCLE, end: int = None) -> tuple[list, float]:
+    """ Remove a location from an existing tour by joining its neighbors,
+        then repairing the tour locally around them. If the first location is
+        removed, the location after it becomes the first location.
+
+        :param distances:   Distance matrix representation of a graph, not
+                            including the removed location
+        :param ids:         IDs of the locations, not including the removed one
+        :param tour:        IDs of the locations in the order they are visited,
+                            including the removed location
+        :param removed_id:  ID of the location to remove
+        :param time_limit:  Maximum number of seconds to spend repairing
+        :param mode:        CYCLE, OPEN, or FIXED (see `calculate_tour`); the
+                            fixed end cannot be removed
+        :param end:         ID of the last location, for FIXED
+        :return:            A tuple containing the new tour and its cost """
+    position = tour.index(removed_id)
+    neighbors = [tour[position - 1], tour[(position + 1) % len(tour)]]
+    tour = list(tour[:position]) + list(tour[position + 1:])
+
+    if len(tour) <= 1:
+        return tour, 0.0
+
+    if mode != CYCLE:
+        return improve_path(distances, ids, tour, end, time_limit=time_limit, active=neighbors)
+    return improve_tour(distances, ids, tour, time_limit=time_limit, active=neighbors)
+
+
+def grow_distance_matrix(distances: np.ndarray, ids: np.ndarray, coordinates: np.ndarray,
+                         new_id: int, new_coordinates: tuple) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Add one location to a distance matrix by computing only its own row
+        and column
+
+        :param distances:       Distance matrix representation of a graph, or
+                                a `NeighborDistances` provider
+        :param ids:             IDs of the locations in matrix order
+        :param coordinates:     (n, 2) array of the latitude and longitude of
+                                each location, in degrees and matrix order
+        :param new_id:          ID of the location to add
+        :param new_coordinates: Latitude and longitude of the new location
+        :return:                A tuple containing the distance matrix, IDs,
+                                and coordinates with the new location last """
+    n = len(ids)
+    coordinates = np.vstack((np.reshape(coordinates, (-1, 2)), new_coordinates)).astype(np.float64)
+    lats, longs = np.radians(coordinates[:, 0]), np.radians(coordinates[:, 1])
+
+    if isinstance(distances, NeighborDistances):
+        return distances.grow(lats[n], longs[n]), np.append(ids, new_id), coordinates
+
+    # same formula as `haversine`, from the new location to every location
+    RADIUS = 3958.8  # Radius of Earth in miles
+    row = 2 * RADIUS * np.arcsin(np.sqrt(np.clip(
+        0.5 - np.cos(lats - lats[n]) / 2
+        + np.cos(lats[n]) * np.cos(lats) * (1 - np.cos(longs - longs[n])) / 2,
+        0.0, 1.0
+    )))
+    row[n] = 0.0
+
+    grown = np.empty((n + 1, n + 1), dtype=distances.dtype)
+    grown[:n, :n] = distances
+    grown[n, :] = row
+    grown[:, n] = row
+
+    return grown, np.append(ids, new_id), coordinates
+
+
+def shrink_distance_matrix(distances: np.ndarray, ids: np.ndarray, coordinates: np.ndarray,
+                           removed_id: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Remove one location's row and column from a distance matrix
+
+        :param distances:   Distance matrix representation of a graph, or a
+                            `NeighborDistances` provider
+        :param ids:         IDs of the locations in matrix order
+        :param coordinates: (n, 2) array of the latitude and longitude of each
+                            location, in degrees and matrix order
+        :param removed_id:  ID of the location to remove
+        :return:            A tuple containing the distance matrix, IDs, and
+                            coordinates without the removed location """
+    i = int(np.where(ids == removed_id)[0][0])
+    keep = np.delete(np.arange(len(ids)), i)
+
+    if isinstance(distances, NeighborDistances):
+        return distances.shrink(i), ids[keep], coordinates[keep]
+
+    return distances[np.ix_(keep, keep)], ids[keep], coordinates[keep]
+
+
+def make_distance_matrix(vertices: dict, dtype: type = np.float64) -> tuple[np.ndarray, np.ndarray]:
+    """ Creates a matrix of distances given a dictionary of names and coordinates
+
+        :param vertices:    Dictionary of the format {name: (latitude, longitude)}
+        :param dtype:       Data type of the matrix, e.g., `np.float32` to halve
+                            its memory use
+        :return:            A tuple containing the distance matrix and an
+                            array of the names in matrix order """
     names = np.array(list(vertices.keys()))
-    dists = np.zeros(shape=(len(vertices), len(vertices)))
+    coordinates = np.array(list(vertices.values()), dtype=np.float64).reshape(-1, 2)
+    lats, longs = np.radians(coordinates[:, 0]), np.radians(coordinates[:, 1])
+
+    return haversine_matrix(lats, longs, dtype), names
+
+
+def haversine_matrix(lats: np.ndarray, longs: np.ndarray, dtype: type = np.float64) -> np.ndarray:
+    """ Get the matrix of great-circle distances in miles between every pair of
+        latitude/longitude points, given in radians
+
+        Only the upper triangle is computed and is then mirrored onto the
+        lower triangle, since the distance is symmetric. """
+    RADIUS = 3958.8  # Radius of Earth in miles
+    n = len(lats)
+    dists = np.zeros(shape=(n, n), dtype=dtype)
+    cos_lats = np.cos(lats)
+
+    def upper(i, j):
+        # same formula as `haversine`, broadcast over pairs of points
+        return 2 * RADIUS * np.arcsin(np.sqrt(np.clip(
+            0.5 - np.cos(lats[j] - lats[i]) / 2
+            + cos_lats[i] * cos_lats[j] * (1 - np.cos(longs[j] - longs[i])) / 2,
+            0.0, 1.0
+        )))
+
+    # greatest number of points for which every pair is computed in one call;
+    # larger matrices are filled one row at a time to bound temporary memory
+    BATCH_CUTOFF = 256
+
+    if n <= BATCH_CUTOFF:
+        rows, cols = np.triu_indices(n, 1)
+        dists[rows, cols] = upper(rows, cols)
+    else:
+        for i in range(n - 1):
+            dists[i, i + 1:] = upper(i, slice(i + 1, None))
 
-    for i, (lat1, long1) in enumerate(vertices.values()):
-        for j, (lat2, long2) in enumerate(vertices.values()):
-            dists[i][j] = haversine(lat1, long1, lat2, long2)
+    # mirror the upper triangle; the diagonal and lower triangle are zero
+    dists += dists.T
 
-    return dists, names
+    return dists
 
 
 def haversine(lat1: float, long1: float, lat2: float, long2: float) -> float:
@@ -0,0 +1,332 @@
+""" Distance providers: compact alternatives to a dense distance matrix for
+    large tours
+
+    A dense float64 matrix takes 8n^2 bytes, or 800 MB for 10,000 locations.
+    The providers below store less and compute the rest from the locations'
+    coordinates as needed, while being indexed like the matrix they replace,
+    so that `nearest_neighbor`, `improve_tour`, and the other heuristics in
+    `algorithms` run on them unchanged:
+
+        len(distances)          number of locations
+        distances[i]            row `i`, as a float64 array
+        distances[i:j]          rows `i` to `j - 1`, as a 2D array
+        distances[rows]         the given rows, for an integer array `rows`
+        distances[i, j]         distances between pairs of locations; `i` and
+                                `j` are integers or arrays and are broadcast
+
+    The exact solvers (Held-Karp and branch and bound) need a dense matrix,
+    but only run on small tours. """
+import numpy as np
+
+from utils.spatial import SpatialIndex
+
+RADIUS = 3958.8  # Radius of Earth in miles
+
+# greatest number of locations for which neighbor lists are found with a
+# matrix product rather than a spatial index
+SPATIAL_INDEX_CUTOFF = 10000
+
+
+class DistanceProvider:
+    """ Base class of the distance providers. Subclasses implement `row`, and
+        may override `rows` and `pairs` with something faster than computing
+        the distances from coordinates. """
+
+    def __init__(self, lats: np.ndarray, longs: np.ndarray):
+        """ :param lats:    Latitudes of the locations, in radians
+            :param longs:   Longitudes of the locations, in radians """
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.longs = np.asarray(longs, dtype=np.float64)
+        self.cos_lats = np.cos(self.lats)
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.pairs(*key)
+        if isinstance(key, slice):
+            return self.rows(np.arange(len(self))[key])
+
+        key = np.asarray(key)
+        if key.ndim == 0:
+            return self.row(int(key))
+        return self.rows(key)
+
+    @property
+    def nbytes(self) -> int:
+        """ Number of bytes of memory used by the provider's arrays """
+        return sum(value.nbytes for value in vars(self).values() if isinstance(value, np.ndarray))
+
+    def row(self, i: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def rows(self, indices: np.ndarray) -> np.ndarray:
+        return np.array([self.row(int(i)) for i in indices]).reshape(len(indices), len(self))
+
+    def pairs(self, i, j) -> np.ndarray:
+        """ Compute the distances between pairs of locations from their coordinates """
+        return self._haversine(np.asarray(i), np.asarray(j))
+
+    def _haversine(self, i, j) -> np.ndarray:
+        # same formula as `algorithms.haversine_matrix`, so that the result
+        # matches the dense matrix exactly
+        return 2 * RADIUS * np.arcsin(np.sqrt(np.clip(
+            0.5 - np.cos(self.lats[j] - self.lats[i]) / 2
+            + self.cos_lats[i] * self.cos_lats[j] * (1 - np.cos(self.longs[j] - self.longs[i])) / 2,
+            0.0, 1.0
+        )))
+
+
+class CondensedDistances(DistanceProvider):
+    """ Every distance, stored once per pair as float32: the upper triangle of
+        the distance matrix, row by row. Takes 2n^2 bytes, a quarter of a
+        dense float64 matrix. """
+
+    def __init__(self, lats: np.ndarray, longs: np.ndarray):
+        super().__init__(lats, longs)
+        n = len(self)
+
+        # `offsets[i]` is the position of the distance between `i` and `i + 1`
+        i = np.arange(n, dtype=np.int64)
+        self.offsets = i * n - i * (i + 1) // 2
+        self.condensed = np.empty(n * (n - 1) // 2, dtype=np.float32)
+
+        # fill one row at a time to bound temporary memory
+        for i in range(n - 1):
+            self.condensed[self.offsets[i]:self.offsets[i] + n - i - 1] = self._haversine(i, slice(i + 1, None))
+
+    def row(self, i: int) -> np.ndarray:
+        n = len(self)
+        result = np.empty(n, dtype=np.float64)
+
+        # distances to later locations are stored contiguously in row `i`, and
+        # distances to earlier ones in each earlier location's row
+        before = np.arange(i)
+        result[:i] = self.condensed[self.offsets[before] + i - before - 1]
+        result[i] = 0.0
+        result[i + 1:] = self.condensed[self.offsets[i]:self.offsets[i] + n - i - 1]
+
+        return result
+
+    def pairs(self, i, j) -> np.ndarray:
+        i, j = np.broadcast_arrays(np.asarray(i), np.asarray(j))
+        if len(self.condensed) == 0:
+            return np.zeros(i.shape)
+
+        low, high = np.minimum(i, j), np.maximum(i, j)
+
+        # the diagonal is not stored, so look up any valid entry and zero it
+        index = np.where(low == high, 0, self.offsets[low] + high - low - 1)
+        return np.where(low == high, 0.0, self.condensed[index].astype(np.float64))
+
+
+class LazyDistances(DistanceProvider):
+    """ No stored distances: every row and pair is computed from the
+        coordinates when it is accessed. Takes memory proportional to n. """
+
+    def row(self, i: int) -> np.ndarray:
+        return self._haversine(i, slice(None))
+
+    def rows(self, indices: np.ndarray) -> np.ndarray:
+        return self._haversine(np.asarray(indices)[:, np.newaxis], np.arange(len(self))[np.newaxis, :])
+
+
+class NeighborDistances(LazyDistances):
+    """ Distances computed as in `LazyDistances`, plus each location's `k`
+        nearest other locations, which the local search uses as its candidate
+        moves instead of computing them from full rows. Takes memory
+        proportional to n * k. """
+
+    def __init__(self, lats: np.ndarray, longs: np.ndarray, k: int = 8, neighbors: np.ndarray = None):
+        """ :param neighbors:   Neighbor lists already found for these
+                                locations, e.g., by `grow` or `shrink` """
+        super().__init__(lats, longs)
+        n = len(self)
+        self.k = min(k, n - 1)
+        if neighbors is not None:
+            self.neighbors = neighbors
+            return
+
+        self.neighbors = np.empty((n, self.k), dtype=np.int64)
+
+        # a matrix product is faster for fewer points, but takes O(n^2) time
+        if n > SPATIAL_INDEX_CUTOFF:
+            index = SpatialIndex(self.lats, self.longs)
+            for i in range(n):
+                self.neighbors[i] = index.nearest(i, self.k)[0]
+            return
+
+        # the great-circle distance grows with the straight-line distance
+        # between points on a unit sphere, so the nearest locations are the
+        # ones whose unit vectors have the greatest dot products, which are
+        # found with a matrix product instead of computing full rows
+        points = np.column_stack((self.cos_lats * np.cos(self.longs),
+                                  self.cos_lats * np.sin(self.longs),
+                                  np.sin(self.lats)))
+
+        # work in blocks of rows to bound the size of temporary arrays
+        BLOCK = 1024
+        for begin in range(0, n, BLOCK):
+            similarity = points[begin:begin + BLOCK] @ points.T
+            similarity[np.arange(len(similarity)), np.arange(begin, begin + len(similarity))] = -np.inf
+
+            nearest = np.argpartition(-similarity, self.k - 1, axis=1)[:, :self.k]
+            nearest_similarity = np.take_along_axis(similarity, nearest, axis=1)
+            self.neighbors[begin:begin + len(similarity)] = np.take_along_axis(
+                nearest, np.argsort(-nearest_similarity, axis=1), axis=1)
+
+    def neighbor_lists(self, k: int) -> np.ndarray:
+        """ Get up to `k` nearest other locations of every location, nearest
+            first; see `algorithms.neighbor_lists` """
+        return self.neighbors[:, :k]
+
+    def grow(self, lat: float, long: float) -> "NeighborDistances":
+        """ Get the distances with one more location, last, finding only its
+            own neighbors and updating the lists of the locations it is nearer
+            to than their farthest neighbor
+
+            :param lat:     Latitude of the new location, in radians
+            :param long:    Longitude of the new location, in radians """
+        n = len(self)
+        if self.k < 1:
+            return NeighborDistances(np.append(self.lats, lat), np.append(self.longs, long))
+
+        grown = NeighborDistances(np.append(self.lats, lat), np.append(self.longs, long), self.k,
+                                  neighbors=np.vstack((self.neighbors, np.zeros((1, self.k), dtype=np.int64))))
+        row = grown.row(n)
+        grown.neighbors[n] = grown._nearest(n, row)
+
+        farthest = grown.pairs(np.arange(n), self.neighbors[:, -1])
+        for i in np.flatnonzero(row[:n] < farthest):
+            # the lists are sorted nearest first
+            position = np.searchsorted(grown.pairs(i, self.neighbors[i]), row[i])
+            grown.neighbors[i] = np.insert(self.neighbors[i], position, n)[:self.k]
+
+        return grown
+
+    def shrink(self, removed: int) -> "NeighborDistances":
+        """ Get the distances without one location, finding new neighbors only
+            for the locations that had it as a neighbor
+
+            :param removed: Index of the location to remove """
+        keep = np.delete(np.arange(len(self)), removed)
+        if len(keep) - 1 < self.k:
+            return NeighborDistances(self.lats[keep], self.longs[keep], self.k)
+
+        neighbors = self.neighbors[keep]
+        affected = np.flatnonzero((neighbors == removed).any(axis=1))
+
+        # later locations move down by one index
+        neighbors = neighbors - (neighbors > removed)
+        shrunk = NeighborDistances(self.lats[keep], self.longs[keep], self.k, neighbors=neighbors)
+        for i in affected:
+            shrunk.neighbors[i] = shrunk._nearest(i, shrunk.row(int(i)))
+
+        return shrunk
+
+    def _nearest(self, i: int, row: np.ndarray) -> np.ndarray:
+        """ The `k` nearest other locations of location `i`, nearest first,
+            given its row of distances """
+        row = row.copy()
+        row[i] = np.inf
+        nearest = np.argpartition(row, self.k - 1)[:self.k]
+        return nearest[np.argsort(row[nearest], kind="stable")]
+
+
+class PathDistances:
+    """ Distances that pose the shortest path from a start (to a fixed end, or
+        to any end) as a shortest tour, so that the tour solvers find paths
+        unchanged: the distances of `n` locations, plus a dummy location `n`
+        that is free to reach from the start and the end, and costs more than
+        any path to reach from anywhere else. The shortest tour then passes
+        through the dummy between the start and the end of the shortest path.
+        Indexed like the distances it wraps, with one more row and column. """
+
+    def __init__(self, distances, start: int, end: int = None):
+        """ :param distances:   Distance matrix or distance provider
+            :param start:       Index of the start of the path
+            :param end:         Index of the end of the path, or None if the
+                                path may end anywhere """
+        self.distances = distances
+        self.start = start
+        self.end = end
+        n = len(distances)
+
+        # longest possible edge, so that a path through every location is
+        # shorter than the penalty
+        if isinstance(distances, np.ndarray):
+            longest = float(distances.max()) if n else 0.0
+        else:
+            longest = np.pi * RADIUS
+        self.penalty = (n + 1) * longest + 1.0
+
+        # distances from the dummy to every location, including itself
+        self.dummy_row = np.full(n + 1, self.penalty)
+        self.dummy_row[[start, n]] = 0.0
+        if end is not None:
+            self.dummy_row[end] = 0.0
+
+    def __len__(self) -> int:
+        return len(self.distances) + 1
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.pairs(*key)
+        if isinstance(key, slice):
+            return self.rows(np.arange(len(self))[key])
+
+        key = np.asarray(key)
+        if key.ndim == 0:
+            return self.rows(key[np.newaxis])[0]
+        return self.rows(key)
+
+    def rows(self, indices: np.ndarray) -> np.ndarray:
+        indices = np.asarray(indices)
+        n = len(self.distances)
+        result = np.empty((len(indices), n + 1))
+
+        real = indices < n
+        if real.any():
+            result[real, :n] = self.distances[indices[real]]
+            result[real, n] = self.dummy_row[indices[real]]
+        result[~real] = self.dummy_row
+
+        return result
+
+    def pairs(self, i, j) -> np.ndarray:
+        i, j = np.broadcast_arrays(np.asarray(i), np.asarray(j))
+        n = len(self.distances)
+
+        # look up any valid pair where either location is the dummy, then
+        # replace it with the dummy's distance
+        result = np.asarray(self.distances[np.where(i == n, 0, i), np.where(j == n, 0, j)], dtype=np.float64)
+        result = np.where(i == n, self.dummy_row[j], result)
+        return np.where(j == n, self.dummy_row[i], result)
+
+
+# distance providers by name
+PROVIDERS = {
+    "condensed": CondensedDistances,
+    "lazy": LazyDistances,
+    "neighbors": NeighborDistances,
+}
+
+
+def make_distance_provider(vertices: dict, kind: str = "neighbors", **options) -> tuple[DistanceProvider, np.ndarray]:
+    """ Create a distance provider given a dictionary of names and coordinates,
+        like `algorithms.make_distance_matrix`
+
+        :param vertices:    Dictionary of the format {name: (latitude, longitude)}
+        :param kind:        "condensed", "lazy", or "neighbors"
+        :param options:     Passed to the provider, e.g., `k` for "neighbors"
+        :return:            A tuple containing the provider and an array of
+                            the names in provider order """
+    if kind not in PROVIDERS:
+        raise ValueError(f"Unknown distance provider: {kind}")
+
+    names = np.array(list(vertices.keys()))
+    coordinates = np.array(list(vertices.values()), dtype=np.float64).reshape(-1, 2)
+    lats, longs = np.radians(coordinates[:, 0]), np.radians(coordinates[:, 1])
+
+    return PROVIDERS[kind](lats, longs, **options), names
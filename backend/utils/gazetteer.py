@@ -0,0 +1,237 @@
+""" Offline place index for searching a local gazetteer by name prefix
+
+    An index is built once from a CSV/TSV file of places (e.g., a dump from
+    GeoNames) and stored in a directory containing two files:
+        `records.bin`   One line per place of the format
+                        key, name, display name, latitude, longitude, importance
+                        separated by the ASCII unit separator, sorted by key
+                        and then by descending importance
+        `offsets.npy`   Byte offset of the start of each line, in order
+        `importance.npy`, `lengths.npy`
+                        Importance and key length in bytes of each place, in
+                        order
+        `blocks.npy`    For each block of `BLOCK_SIZE` consecutive places, the
+                        positions of its `BLOCK_TOP` best ranked places (see
+                        `PlaceIndex.search`), padded with -1
+    All files are memory-mapped when the index is opened, so only the pages
+    touched by a search are read into memory. A search for a short prefix only
+    has to rank the best places of each block it covers instead of every
+    matching place. """
+import csv
+import mmap
+import os
+import unicodedata
+
+import numpy as np
+
+SEPARATOR = b"\x1f"
+
+# Number of consecutive places per block, and number of best ranked places
+# stored for each block
+BLOCK_SIZE = 256
+BLOCK_TOP = 16
+
+# Names accepted for each column when the file has a header row
+COLUMN_NAMES = {
+    "name": ("name", "asciiname"),
+    "display_name": ("display_name", "display name", "address"),
+    "latitude": ("lat", "latitude"),
+    "longitude": ("lon", "lng", "long", "longitude"),
+    "importance": ("importance", "population", "rank"),
+}
+
+
+def normalize_name(name: str) -> str:
+    """ Normalize a place name or query for prefix matching by removing
+        accents, case, and repeated whitespace, e.g., "São  Paulo" becomes
+        "sao paulo" """
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.casefold().split())
+
+
+def build_index(source: str, directory: str, columns: dict = None, delimiter: str = None) -> int:
+    """ Build a place index from a CSV/TSV file
+
+        :param source:      Path to the CSV/TSV file
+        :param directory:   Directory to write the index to
+        :param columns:     Column number of each field, of the format
+                            {"name": 0, "display_name": 1, "latitude": 2,
+                             "longitude": 3, "importance": 4}, for files
+                            without a header row; "display_name" and
+                            "importance" are optional
+        :param delimiter:   Field delimiter; a tab for `.tsv`/`.txt` files and
+                            a comma otherwise if not given
+        :return:            The number of places in the index """
+    if delimiter is None:
+        delimiter = "\t" if source.endswith((".tsv", ".txt")) else ","
+
+    records = []
+    with open(source, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter=delimiter, quoting=csv.QUOTE_NONE if delimiter == "\t" else csv.QUOTE_MINIMAL)
+
+        if columns is None:
+            columns = _columns_from_header(next(reader))
+
+        for row in reader:
+            try:
+                name = _clean(row[columns["name"]])
+                display_name = _clean(row[columns["display_name"]]) if "display_name" in columns else name
+                latitude = float(row[columns["latitude"]])
+                longitude = float(row[columns["longitude"]])
+                importance = float(row[columns["importance"]] or 0) if "importance" in columns else 0.0
+            except (IndexError, ValueError):
+                # Skip malformed rows
+                continue
+
+            key = normalize_name(name)
+            if key:
+                records.append((key.encode("utf-8"), -importance, name, display_name, latitude, longitude))
+
+    # UTF-8 byte order is the same as code point order, so sorting the encoded
+    # keys lets searches compare raw bytes
+    records.sort(key=lambda r: (r[0], r[1]))
+
+    os.makedirs(directory, exist_ok=True)
+    offsets = np.empty(len(records), dtype=np.uint64)
+    position = 0
+
+    with open(os.path.join(directory, "records.bin"), "wb") as f:
+        for i, (key, importance, name, display_name, latitude, longitude) in enumerate(records):
+            line = SEPARATOR.join((
+                key, name.encode("utf-8"), display_name.encode("utf-8"),
+                repr(latitude).encode(), repr(longitude).encode(), repr(-importance).encode(),
+            )) + b"\n"
+            offsets[i] = position
+            position += len(line)
+            f.write(line)
+
+    importance = np.array([-r[1] for r in records], dtype=np.float64)
+    lengths = np.array([len(r[0]) for r in records], dtype=np.uint32)
+
+    # Rank the places of each block by descending importance, then by shorter
+    # names, then by position
+    blocks = np.full(((len(records) + BLOCK_SIZE - 1) // BLOCK_SIZE, BLOCK_TOP), -1, dtype=np.int64)
+    for b in range(len(blocks)):
+        positions = np.arange(b * BLOCK_SIZE, min((b + 1) * BLOCK_SIZE, len(records)))
+        best = positions[np.lexsort((positions, lengths[positions], -importance[positions]))][:BLOCK_TOP]
+        blocks[b, :len(best)] = best
+
+    np.save(os.path.join(directory, "offsets.npy"), offsets)
+    np.save(os.path.join(directory, "importance.npy"), importance)
+    np.save(os.path.join(directory, "lengths.npy"), lengths)
+    np.save(os.path.join(directory, "blocks.npy"), blocks)
+
+    return len(records)
+
+
+class PlaceIndex:
+    """ Memory-mapped place index built by `build_index` """
+
+    def __init__(self, directory: str):
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        self.importance = np.load(os.path.join(directory, "importance.npy"), mmap_mode="r")
+        self.lengths = np.load(os.path.join(directory, "lengths.npy"), mmap_mode="r")
+        self.blocks = np.load(os.path.join(directory, "blocks.npy"), mmap_mode="r")
+
+        with open(os.path.join(directory, "records.bin"), "rb") as f:
+            # An empty file cannot be memory-mapped
+            self.records = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets.size else b""
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def search(self, query: str, limit: int = 5) -> list[dict]:
+        """ Find the places whose names start with `query`, ranked by exact
+            matches first, then by importance, then by shorter names
+
+            :return:    A list of dictionaries of the format:
+                        {"name": ..., "address": ..., "latitude": ..., "longitude": ...} """
+        prefix = normalize_name(query).encode("utf-8")
+        if not prefix:
+            return []
+
+        # No UTF-8 string contains the byte 0xff, so every key that starts with
+        # `prefix` sorts before `prefix + 0xff`. Exact matches sort first, and
+        # are already sorted by importance.
+        begin = self._lower_bound(prefix)
+        exact_end = self._lower_bound(prefix, upper=True)
+        end = self._lower_bound(prefix + b"\xff")
+
+        positions = list(range(begin, min(exact_end, begin + limit)))
+        positions += self._best(exact_end, end, limit - len(positions))
+        candidates = [self._record(i) for i in positions]
+
+        return [
+            {"name": name.decode("utf-8"),
+             "address": display_name.decode("utf-8"),
+             "latitude": latitude.decode(),
+             "longitude": longitude.decode()}
+            for _, name, display_name, latitude, longitude, _ in candidates[:limit]
+        ]
+
+    def _best(self, begin: int, end: int, count: int) -> list[int]:
+        """ Positions of the `count` best ranked places between `begin` and
+            `end`, by descending importance and then by shorter names """
+        if count <= 0 or begin >= end:
+            return []
+
+        first = -(-begin // BLOCK_SIZE)
+        last = end // BLOCK_SIZE
+        if count > BLOCK_TOP or last - first < 1:
+            candidates = np.arange(begin, end)
+        else:
+            # The best places of the blocks inside the range, plus every place
+            # in the partial blocks at either end
+            best = np.asarray(self.blocks[first:last]).ravel()
+            candidates = np.concatenate((
+                np.arange(begin, first * BLOCK_SIZE), best[best >= 0], np.arange(last * BLOCK_SIZE, end),
+            ))
+
+        order = np.lexsort((candidates, self.lengths[candidates], -self.importance[candidates]))
+        return candidates[order[:count]].tolist()
+
+    def _key(self, i: int) -> bytes:
+        start = int(self.offsets[i])
+        return self.records[start:self.records.find(SEPARATOR, start)]
+
+    def _record(self, i: int) -> list[bytes]:
+        start = int(self.offsets[i])
+        return self.records[start:self.records.find(b"\n", start)].split(SEPARATOR)
+
+    def _lower_bound(self, key: bytes, upper: bool = False) -> int:
+        """ Index of the first record whose key is not less than `key`, or
+            greater than `key` if `upper` is True """
+        low, high = 0, len(self.offsets)
+        while low < high:
+            middle = (low + high) // 2
+            middle_key = self._key(middle)
+            if middle_key < key or (upper and middle_key == key):
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+
+def _clean(value: str) -> str:
+    """ Remove characters that are used as delimiters in the index """
+    return value.replace("\x1f", " ").replace("\n", " ").replace("\r", " ").strip()
+
+
+def _columns_from_header(header: list[str]) -> dict:
+    """ Find the column number of each field from a header row """
+    header = [h.strip().casefold() for h in header]
+    columns = {}
+
+    for field, names in COLUMN_NAMES.items():
+        for name in names:
+            if name in header:
+                columns[field] = header.index(name)
+                break
+
+    missing = {"name", "latitude", "longitude"} - columns.keys()
+    if missing:
+        raise ValueError(f"Gazetteer header is missing columns: {', '.join(sorted(missing))}")
+
+    return columns
@@ -0,0 +1,291 @@
+""" Geocoders that search for candidate locations by name
+
+    Every geocoder returns a list of dictionaries of the format:
+        {"name": ..., "address": ..., "latitude": ..., "longitude": ...}
+    ordered from most to least relevant. """
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.gazetteer import PlaceIndex
+
+
+class GeocoderError(Exception):
+    """ Raised when a geocoder's upstream service fails or cannot be reached """
+
+
+class Geocoder:
+    """ Base class for geocoders """
+
+    def search(self, query: str, limit: int = 5) -> list[dict]:
+        raise NotImplementedError
+
+    async def asearch(self, query: str, limit: int = 5) -> list[dict]:
+        """ Search without blocking the event loop; by default `search` runs
+            in a worker thread """
+        return await asyncio.to_thread(self.search, query, limit)
+
+
+class NominatimGeocoder(Geocoder):
+    """ Geocoder backed by the Nominatim API, which uses OpenStreetMap data.
+        Connections are pooled and reused across searches. """
+
+    def __init__(self, url: str = "https://nominatim.openstreetmap.org/search",
+                 user_agent: str = "TourGuide", timeout: float = 5.0, pool_size: int = 10):
+        self.url = url
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.pool_size = pool_size
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = user_agent
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # Asynchronous clients are bound to the event loop they were created
+        # on, so there is one per running loop
+        self.async_clients = weakref.WeakKeyDictionary()
+
+    def search(self, query: str, limit: int = 5) -> list[dict]:
+        try:
+            response = self.session.get(self.url, params=self.params(query, limit), timeout=self.timeout)
+            response.raise_for_status()
+            results = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise GeocoderError(f"Nominatim search for {query!r} failed: {e}") from e
+
+        return self.parse(results)
+
+    async def asearch(self, query: str, limit: int = 5) -> list[dict]:
+        loop = asyncio.get_running_loop()
+        if loop not in self.async_clients:
+            self.async_clients[loop] = httpx.AsyncClient(
+                headers={"User-Agent": self.user_agent},
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.pool_size),
+            )
+
+        try:
+            response = await self.async_clients[loop].get(self.url, params=self.params(query, limit))
+            response.raise_for_status()
+            results = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise GeocoderError(f"Nominatim search for {query!r} failed: {e}") from e
+
+        return self.parse(results)
+
+    def params(self, query: str, limit: int) -> dict:
+        """ Parameters for API call """
+        return {"q": query,                 # search query
+                "format": "json",           # return in json format
+                "accept-language": "en",    # return results in English
+                "limit": limit,             # max number of results returned
+        }
+
+    def parse(self, results: list[dict]) -> list[dict]:
+        """ Convert Nominatim results into the common result format """
+        return [
+            {"name": loc["name"],
+             "address": loc["display_name"],
+             "latitude": loc["lat"],
+             "longitude": loc["lon"]} for loc in results
+        ]
+
+
+class LocalGeocoder(Geocoder):
+    """ Geocoder that searches a fixed list of places in memory, for tests and
+        local development without network access """
+
+    def __init__(self, places: list[dict] = None):
+        self.places = places or []
+
+    def search(self, query: str, limit: int = 5) -> list[dict]:
+        query = normalize_query(query)
+        return [place for place in self.places if query in place["name"].casefold()][:limit]
+
+    async def asearch(self, query: str, limit: int = 5) -> list[dict]:
+        return self.search(query, limit)
+
+
+class OfflineGeocoder(Geocoder):
+    """ Geocoder that searches a local place index built from a gazetteer
+        (see `utils.gazetteer`), without any network access """
+
+    def __init__(self, path: str):
+        self.index = PlaceIndex(path)
+
+    def search(self, query: str, limit: int = 5) -> list[dict]:
+        return self.index.search(query, limit)
+
+    async def asearch(self, query: str, limit: int = 5) -> list[dict]:
+        # Index lookups take a few milliseconds at most, so they run inline
+        return self.search(query, limit)
+
+
+class CachedGeocoder(Geocoder):
+    """ Geocoder that serves repeated searches from a persistent SQLite cache
+        keyed by the normalized query, and passes other searches through to
+        another geocoder
+
+        Entries expire after `ttl` seconds. Once there are more than
+        `max_entries` entries, the least recently used ones are evicted.
+        Eviction runs every `EVICT_INTERVAL` stores, or sooner once this
+        geocoder's estimate of the number of entries passes `max_entries`,
+        rather than on every store. """
+
+    # Minimum number of seconds between updates of an entry's last use time,
+    # so that most cache hits do not write to the database
+    TOUCH_INTERVAL = 60
+
+    # Greatest number of stores between evictions
+    EVICT_INTERVAL = 100
+
+    def __init__(self, backend: Geocoder, path: str, ttl: float = 7 * 24 * 60 * 60,
+                 max_entries: int = 100_000):
+        self.backend = backend
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        self.connection().execute(
+            "CREATE TABLE IF NOT EXISTS geocode_cache ("
+            "query TEXT NOT NULL, "
+            "lim INTEGER NOT NULL, "
+            "results TEXT NOT NULL, "
+            "created REAL NOT NULL, "
+            "last_used REAL NOT NULL, "
+            "PRIMARY KEY (query, lim))"
+        )
+        self.connection().execute(
+            "CREATE INDEX IF NOT EXISTS geocode_cache_last_used ON geocode_cache (last_used)")
+        self.connection().execute(
+            "CREATE INDEX IF NOT EXISTS geocode_cache_created ON geocode_cache (created)")
+
+        # Estimated number of entries, which counts replaced entries and
+        # misses other processes' stores and is corrected by each eviction,
+        # and the number of stores since the last eviction
+        self.entries = self.connection().execute("SELECT COUNT(*) FROM geocode_cache").fetchone()[0]
+        self.stores = 0
+
+    def connection(self) -> sqlite3.Connection:
+        """ Get this thread's connection to the cache database """
+        if not hasattr(self.local, "connection"):
+            connection = sqlite3.connect(self.path, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+
+        return self.local.connection
+
+    def search(self, query: str, limit: int = 5) -> list[dict]:
+        results = self.lookup(query, limit)
+        if results is None:
+            results = self.backend.search(query, limit)
+            self.store(query, limit, results)
+
+        return results
+
+    async def asearch(self, query: str, limit: int = 5) -> list[dict]:
+        # Cache lookups and stores may wait on the database, so they run in
+        # worker threads
+        results = await asyncio.to_thread(self.lookup, query, limit)
+        if results is None:
+            results = await self.backend.asearch(query, limit)
+            await asyncio.to_thread(self.store, query, limit, results)
+
+        return results
+
+    def lookup(self, query: str, limit: int) -> list[dict] | None:
+        """ Get the cached results of a search, or None if they are not cached
+            or have expired """
+        key = normalize_query(query)
+        now = time.time()
+
+        row = self.connection().execute(
+            "SELECT results, created, last_used FROM geocode_cache WHERE query = ? AND lim = ?",
+            (key, limit)).fetchone()
+
+        if row is None or now - row[1] >= self.ttl:
+            return None
+
+        if now - row[2] > self.TOUCH_INTERVAL:
+            self.connection().execute(
+                "UPDATE geocode_cache SET last_used = ? WHERE query = ? AND lim = ?",
+                (now, key, limit))
+
+        return json.loads(row[0])
+
+    def store(self, query: str, limit: int, results: list[dict]):
+        """ Cache the results of a search """
+        now = time.time()
+        self.connection().execute(
+            "INSERT OR REPLACE INTO geocode_cache VALUES (?, ?, ?, ?, ?)",
+            (normalize_query(query), limit, json.dumps(results), now, now))
+
+        with self.lock:
+            self.entries += 1
+            self.stores += 1
+            due = self.entries > self.max_entries or self.stores >= self.EVICT_INTERVAL
+        if due:
+            self.evict()
+
+    def evict(self):
+        """ Delete expired entries and, if there are still too many entries,
+            the least recently used ones """
+        connection = self.connection()
+        connection.execute("DELETE FROM geocode_cache WHERE created < ?", (time.time() - self.ttl,))
+
+        entries = connection.execute("SELECT COUNT(*) FROM geocode_cache").fetchone()[0]
+        excess = entries - self.max_entries
+        if excess > 0:
+            connection.execute(
+                "DELETE FROM geocode_cache WHERE rowid IN "
+                "(SELECT rowid FROM geocode_cache ORDER BY last_used LIMIT ?)", (excess,))
+
+        with self.lock:
+            self.entries = min(entries, self.max_entries)
+            self.stores = 0
+
+
+def normalize_query(query: str) -> str:
+    """ Normalize a search query so that trivially different queries, e.g.,
+        "New  York" and "new york", share a cache entry """
+    return " ".join(query.casefold().split())
+
+
+def make_geocoder(backend: str = "nominatim", cache_path: str = None, **options) -> Geocoder:
+    """ Create a geocoder by name, wrapped in a persistent cache if a cache
+        path is given
+
+        :param backend:     "nominatim", "offline", or "local"
+        :param cache_path:  Path to the SQLite cache database, or None to
+                            disable caching; the offline geocoder is never
+                            cached since its index is just as fast
+        :param options:     `timeout` for Nominatim, `place_index` (the index
+                            directory) for the offline geocoder, `places` for
+                            the local geocoder, and `ttl` and `max_entries`
+                            for the cache """
+    if backend == "nominatim":
+        geocoder = NominatimGeocoder(timeout=options.get("timeout", 5.0))
+    elif backend == "offline":
+        return OfflineGeocoder(options["place_index"])
+    elif backend == "local":
+        geocoder = LocalGeocoder(options.get("places"))
+    else:
+        raise ValueError(f"Unknown geocoder backend: {backend!r}")
+
+    if cache_path is None:
+        return geocoder
+
+    cache_options = {k: options[k] for k in ("ttl", "max_entries") if k in options}
+    return CachedGeocoder(geocoder, cache_path, **cache_options)
@@ -0,0 +1,130 @@
+""" Cache of distance matrices keyed by the locations they cover, so that
+    adding or removing a single location can grow or shrink a tour's matrix
+    instead of rebuilding it
+
+    A matrix is keyed by a hash of its locations' IDs and coordinates, so a
+    tour whose locations changed, moved, or were deleted simply no longer finds
+    its old matrix, and nothing has to be invalidated. Matrices are stored
+    through Django's cache framework in the cache named by `CACHE_ALIAS` (see
+    `CACHES` in settings). On top of the backend's own culling, entries are
+    evicted least-recently-used first once their total size exceeds
+    `DISTANCE_CACHE_MAX_BYTES`. The LRU index of entries and their sizes, and
+    the hit/miss/eviction counters, are stored in the same cache, so that
+    processes sharing a backend also share the budget; concurrent updates from
+    different processes may at worst evict an entry early or briefly exceed
+    the budget. """
+import hashlib
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+CACHE_ALIAS = "distances"
+
+# {key: size in bytes} of every cached matrix, least recently used first
+INDEX_KEY = "tour-distances:index"
+
+COUNTERS = ("hits", "misses", "evictions")
+
+_lock = threading.Lock()
+
+
+def get(data: dict) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+    """ Get the cached distance matrix, IDs, and coordinates of a set of
+        locations, or None if they are not cached
+
+        :param data:    Dictionary of the format: {location_id: (latitude, longitude)} """
+    entry_key = key(data)
+    cached = caches[CACHE_ALIAS].get(entry_key)
+
+    _count("hits" if cached is not None else "misses")
+    if cached is not None:
+        with _lock:
+            index = _index()
+            if entry_key in index:
+                index[entry_key] = index.pop(entry_key)
+                caches[CACHE_ALIAS].set(INDEX_KEY, index, timeout=None)
+
+    return cached
+
+
+def put(distances: np.ndarray, ids: np.ndarray, coordinates: np.ndarray):
+    """ Cache the distance matrix, IDs, and coordinates of a set of locations,
+        evicting the least recently used matrices if the cache is over its
+        budget """
+    size = distances.nbytes + ids.nbytes + coordinates.nbytes
+    max_bytes = settings.DISTANCE_CACHE_MAX_BYTES
+
+    # a matrix larger than the whole budget is not worth caching
+    if size > max_bytes:
+        return
+
+    entry_key = key(dict(zip(ids.tolist(), coordinates.tolist())))
+    cache = caches[CACHE_ALIAS]
+    cache.set(entry_key, (distances, ids, coordinates), timeout=None)
+
+    with _lock:
+        index = _index()
+        index.pop(entry_key, None)
+        index[entry_key] = size
+
+        evicted = []
+        total = sum(index.values())
+        while total > max_bytes:
+            oldest = next(iter(index))
+            total -= index.pop(oldest)
+            evicted.append(oldest)
+
+        cache.set(INDEX_KEY, index, timeout=None)
+
+    if evicted:
+        cache.delete_many(evicted)
+        _count("evictions", len(evicted))
+
+
+def key(data: dict) -> str:
+    """ Cache key of a set of locations: a hash of their IDs and coordinates,
+        in ID order """
+    digest = hashlib.sha256()
+    for id in sorted(data):
+        lat, long = data[id]
+        digest.update(f"{id}:{float(lat):.6f}:{float(long):.6f};".encode())
+
+    return f"tour-distances:{digest.hexdigest()}"
+
+
+def stats() -> dict:
+    """ Get the cache's hit, miss, and eviction counters and its current size """
+    cache = caches[CACHE_ALIAS]
+    counters = cache.get_many([_counter_key(name) for name in COUNTERS])
+    counters = {name: counters.get(_counter_key(name), 0) for name in COUNTERS}
+    lookups = counters["hits"] + counters["misses"]
+    index = _index()
+
+    return {
+        **counters,
+        "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+        "entries": len(index),
+        "bytes": sum(index.values()),
+        "max_bytes": settings.DISTANCE_CACHE_MAX_BYTES,
+    }
+
+
+def _index() -> dict:
+    return caches[CACHE_ALIAS].get(INDEX_KEY) or {}
+
+
+def _counter_key(name: str) -> str:
+    return f"tour-distances:{name}"
+
+
+def _count(name: str, amount: int = 1):
+    """ Add to one of the counters in the cache """
+    cache = caches[CACHE_ALIAS]
+    cache.add(_counter_key(name), 0, timeout=None)
+    try:
+        cache.incr(_counter_key(name), amount)
+    except ValueError:
+        # the counter was culled in between
+        cache.add(_counter_key(name), amount, timeout=None)
@@ -0,0 +1,84 @@
+""" Cache of serialized `get_tour` responses, so that fetching a tour that has
+    not changed since it was last fetched does not query the database
+
+    Each entry holds a response body along with its ETag and the time it was
+    built, and is tagged with the version of its tour that was current before
+    the tour was read from the database. Changes to a tour bump its version
+    once they are committed, so an entry that was built from an older state of
+    the tour, even one stored after the change was committed, is never served.
+    Entries and versions are stored through Django's cache framework in the
+    cache named by `CACHE_ALIAS` (see `CACHES` in settings); when there is
+    more than one server process it must be a backend they share, or else a
+    process could keep serving a tour that another process changed. """
+import hashlib
+import json
+import time
+
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+CACHE_ALIAS = "responses"
+
+
+def get(tour_id: int) -> tuple[dict | None, int]:
+    """ Get the cached response of a tour as a dictionary of the format:
+        {"body": bytes, "etag": str, "last_modified": timestamp, "version": int},
+        or None if it is not cached or out of date, along with the tour's
+        current version, which is to be passed to `put` """
+    cache = caches[CACHE_ALIAS]
+    found = cache.get_many([_key(tour_id), _version_key(tour_id)])
+    entry, version = found.get(_key(tour_id)), found.get(_version_key(tour_id))
+
+    if version is None:
+        # Versions start from the current time rather than from 0, so that a
+        # version that is evicted from the cache never matches old entries
+        cache.add(_version_key(tour_id), time.time_ns(), timeout=None)
+        version = cache.get(_version_key(tour_id))
+
+    if entry is not None and entry["version"] != version:
+        entry = None
+
+    return entry, version
+
+
+def put(tour_id: int, version: int, data: dict) -> dict:
+    """ Serialize and cache the response of a tour, read from the database
+        after `get` returned `version`, and return its entry """
+    body = json.dumps(data, cls=DjangoJSONEncoder).encode()
+    entry = {
+        "body": body,
+        "etag": f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+        "last_modified": int(time.time()),
+        "version": version,
+    }
+
+    caches[CACHE_ALIAS].set(_key(tour_id), entry, timeout=None)
+    return entry
+
+
+def discard(tour_id: int):
+    """ Invalidate the cached response of a tour, if there is one, by bumping
+        the tour's version """
+    cache = caches[CACHE_ALIAS]
+    try:
+        cache.incr(_version_key(tour_id))
+    except ValueError:
+        # The tour has no version yet, or it was evicted
+        cache.add(_version_key(tour_id), time.time_ns(), timeout=None)
+    cache.delete(_key(tour_id))
+
+
+def discard_on_commit(tour_id: int):
+    """ Invalidate the cached response of a tour once the current transaction
+        commits, so that it is not rebuilt from the tour's old state in the
+        meantime """
+    transaction.on_commit(lambda: discard(tour_id))
+
+
+def _key(tour_id: int) -> str:
+    return f"tour-response:{tour_id}"
+
+
+def _version_key(tour_id: int) -> str:
+    return f"tour-version:{tour_id}"
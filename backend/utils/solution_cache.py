@@ -0,0 +1,115 @@
+""" Cache of solved tours keyed by the set of locations they visit, so that a
+    set of locations that was solved before, by any tour, is not solved again
+
+    A solution is stored as a cycle that starts at its smallest location ID and
+    is rotated to whichever location a tour starts at; a path (see the modes of
+    `calculate_tour`) is only reused for the same start and end. Solutions are
+    stored along with how they were
+    found (see `calculate_tour`). A solution that is not known to be optimal
+    is only reused by requests with at most the time budget it was found
+    with, so that a larger budget can find a shorter tour. Solutions are stored
+    through Django's cache framework in the cache named by `CACHE_ALIAS` (see
+    `CACHES` in settings), whose MAX_ENTRIES bounds the number of solutions
+    kept. The hit and miss counters are kept per process. """
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from utils.algorithms import CYCLE, SOLVER_VERSION, calculate_tour, rotate
+
+CACHE_ALIAS = "solutions"
+
+_counters = {"hits": 0, "misses": 0}
+_lock = threading.Lock()
+
+
+def solve(data: dict, start: int, time_budget_ms: float = None,
+          mode: str = CYCLE, end: int = None) -> tuple[list, float, dict]:
+    """ `calculate_tour`, reusing the cached solution for the same locations if
+        there is one
+
+        :param data:            Dictionary of the format: {location_id: (latitude, longitude)}
+        :param start:           ID of the location the tour starts at
+        :param time_budget_ms:  Passed to `calculate_tour` on a cache miss;
+                                defaults to the TOUR_TIME_BUDGET_MS setting
+        :param mode:            CYCLE, OPEN, or FIXED (see `calculate_tour`)
+        :param end:             ID of the last location, for FIXED
+        :return:                A tuple containing the tour, its cost, and how
+                                it was found (see `calculate_tour`), with
+                                "cached" set if it was found before """
+    if time_budget_ms is None:
+        time_budget_ms = settings.TOUR_TIME_BUDGET_MS
+
+    cached = get(data, start, time_budget_ms, mode, end)
+    if cached is not None:
+        return cached
+
+    tour, cost, info = calculate_tour(data, start, time_budget_ms, mode, end)
+    put(data, tour, cost, info, mode)
+    return tour, cost, {**info, "cached": False}
+
+
+def get(data: dict, start: int, time_budget_ms: float = None,
+        mode: str = CYCLE, end: int = None) -> tuple[list, float, dict] | None:
+    """ Get the cached tour of a set of locations, starting at `start`, its
+        cost, and how it was found, or None if the locations have not been
+        solved, or were solved with less than `time_budget_ms` and not to
+        optimality """
+    cached = caches[CACHE_ALIAS].get(key(data, mode, start, end))
+
+    if cached is not None:
+        _, _, info = cached
+        if time_budget_ms is not None and not info["optimal"] and info["time_budget_ms"] < time_budget_ms:
+            cached = None
+
+    with _lock:
+        _counters["hits" if cached is not None else "misses"] += 1
+
+    if cached is None:
+        return None
+
+    cycle, cost, info = cached
+    return rotate(cycle, -cycle.index(start)), cost, {**info, "cached": True}
+
+
+def put(data: dict, tour: list, cost: float, info: dict, mode: str = CYCLE):
+    """ Cache the tour of a set of locations and how it was found """
+    if not tour:
+        return
+
+    if mode != CYCLE:
+        caches[CACHE_ALIAS].set(key(data, mode, tour[0], tour[-1]), (list(tour), cost, info), timeout=None)
+        return
+
+    # store the cycle starting at its smallest ID, so that every tour of the
+    # same locations shares one entry whatever its start
+    cycle = rotate(list(tour), -tour.index(min(tour)))
+    caches[CACHE_ALIAS].set(key(data), (cycle, cost, info), timeout=None)
+
+
+def key(data: dict, mode: str = CYCLE, start: int = None, end: int = None) -> str:
+    """ Cache key of a set of locations: a hash of their IDs and coordinates,
+        in ID order, and the solver version. The key of a path also includes
+        its mode, start, and, for a fixed end, its end. """
+    digest = hashlib.sha256()
+    for id in sorted(data):
+        lat, long = data[id]
+        digest.update(f"{id}:{float(lat):.6f}:{float(long):.6f};".encode())
+
+    if mode != CYCLE:
+        digest.update(f"{mode}:{start}:{end if mode != 'open' else ''}".encode())
+
+    return f"tour-solution:{SOLVER_VERSION}:{digest.hexdigest()}"
+
+
+def stats() -> dict:
+    """ Get the cache's hit and miss counters and its hit rate """
+    with _lock:
+        lookups = _counters["hits"] + _counters["misses"]
+        return {
+            **_counters,
+            "hit_rate": _counters["hits"] / lookups if lookups else 0.0,
+            "max_entries": settings.CACHES[CACHE_ALIAS].get("OPTIONS", {}).get("MAX_ENTRIES"),
+        }
@@ -0,0 +1,222 @@
+""" Pool of worker processes that improve large tours in the background, so
+    that long solves neither hold up the request that started them nor, because
+    of the GIL, each other
+
+    Every submitted solve is a job with an ID. Job statuses are stored through
+    Django's default cache, so that any server process can report them, while
+    the futures themselves live in the process that submitted them. Submitting
+    a job for a tour supersedes the tour's earlier jobs: they are cancelled if
+    they have not started yet, and their results are discarded otherwise. """
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from utils.algorithms import CYCLE, improve_path, improve_tour
+
+# number of seconds that job statuses are kept for
+JOB_TIMEOUT = 60 * 60
+
+# statuses after which a job's status no longer changes
+FINISHED = ("done", "failed", "cancelled")
+
+_pool = None
+
+# results are written back one at a time, off the pool's own callback thread
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="solver-writer")
+
+# {tour_id: (job_id, future)} for the latest job of each tour submitted by this process
+_latest = {}
+_lock = threading.Lock()
+
+
+def start():
+    """ Start the worker processes, if the pool is enabled and not already
+        running, and have each of them import the solver so that the first
+        jobs do not wait for it """
+    global _pool
+
+    with _lock:
+        if _pool is not None or settings.SOLVER_WORKERS <= 0:
+            return _pool
+
+        # worker processes are spawned rather than forked, since forking a
+        # server process would copy its threads' locks and database connections
+        _pool = ProcessPoolExecutor(max_workers=settings.SOLVER_WORKERS,
+                                    mp_context=multiprocessing.get_context("spawn"),
+                                    initializer=_warm_up)
+
+        # processes are only started as jobs arrive, so send each one a no-op
+        for _ in range(settings.SOLVER_WORKERS):
+            _pool.submit(_ping)
+
+    return _pool
+
+
+def enabled() -> bool:
+    """ Whether tours are solved by the pool rather than in the request """
+    return settings.SOLVER_WORKERS > 0
+
+
+def submit(tour_id: int, distances: np.ndarray, ids: np.ndarray, tour: list,
+           on_result, time_budget: float = None, mode: str = CYCLE, end: int = None) -> str:
+    """ Submit a job that improves a tour, superseding the tour's earlier jobs.
+        If the pool is disabled, the job runs in the calling thread before
+        this returns.
+
+        :param tour_id:     ID of the tour
+        :param distances:   Distance matrix or distance provider of the
+                            tour's locations
+        :param ids:         IDs of the locations
+        :param tour:        IDs of the locations in their current order, which
+                            the job starts from
+        :param on_result:   Called as `on_result(tour_id, order)` in a
+                            background thread with the improved order, unless
+                            the job has been superseded; returns whether the
+                            order was saved
+        :param time_budget: Seconds the job may spend improving the tour;
+                            defaults to SOLVER_TIME_BUDGET
+        :param mode:        CYCLE, OPEN, or FIXED (see `calculate_tour`)
+        :param end:         ID of the last location, for FIXED
+        :return:            The job's ID """
+    pool = start()
+    if time_budget is None:
+        time_budget = settings.SOLVER_TIME_BUDGET
+
+    job_id = uuid.uuid4().hex
+
+    with _lock:
+        # cancel the tour's previous job if it has not started yet; if it has,
+        # its result is discarded since it is no longer the latest
+        previous = _latest.get(tour_id)
+        if previous is not None:
+            previous[1].cancel()
+
+        cache.set(_tour_key(tour_id), job_id, JOB_TIMEOUT)
+        _set_status(job_id, {"id": job_id, "tour_id": tour_id, "status": "queued",
+                             "submitted": time.time(), "finished": None})
+
+        if pool is not None:
+            future = pool.submit(solve, distances, ids, tour, time_budget, mode, end)
+            _latest[tour_id] = (job_id, future)
+
+    if pool is None:
+        future = _run_inline(solve, distances, ids, tour, time_budget, mode, end)
+        with _lock:
+            _latest[tour_id] = (job_id, future)
+
+    future.add_done_callback(lambda f: _writer.submit(_finish, tour_id, job_id, f, on_result))
+    return job_id
+
+
+def cancel(tour_id: int):
+    """ Cancel the latest job of a tour, e.g., when the tour is deleted """
+    cache.delete(_tour_key(tour_id))
+
+    with _lock:
+        latest = _latest.pop(tour_id, None)
+    if latest is not None:
+        latest[1].cancel()
+
+
+def status(job_id: str) -> dict | None:
+    """ Get the status of a job, or None if there is no such job. The status
+        is one of "queued", "running", "done", "failed", or "cancelled", and
+        finished jobs include their resulting `order` and `cost` or `error` """
+    job = cache.get(_job_key(job_id))
+    if job is None:
+        return None
+
+    # only the submitting process can tell whether a queued job has started
+    if job["status"] == "queued":
+        with _lock:
+            latest = _latest.get(job["tour_id"])
+        if latest is not None and latest[0] == job_id and latest[1].running():
+            job["status"] = "running"
+
+    return job
+
+
+def solve(distances: np.ndarray, ids: np.ndarray, tour: list, time_budget: float,
+          mode: str = CYCLE, end: int = None) -> tuple[list, float]:
+    """ Runs in a worker process: improve a tour for up to `time_budget` seconds,
+        starting from its current order """
+    if mode != CYCLE:
+        return improve_path(distances, ids, tour, end, time_limit=time_budget)
+    return improve_tour(distances, ids, tour, time_limit=time_budget)
+
+
+def _finish(tour_id: int, job_id: str, future, on_result):
+    """ Record the outcome of a job and write its result back if it is still
+        the tour's latest job """
+    job = cache.get(_job_key(job_id)) or {"id": job_id, "tour_id": tour_id}
+    job["finished"] = time.time()
+
+    try:
+        if future.cancelled():
+            job["status"] = "cancelled"
+        elif future.exception() is not None:
+            job["status"] = "failed"
+            job["error"] = str(future.exception())
+        elif cache.get(_tour_key(tour_id)) != job_id:
+            # a later edit to the tour superseded this job
+            job["status"] = "cancelled"
+        else:
+            order, cost = future.result()
+            if on_result(tour_id, order):
+                job.update(status="done", order=order, cost=cost)
+            else:
+                # the tour changed or was deleted while the job was running
+                job["status"] = "cancelled"
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+    finally:
+        # the writer thread is long-lived, so it should not hold a connection
+        connection.close()
+
+    _set_status(job_id, job)
+
+    with _lock:
+        if _latest.get(tour_id, (None,))[0] == job_id:
+            del _latest[tour_id]
+
+
+def _run_inline(func, *args) -> Future:
+    """ Run a job in the calling thread, for when the pool is disabled, and
+        return its finished future """
+    future = Future()
+    future.set_running_or_notify_cancel()
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def _set_status(job_id: str, job: dict):
+    cache.set(_job_key(job_id), job, JOB_TIMEOUT)
+
+
+def _job_key(job_id: str) -> str:
+    return f"solver-job:{job_id}"
+
+
+def _tour_key(tour_id: int) -> str:
+    return f"solver-tour:{tour_id}"
+
+
+def _warm_up():
+    """ Runs in each worker process as it starts: solve a tiny tour so that
+        the solver and NumPy are imported and ready """
+    improve_tour(np.ones((4, 4)), np.arange(4), [0, 1, 2, 3], time_limit=0.01)
+
+
+def _ping():
+    pass
@@ -0,0 +1,193 @@
+""" Spatial index over latitude/longitude points for nearest neighbor and
+    radius queries, with support for deleting points as they are used up
+
+    Points are placed on the unit sphere as 3D vectors and stored in a k-d tree
+    whose leaves hold small buckets of points. The straight-line (chord)
+    distance between two points on the sphere grows with their great-circle
+    distance, so the nearest points by one are the nearest by the other, and
+    the tree can search with simple bounding boxes. Each node counts the points
+    below it that have not been deleted, so that emptied parts of the tree are
+    skipped; a query therefore stays fast as points are deleted, which is what
+    the Nearest Neighbor heuristic does once per step. """
+import heapq
+import math
+
+import numpy as np
+
+RADIUS = 3958.8  # Radius of Earth in miles
+
+# greatest number of points in a leaf of the tree
+LEAF_SIZE = 16
+
+
+class SpatialIndex:
+
+    def __init__(self, lats: np.ndarray, longs: np.ndarray):
+        """ :param lats:    Latitudes of the points, in radians
+            :param longs:   Longitudes of the points, in radians """
+        lats = np.asarray(lats, dtype=np.float64)
+        longs = np.asarray(longs, dtype=np.float64)
+        self.points = np.column_stack((np.cos(lats) * np.cos(longs),
+                                       np.cos(lats) * np.sin(longs),
+                                       np.sin(lats)))
+        self.alive = np.ones(len(self.points), dtype=bool)
+
+        # nodes are stored in parallel lists; a leaf has no children and owns
+        # the points `order[start:end]`
+        self.order = np.arange(len(self.points))
+        self.children = []
+        self.parent = []
+        self.start, self.end = [], []
+        self.low, self.high = [], []
+        self.count = []
+
+        # `leaf[p]` is the leaf that holds point `p`
+        self.leaf = np.empty(len(self.points), dtype=np.int64)
+
+        if len(self.points):
+            self._build(0, len(self.points), -1)
+
+    def __len__(self) -> int:
+        """ Number of points that have not been deleted """
+        return self.count[0] if self.count else 0
+
+    def delete(self, point: int):
+        """ Delete a point so that queries no longer return it """
+        if not self.alive[point]:
+            return
+
+        self.alive[point] = False
+        node = int(self.leaf[point])
+        while node != -1:
+            self.count[node] -= 1
+            node = self.parent[node]
+
+    def distance(self, a: int, b: int) -> float:
+        """ Great-circle distance in miles between two points """
+        chord = np.linalg.norm(self.points[a] - self.points[b])
+        return 2 * RADIUS * math.asin(min(chord / 2, 1.0))
+
+    def nearest(self, point: int, k: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        """ Get the `k` nearest points to a point, not including itself or
+            deleted points
+
+            :param point:   Index of the point to search around
+            :param k:       Number of points to find
+            :return:        A tuple containing the indices of the nearest
+                            points, nearest first, and their great-circle
+                            distances in miles """
+        return self._search(self.points[point], k, math.inf, exclude=point)
+
+    def nearest_to(self, lat: float, long: float, k: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        """ Get the `k` nearest points to a latitude/longitude, in radians; see
+            `nearest` """
+        return self._search(self._vector(lat, long), k, math.inf)
+
+    def within(self, point: int, radius: float) -> tuple[np.ndarray, np.ndarray]:
+        """ Get every point within `radius` miles of a point, not including
+            itself or deleted points, nearest first; see `nearest` """
+        return self._search(self.points[point], len(self.points), _chord(radius) ** 2, exclude=point)
+
+    def within_of(self, lat: float, long: float, radius: float) -> tuple[np.ndarray, np.ndarray]:
+        """ Get every point within `radius` miles of a latitude/longitude, in
+            radians; see `nearest` """
+        return self._search(self._vector(lat, long), len(self.points), _chord(radius) ** 2)
+
+    def _search(self, query: np.ndarray, k: int, limit: float, exclude: int = -1):
+        """ Best-first search of the tree for up to `k` points whose squared
+            chord distance from `query` is at most `limit` """
+        q = query.tolist()
+        found_points, found_distances = [], []
+        # squared chord distance of the `k`-th nearest point found so far
+        bound = limit
+
+        # nodes are visited in order of the distance from the query to their
+        # bounding boxes, so the search ends at the first box that is farther
+        # than the `k`-th nearest point found
+        heap = [(0.0, 0)] if self.count and self.count[0] > 0 else []
+        while heap:
+            box_distance, node = heapq.heappop(heap)
+            if box_distance > bound:
+                break
+
+            if not self.children[node]:
+                candidates = self.order[self.start[node]:self.end[node]]
+                candidates = candidates[self.alive[candidates] & (candidates != exclude)]
+                distances = ((self.points[candidates] - query) ** 2).sum(axis=1)
+                keep = distances <= bound
+                found_points.append(candidates[keep])
+                found_distances.append(distances[keep])
+
+                # keep only the `k` nearest points found so far
+                points, distances = np.concatenate(found_points), np.concatenate(found_distances)
+                if len(points) > k:
+                    nearest = np.argpartition(distances, k - 1)[:k]
+                    points, distances = points[nearest], distances[nearest]
+                found_points, found_distances = [points], [distances]
+                if len(points) == k:
+                    bound = min(bound, float(distances.max()))
+                continue
+
+            for child in self.children[node]:
+                if self.count[child] > 0:
+                    distance = _box_distance(q, self.low[child], self.high[child])
+                    if distance <= bound:
+                        heapq.heappush(heap, (distance, child))
+
+        if not found_points:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        points, distances = found_points[0], found_distances[0]
+        nearest = np.argsort(distances, kind="stable")
+        return points[nearest], 2 * RADIUS * np.arcsin(np.minimum(np.sqrt(distances[nearest]) / 2, 1.0))
+
+    def _build(self, start: int, end: int, parent: int) -> int:
+        """ Build the subtree over `order[start:end]` and return its root """
+        node = len(self.children)
+        members = self.order[start:end]
+        coordinates = self.points[members]
+
+        self.children.append(())
+        self.parent.append(parent)
+        self.start.append(start)
+        self.end.append(end)
+        self.low.append(coordinates.min(axis=0).tolist())
+        self.high.append(coordinates.max(axis=0).tolist())
+        self.count.append(end - start)
+
+        if end - start <= LEAF_SIZE:
+            self.leaf[members] = node
+            return node
+
+        # split at the median of the widest dimension
+        dimension = int(np.argmax(coordinates.max(axis=0) - coordinates.min(axis=0)))
+        middle = (end - start) // 2
+        split = np.argpartition(coordinates[:, dimension], middle)
+        self.order[start:end] = members[split]
+
+        left = self._build(start, start + middle, node)
+        right = self._build(start + middle, end, node)
+        self.children[node] = (left, right)
+
+        return node
+
+    @staticmethod
+    def _vector(lat: float, long: float) -> np.ndarray:
+        return np.array([math.cos(lat) * math.cos(long), math.cos(lat) * math.sin(long), math.sin(lat)])
+
+
+def _box_distance(q: list, low: list, high: list) -> float:
+    """ Squared distance from a point to the nearest point of a box """
+    total = 0.0
+    for x, lo, hi in zip(q, low, high):
+        if x < lo:
+            total += (lo - x) ** 2
+        elif x > hi:
+            total += (x - hi) ** 2
+    return total
+
+
+def _chord(miles: float) -> float:
+    """ Straight-line distance through the unit sphere between two points
+        that are `miles` apart along the surface """
+    return 2 * math.sin(min(miles / (2 * RADIUS), math.pi / 2))
@@ -0,0 +1,198 @@
+""" Per-request timing of the phases of a request, such as building a
+    distance matrix, solving a tour, or writing its new order
+
+    A request's timings are recorded only while `start` has been called for it
+    (by `tourguide.middleware.TimingMiddleware` for sampled requests), so that
+    timing a phase costs one context variable lookup the rest of the time:
+
+        with timing.phase("solve"):
+            order, _ = solve(...)
+
+        @timing.timed("matrix")
+        def build_matrix(...):
+            ...
+
+    Phases may be nested; the time spent in an inner phase is not counted
+    towards the outer one, so the phases of a request add up to at most its
+    total time. Database queries made during a request are counted, along
+    with the time they take, both for the request and for the phase they are
+    made in.
+
+    Timings are kept in a context variable, so they follow a request into
+    `sync_to_async` threads; work handed to an executor should be run with
+    `contextvars.copy_context().run` to be timed. """
+import contextvars
+import functools
+import time
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# name of the time spent outside of any phase
+OTHER = "other"
+
+# timings of the current request, or None if it is not being timed
+_current = contextvars.ContextVar("timings", default=None)
+
+
+class Timings:
+    """ Durations and query counts of the phases of a single request """
+
+    def __init__(self):
+        self.began = time.perf_counter()
+        self.ended = None
+
+        # {phase: [seconds, queries, query seconds]}, in the order the phases
+        # were first entered
+        self.phases = {}
+        self.queries = 0
+        self.query_seconds = 0.0
+
+        # phases that have been entered and not exited, innermost last, and
+        # when the innermost one was entered or last resumed
+        self._stack = []
+        self._resumed = self.began
+
+    @property
+    def total(self) -> float:
+        """ Seconds from the start of the request until it finished, or until
+            now if it has not finished """
+        return (self.ended or time.perf_counter()) - self.began
+
+    def enter(self, name: str):
+        self._pause()
+        self._stack.append(name)
+
+    def exit(self):
+        self._pause()
+        self._stack.pop()
+
+    def add_query(self, seconds: float):
+        self.queries += 1
+        self.query_seconds += seconds
+        entry = self._entry(self._stack[-1] if self._stack else OTHER)
+        entry[1] += 1
+        entry[2] += seconds
+
+    def finish(self):
+        self._pause()
+        self.ended = time.perf_counter()
+
+    def as_dict(self) -> dict:
+        """ Timings in milliseconds, e.g., for logging """
+        return {
+            "total_ms": round(self.total * 1000, 3),
+            "queries": self.queries,
+            "query_ms": round(self.query_seconds * 1000, 3),
+            "phases": {
+                name: {"ms": round(seconds * 1000, 3), "queries": queries, "query_ms": round(query_seconds * 1000, 3)}
+                for name, (seconds, queries, query_seconds) in self.phases.items()
+            },
+        }
+
+    def server_timing(self) -> str:
+        """ Timings as the value of a Server-Timing header, with durations in
+            milliseconds """
+        metrics = [f'{name};dur={seconds * 1000:.3f};desc="{queries} queries"'
+                   for name, (seconds, queries, _) in self.phases.items()]
+        metrics.append(f'db;dur={self.query_seconds * 1000:.3f};desc="{self.queries} queries"')
+        metrics.append(f"total;dur={self.total * 1000:.3f}")
+        return ", ".join(metrics)
+
+    def _pause(self):
+        """ Add the time since the innermost phase was resumed to it """
+        now = time.perf_counter()
+        self._entry(self._stack[-1] if self._stack else OTHER)[0] += now - self._resumed
+        self._resumed = now
+
+    def _entry(self, name: str) -> list:
+        return self.phases.setdefault(name, [0.0, 0, 0.0])
+
+
+def start() -> contextvars.Token:
+    """ Start timing the current request
+
+        :return:            A token to pass to `finish` """
+    return _current.set(Timings())
+
+
+def finish(token: contextvars.Token) -> Timings:
+    """ Stop timing the current request
+
+        :param token:       The token returned by `start`
+        :return:            The request's timings """
+    timings = _current.get()
+    timings.finish()
+    _current.reset(token)
+    return timings
+
+
+def current() -> Timings | None:
+    """ Get the timings of the current request, or None if it is not being timed """
+    return _current.get()
+
+
+class phase:
+    """ Context manager that times a phase of the current request """
+
+    __slots__ = ("name", "timings")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.timings = None
+
+    def __enter__(self):
+        self.timings = _current.get()
+        if self.timings is not None:
+            self.timings.enter(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings.exit()
+        return False
+
+
+def timed(name: str):
+    """ Decorator that times every call of a function as a phase of the
+        current request """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            timings = _current.get()
+            if timings is None:
+                return func(*args, **kwargs)
+
+            timings.enter(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings.exit()
+        return wrapper
+    return decorator
+
+
+def _count_query(execute, sql, params, many, context):
+    """ Database execute wrapper that counts queries made while timing """
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+
+    began = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(time.perf_counter() - began)
+
+
+def _install(connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def install_query_counter():
+    """ Count the queries made on every database connection, including ones
+        opened later (each thread has its own connections) """
+    connection_created.connect(_install, dispatch_uid="utils.timing")
+    for connection in connections.all(initialized_only=True):
+        _install(connection)
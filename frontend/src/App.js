@@ -30,6 +30,19 @@ function isEmpty(dict) {
 }
 
 
+async function getAllTours() {
+    // Tours are listed a page at a time, so follow the link to each next page
+    let tours = [];
+    let url = "http://127.0.0.1:8000/api/tours/";
+    while (url) {
+        const res = await axios.get(url);
+        tours = tours.concat(res.data.results);
+        url = res.data.next;
+    }
+    return tours;
+}
+
+
 function Dropdown({ currentTour, tours=[], handler }) {
     const selectItems = tours.map(t =>
         <option key={t.id} value={t.id}>{t.name}</option>
@@ -248,10 +261,10 @@ export default function App() {
         // Set tours upon page load
         let ignore = false;
         setTours([])
-        axios.get("http://127.0.0.1:8000/api/tours/")
-        .then(res => {
+        getAllTours()
+        .then(allTours => {
             if (!ignore) {
-                setTours(res.data);
+                setTours(allTours);
             }
         });
 
@@ -330,10 +343,10 @@ export default function App() {
         // Create tour with given name
         await axios.post("http://127.0.0.1:8000/api/create_tour/", {name: name})
         .then((newTour) => {
-            axios.get("http://127.0.0.1:8000/api/tours/")
-            .then((res) => {
+            getAllTours()
+            .then((allTours) => {
                 // Refresh list of tours
-                setTours(res.data);
+                setTours(allTours);
 
                 // Set current tour to newly created tour
                 handleTourChange(newTour.data.id);
@@ -352,8 +365,8 @@ export default function App() {
         await axios.delete("http://127.0.0.1:8000/api/delete_tour/" + currentTour.id + "/");
 
         // Refresh list of tours
-        await axios.get("http://127.0.0.1:8000/api/tours/")
-        .then((res) => setTours(res.data))
+        await getAllTours()
+        .then((allTours) => setTours(allTours))
         .catch((err) => console.log(err));
 
         // After deletion, default to tour `{}`